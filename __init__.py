@@ -1,34 +1,59 @@
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import timedelta
 from models import db
 from config import Config
 from utils import ensure_upload_folder
+from search import init_search
+from commands import register_commands
+from query_counter import init_query_counter
+from sessions import init_sessions
 
-def create_app(config_class=Config):
+def create_app(config_class=Config, test_config=None):
     """Application factory pattern"""
     app = Flask(__name__)
     app.config.from_object(config_class)
+    if test_config:
+        # Applied before the extensions bind to the database
+        app.config.update(test_config)
+    
+    # Take the client address and scheme from the proxies we trust
+    if app.config['PROXY_FIX_HOPS']:
+        hops = app.config['PROXY_FIX_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
     
     # Set session lifetime
     app.permanent_session_lifetime = timedelta(days=30)
     
     # Initialize extensions
     db.init_app(app)
+    init_query_counter(app)
+    init_sessions(app)
     
     # Ensure upload folder exists
-    ensure_upload_folder()
+    ensure_upload_folder(app.config['UPLOAD_FOLDER'])
     
     # Register blueprints
     from routes.auth import auth
     from routes.main import main
     from routes.calendar import calendar_bp
+    from routes.jobs import jobs_bp
+    from routes.uploads import uploads_bp
     
     app.register_blueprint(auth)
     app.register_blueprint(main)
     app.register_blueprint(calendar_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(uploads_bp)
+    
+    # Register CLI commands
+    register_commands(app)
     
     # Create database tables
     with app.app_context():
         db.create_all()
     
+    # Create the full-text search index and its sync triggers
+    init_search(app)
+    
     return app 
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+Username and email uniqueness for user accounts
+
+Both columns have unique indexes, which are what actually keep accounts
+apart. Registration and profile updates look both values up in one query
+first, so a taken name is reported before a password is hashed, and a
+request that loses a race to a concurrent one gets the same message from
+the IntegrityError of its write.
+"""
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from models import db, User
+
+USERNAME_TAKEN = 'Username already exists!'
+EMAIL_TAKEN = 'Email already registered!'
+
+
+class AccountConflict(ValueError):
+    """The username or email belongs to another account"""
+
+
+def check_available(username, email, user_id=None):
+    """Raise AccountConflict if an account other than user_id has the username or email"""
+    query = select(User.username).where(or_(User.username == username, User.email == email))
+    if user_id is not None:
+        query = query.where(User.id != user_id)
+    taken = db.session.scalars(query.limit(2)).all()
+    if username in taken:
+        raise AccountConflict(USERNAME_TAKEN)
+    if taken:
+        raise AccountConflict(EMAIL_TAKEN)
+
+
+def commit_account():
+    """Commit a new or changed user, turning a unique index violation into AccountConflict"""
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        # e.g. "UNIQUE constraint failed: user.email" or "... constraint "user_email_key""
+        raise AccountConflict(EMAIL_TAKEN if 'email' in str(e.orig).lower() else USERNAME_TAKEN) from e
@@ -0,0 +1,120 @@
+"""
+Task attachments
+
+A task can have any number of attachments, each holding one reference to a
+blob in the blob store. Full attachment lists are only loaded for a single
+task; listings call attachment_summaries, which fetches the count and the
+first image of a whole page of tasks in one grouped query.
+"""
+import os
+from collections import namedtuple
+from sqlalchemy import bindparam, case, func, inspect, select, text
+from models import db, Attachment, Blob
+import blobstore
+import filetypes
+
+# What a listing shows about a task's attachments
+AttachmentSummary = namedtuple('AttachmentSummary', 'count thumbnail_key')
+
+
+def _attach(task, stored):
+    attachment = Attachment(key=stored.key, size=stored.size, mime=stored.mime, sha256=stored.sha256)
+    task.attachments.append(attachment)
+    return attachment
+
+
+def attach_upload(task, file):
+    """Store a Werkzeug FileStorage and attach it to task; raises FileTypeMismatch"""
+    return _attach(task, blobstore.store_upload(file))
+
+
+def attach_file(task, staged_path, filename):
+    """Move a complete file on disk into the store and attach it to task"""
+    return _attach(task, blobstore.store_file(staged_path, filename))
+
+
+def remove_attachment(attachment):
+    """Detach a file, releasing its blob once the transaction commits"""
+    blobstore.release(attachment.key)
+    db.session.delete(attachment)
+
+
+def release_task_attachments(task):
+    """Release the blobs of all of a task's attachments before the task is deleted"""
+    release_attachments_of([task.id])
+
+
+def release_attachments_of(task_ids):
+    """Release the blobs attached to any of the given tasks, in a constant number of queries"""
+    keys = db.session.scalars(select(Attachment.key).where(Attachment.task_id.in_(task_ids))).all()
+    blobstore.release_many(keys)
+
+
+def attachment_summaries(task_ids):
+    """Map each task id with attachments to an AttachmentSummary, in one query"""
+    task_ids = list(task_ids)
+    if not task_ids:
+        return {}
+    first_image = func.min(case((Attachment.mime.like('image/%'), Attachment.id)))
+    grouped = select(
+        Attachment.task_id,
+        func.count(Attachment.id).label('count'),
+        first_image.label('thumbnail_id')
+    ).where(Attachment.task_id.in_(task_ids)).group_by(Attachment.task_id).subquery()
+    thumbnail = db.aliased(Attachment)
+    rows = db.session.execute(
+        select(grouped.c.task_id, grouped.c.count, thumbnail.key)
+        .outerjoin(thumbnail, thumbnail.id == grouped.c.thumbnail_id)
+    )
+    return {task_id: AttachmentSummary(count, key) for task_id, count, key in rows}
+
+
+def migrate_file_paths(batch_size=500):
+    """Move the single task.file_path of databases from before attachments into attachment rows.
+
+    Returns the number of attachments created. The column itself is left in
+    place (SQLite can't drop it everywhere) but emptied, so running this
+    again does nothing.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('task')}
+    if 'file_path' not in columns:
+        return 0
+
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(
+            'SELECT id, file_path FROM task WHERE id > :last_id AND file_path IS NOT NULL '
+            'ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': batch_size}).all()
+        if not rows:
+            return migrated
+
+        shas = {blobstore.blob_sha(key) for _, key in rows} - {None}
+        blobs = {blob.sha256: blob for blob in Blob.query.filter(Blob.sha256.in_(shas))} if shas else {}
+        mappings = []
+        for task_id, key in rows:
+            sha256 = blobstore.blob_sha(key)
+            blob = blobs.get(sha256)
+            if blob is not None:
+                size, mime = blob.size, blob.mime
+            else:
+                path = blobstore.key_path(key)
+                size = os.path.getsize(path) if path and os.path.isfile(path) else 0
+                mime = None
+            mappings.append({
+                'task_id': task_id,
+                'key': key,
+                'size': size,
+                'mime': mime or filetypes.guess_type(key),
+                'sha256': sha256,
+            })
+        # Each file_path already held one blob reference, which now belongs to its attachment
+        db.session.bulk_insert_mappings(Attachment, mappings)
+        db.session.execute(
+            text('UPDATE task SET file_path = NULL WHERE id IN :ids').bindparams(bindparam('ids', expanding=True)),
+            {'ids': [task_id for task_id, _ in rows]}
+        )
+        db.session.commit()
+        migrated += len(rows)
+        last_id = rows[-1][0]
@@ -0,0 +1,330 @@
+"""
+Content-addressed, deduplicated upload store
+
+Uploads are hashed with SHA-256 while they stream to a staging file under
+UPLOAD_FOLDER and are then handed to the configured storage backend (see
+storage.py) under their hash, so identical files are stored once however
+many tasks attach them. Each blob has a row in the blob table counting the
+attachments that reference it; the file is removed once the last reference
+is released and that change is committed.
+
+An attachment's key is "<sha256>_<original filename>". Keys from
+before the blob store ("<uuid>_<filename>") still point at files directly
+inside UPLOAD_FOLDER and keep working.
+"""
+import hashlib
+import importlib
+import mimetypes
+import os
+import re
+import tempfile
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import current_app, abort, redirect, send_file
+from sqlalchemy import event, select, update, delete
+from sqlalchemy.orm import Session
+from werkzeug.utils import secure_filename
+from models import db, Blob
+from storage import LocalStorage, get_storage
+import filetypes
+
+# Bytes read from an upload per hashing/writing step
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_SHA256_KEY = re.compile(r'^([0-9a-f]{64})_')
+
+# What storing a file produced: its key and what was learned reading it
+StoredFile = namedtuple('StoredFile', 'key sha256 size mime')
+
+# Functions mapping a stored name to the names of files derived from it
+# (such as thumbnails), which are removed along with it
+DERIVATIVES = []
+
+
+def derivative(f):
+    """Register a function(name) returning the derived file names of a stored file"""
+    DERIVATIVES.append(f)
+    return f
+
+
+def upload_folder():
+    """Root directory for staging files and legacy uploads"""
+    return current_app.config['UPLOAD_FOLDER']
+
+
+def blob_sha(key):
+    """The SHA-256 a key refers to, or None for a legacy key"""
+    match = _SHA256_KEY.match(key or '')
+    return match.group(1) if match else None
+
+
+def key_filename(key):
+    """Original filename part of a key"""
+    return key.split('_', 1)[1] if '_' in key else key
+
+
+def locate(key):
+    """The (storage backend, name) holding the file a key refers to"""
+    sha256 = blob_sha(key)
+    if sha256:
+        return get_storage(), sha256
+    # Legacy uploads live directly in UPLOAD_FOLDER
+    return LocalStorage(upload_folder()), key
+
+
+def blob_path(sha256):
+    """Local path of a blob, or None when blobs aren't kept on local disk"""
+    return get_storage().local_path(sha256)
+
+
+def key_path(key):
+    """Local path of the file a key refers to, or None when it isn't on local disk"""
+    backend, name = locate(key)
+    return backend.local_path(name)
+
+
+def staging_path():
+    """A new empty file under UPLOAD_FOLDER to assemble data in before storing it"""
+    tmp_dir = os.path.join(upload_folder(), 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=tmp_dir)
+    os.close(fd)
+    return path
+
+
+def send_upload(key, mimetype=None):
+    """Response serving a stored upload to a user already authorized to see it.
+
+    Pass the attachment's recorded mimetype; without it the type is guessed
+    from the filename.
+    """
+    backend, name = locate(key)
+    return send_stored(backend, name, key_filename(key), etag=blob_sha(key), mimetype=mimetype)
+
+
+def send_stored(backend, name, download_name, etag=None, mimetype=None):
+    """Response for a stored file.
+
+    Files on local disk are handed to nginx with X-Accel-Redirect when
+    UPLOAD_ACCEL_REDIRECT_PREFIX is set (or to Apache/lighttpd with Flask's
+    USE_X_SENDFILE), and otherwise sent from here with Range support and
+    conditional GET. Remote files are downloaded by the browser directly
+    from a presigned URL. Pass etag for content that never changes under
+    this name; it is used as a strong validator.
+    """
+    mimetype = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    path = backend.local_path(name)
+
+    if path is None:
+        if not backend.exists(name):
+            abort(404)
+        url = backend.url(name, current_app.config['PRESIGNED_URL_EXPIRES'], download_name, mimetype)
+        if url:
+            response = redirect(url)
+            # The URL expires, so it must not be reused from a cache
+            response.cache_control.no_store = True
+            return response
+        response = send_file(backend.open(name), mimetype=mimetype, download_name=download_name, etag=etag or False)
+    elif not os.path.isfile(path):
+        abort(404)
+    elif current_app.config.get('UPLOAD_ACCEL_REDIRECT_PREFIX'):
+        prefix = current_app.config['UPLOAD_ACCEL_REDIRECT_PREFIX']
+        relative = os.path.relpath(path, upload_folder()).replace(os.sep, '/')
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative)
+        response.headers['Content-Disposition'] = f'inline; filename="{download_name}"'
+        if etag:
+            response.set_etag(etag)
+    else:
+        response = send_file(path, mimetype=mimetype, download_name=download_name, conditional=True, etag=etag or True)
+
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['UPLOAD_CACHE_MAX_AGE']
+    return response
+
+
+def store_stream(stream, filename):
+    """Store the contents of a binary stream, returning a StoredFile.
+
+    The content is checked against the filename's type, hashed and written
+    in one pass; FileTypeMismatch is raised before anything is stored if it
+    doesn't match. The reference is added in the current transaction, so
+    it only sticks once the caller commits.
+    """
+    staged = staging_path()
+    digest = hashlib.sha256()
+    size = 0
+    mime = None
+    try:
+        with open(staged, 'wb') as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if mime is None:
+                    mime = filetypes.sniff(chunk, filename)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        _add_reference(sha256, size, mime)
+        _place(staged, sha256)
+    except BaseException:
+        if os.path.exists(staged):
+            os.remove(staged)
+        raise
+
+    return StoredFile(_key(sha256, filename), sha256, size, mime)
+
+
+def store_upload(file):
+    """Store a Werkzeug FileStorage, returning a StoredFile"""
+    return store_stream(file.stream, file.filename)
+
+
+def store_file(staged_path, filename):
+    """Move a complete file already on disk under UPLOAD_FOLDER into the store, returning a StoredFile"""
+    digest = hashlib.sha256()
+    size = 0
+    mime = None
+    with open(staged_path, 'rb') as f:
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            if mime is None:
+                mime = filetypes.sniff(chunk, filename)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+
+    sha256 = digest.hexdigest()
+    _add_reference(sha256, size, mime)
+    _place(staged_path, sha256)
+    return StoredFile(_key(sha256, filename), sha256, size, mime)
+
+
+def _place(staged_path, sha256):
+    # Called once the reference is added, which holds off a concurrent
+    # release of the same blob until this transaction ends
+    backend = get_storage()
+    if backend.touch(sha256):
+        # Already stored. Touching it keeps garbage collection, which spares
+        # recent files, off it until this upload's reference is committed.
+        # A release that committed just before the reference was added may
+        # still delete the file, so the staged copy is kept until commit
+        db.session.info.setdefault('blob_placements', []).append((backend, sha256, staged_path))
+    else:
+        backend.put_file(sha256, staged_path)
+
+
+def _key(sha256, filename):
+    return f'{sha256}_{secure_filename(filename) or "file"}'
+
+
+def _add_reference(sha256, size, mime):
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        # One round trip that either creates the blob row or bumps its count
+        # The engine has already loaded its own dialect; don't import the other one at startup
+        insert = importlib.import_module(f'sqlalchemy.dialects.{dialect}').insert
+        stmt = insert(Blob).values(
+            sha256=sha256, size=size, mime=mime, refcount=1, created_at=datetime.now(timezone.utc)
+        ).on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={'refcount': Blob.__table__.c.refcount + 1}
+        )
+        db.session.execute(stmt)
+        return
+
+    updated = db.session.execute(
+        update(Blob).where(Blob.sha256 == sha256).values(refcount=Blob.refcount + 1)
+    ).rowcount
+    if not updated:
+        db.session.add(Blob(sha256=sha256, size=size, mime=mime, refcount=1))
+        db.session.flush()
+
+
+def release(key):
+    """Drop one reference to a key; the file goes once nothing refers to it"""
+    if not key:
+        return
+    sha256 = blob_sha(key)
+    if sha256 is None:
+        # Legacy uploads belong to exactly one task
+        _remove_after_commit(*locate(key))
+        return
+
+    db.session.execute(
+        update(Blob).where(Blob.sha256 == sha256).values(refcount=Blob.refcount - 1)
+    )
+    removed = db.session.execute(
+        delete(Blob).where(Blob.sha256 == sha256, Blob.refcount <= 0)
+    ).rowcount
+    if removed:
+        _remove_after_commit(*locate(key))
+
+
+def release_many(keys):
+    """Drop one reference per key with a few set-based statements, however many keys there are"""
+    decrements = {}
+    for key in keys:
+        sha256 = blob_sha(key)
+        if sha256 is None:
+            if key:
+                _remove_after_commit(*locate(key))
+            continue
+        decrements[sha256] = decrements.get(sha256, 0) + 1
+    if not decrements:
+        return
+
+    # Usually every blob loses one reference, making this a single UPDATE
+    by_amount = {}
+    for sha256, amount in decrements.items():
+        by_amount.setdefault(amount, []).append(sha256)
+    for amount, shas in by_amount.items():
+        db.session.execute(
+            update(Blob).where(Blob.sha256.in_(shas)).values(refcount=Blob.refcount - amount)
+        )
+    unreferenced = db.session.scalars(
+        select(Blob.sha256).where(Blob.sha256.in_(decrements), Blob.refcount <= 0)
+    ).all()
+    if unreferenced:
+        db.session.execute(delete(Blob).where(Blob.sha256.in_(unreferenced)))
+        backend = get_storage()
+        for sha256 in unreferenced:
+            _remove_after_commit(backend, sha256)
+
+
+def _remove_after_commit(backend, name):
+    # Deleting straight away would lose the file if the transaction rolls back
+    names = [name]
+    for derived in DERIVATIVES:
+        names.extend(derived(name))
+    db.session.info.setdefault('blob_removals', []).append((backend, names))
+
+
+@event.listens_for(Session, 'after_commit')
+def _remove_released_files(session):
+    for backend, names in session.info.pop('blob_removals', ()):
+        for name in names:
+            backend.delete(name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _check_placed_files(session):
+    for backend, sha256, staged_path in session.info.pop('blob_placements', ()):
+        if backend.exists(sha256):
+            os.remove(staged_path)
+        else:
+            # Removed by a release that raced this upload; the new reference needs it back
+            backend.put_file(sha256, staged_path)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _keep_released_files(session, previous_transaction):
+    session.info.pop('blob_removals', None)
+    for backend, sha256, staged_path in session.info.pop('blob_placements', ()):
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
@@ -0,0 +1,103 @@
+"""
+Set-based changes to many tasks at once
+
+Each operation is a fixed number of UPDATE/DELETE statements scoped with
+"WHERE user_id = ? AND id IN (...)", so ids belonging to someone else are
+simply not matched. They bypass the ORM, so they set updated_at themselves
+(the Google sync relies on it) and callers invalidate the user's cached
+statistics after committing. Nothing is committed here: the caller commits
+once, so a request applies all of its changes or none.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import select, update, delete
+from models import db, Task, Category, Attachment, ChunkedUpload
+from stats import STATUSES, PRIORITIES
+import attachments
+
+
+class BulkError(ValueError):
+    """A bulk request that can't be applied as given"""
+
+
+def _task_id(value):
+    # int() would also take 1.5, True and " 7 "; only JSON integers and form digits are ids
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    raise BulkError('Task ids must be integers')
+
+
+def parse_task_ids(values, limit):
+    """The distinct integer task ids in values, raising BulkError if there are none or too many"""
+    ids = {_task_id(value) for value in values}
+    if not ids:
+        raise BulkError('No tasks selected')
+    if len(ids) > limit:
+        raise BulkError(f'At most {limit} tasks can be changed at once')
+    return sorted(ids)
+
+
+def validate_changes(user_id, status=None, priority=None, category_id=None):
+    """The column values for a bulk update, checked against what a task may hold.
+
+    Pass category_id='' to clear the category; None leaves it unchanged.
+    """
+    changes = {}
+    if status is not None:
+        if status not in STATUSES:
+            raise BulkError(f'Unknown status {status!r}')
+        changes['status'] = status
+    if priority is not None:
+        if priority not in PRIORITIES:
+            raise BulkError(f'Unknown priority {priority!r}')
+        changes['priority'] = priority
+    if category_id is not None:
+        if category_id == '':
+            changes['category_id'] = None
+        else:
+            owned = db.session.scalar(
+                select(Category.id).where(Category.id == category_id, Category.user_id == user_id)
+            ) if str(category_id).isdigit() else None
+            if owned is None:
+                raise BulkError('Category not found')
+            changes['category_id'] = owned
+    if not changes:
+        raise BulkError('Nothing to change')
+    return changes
+
+
+def bulk_update(user_id, task_ids, changes):
+    """Apply changes to the user's tasks among task_ids with one UPDATE, returning how many matched"""
+    changes = dict(changes, updated_at=datetime.now(timezone.utc))
+    result = db.session.execute(
+        update(Task)
+        .where(Task.user_id == user_id, Task.id.in_(task_ids))
+        .values(**changes)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def bulk_delete(user_id, task_ids):
+    """Delete the user's tasks among task_ids with their attachments, returning how many went.
+
+    Blob references are released in one batch; the files themselves are
+    removed once the transaction commits. Partial files of chunked uploads
+    to these tasks are left for gc-uploads.
+    """
+    owned = db.session.scalars(
+        select(Task.id).where(Task.user_id == user_id, Task.id.in_(task_ids))
+    ).all()
+    if not owned:
+        return 0
+
+    attachments.release_attachments_of(owned)
+    db.session.execute(delete(Attachment).where(Attachment.task_id.in_(owned)))
+    db.session.execute(delete(ChunkedUpload).where(ChunkedUpload.task_id.in_(owned)))
+    db.session.execute(
+        delete(Task)
+        .where(Task.user_id == user_id, Task.id.in_(owned))
+        .execution_options(synchronize_session=False)
+    )
+    return len(owned)
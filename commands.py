@@ -0,0 +1,234 @@
+"""
+Flask CLI commands for database maintenance
+"""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from models import db, User, Task, Category
+from jobs import JobWorker, enqueue, run_pending
+from upload_gc import collect_uploads
+from attachments import migrate_file_paths
+from task_import import ImportRowError, import_tasks
+from sessions import purge_expired_sessions
+from search import create_search_index
+import passwords
+
+
+def _sample_queries(user_id):
+    """Representative queries issued by the listing pages"""
+    return {
+        'dashboard listing': select(Task).where(Task.user_id == user_id)
+            .order_by(Task.created_at.desc(), Task.id.desc()).limit(20),
+        'status filter': select(Task).where(Task.user_id == user_id, Task.status == 'pending')
+            .order_by(Task.created_at.desc()).limit(20),
+        'due date window': select(Task).where(
+            Task.user_id == user_id,
+            Task.due_date >= '2024-01-01',
+            Task.due_date < '2024-02-01'
+        ),
+        'category by name': select(Category).where(
+            Category.user_id == user_id, Category.name == 'Homework'
+        ),
+    }
+
+
+def _explain(conn, statement):
+    """Return the database's query plan for statement as a list of lines"""
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'sqlite':
+        rows = conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+        return [row[-1] for row in rows]
+    return [row[0] for row in conn.execute(text(f'EXPLAIN {sql}')).fetchall()]
+
+
+def _print_plans(conn, heading, user_id):
+    click.echo(f'== {heading} ==')
+    for name, statement in _sample_queries(user_id).items():
+        click.echo(f'{name}:')
+        for line in _explain(conn, statement):
+            click.echo(f'    {line}')
+
+
+def _create_index(index, conn):
+    """Create index if missing, without blocking writes where the database allows it"""
+    if conn.dialect.name == 'postgresql':
+        # CREATE INDEX CONCURRENTLY keeps the table writable while the index builds
+        index.dialect_options['postgresql']['concurrently'] = True
+    index.create(bind=conn, checkfirst=True)
+
+
+@click.command('create-indexes')
+@with_appcontext
+def create_indexes_command():
+    """Build any missing Task/Category indexes and show query plans before and after."""
+    user_id = db.session.scalar(select(User.id).limit(1)) or 1
+    db.session.remove()
+
+    # Autocommit so each index is built and released on its own
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        _print_plans(conn, 'Query plans before', user_id)
+
+        for table in (Task.__table__, Category.__table__):
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                try:
+                    _create_index(index, conn)
+                    click.echo(f'Index {index.name} ready')
+                except (IntegrityError, OperationalError, ProgrammingError) as e:
+                    click.echo(f'Could not create index {index.name}: {e.orig}', err=True)
+
+        try:
+            if create_search_index(conn):
+                click.echo('Index ix_task_search_vector ready (restart the app to search with it)')
+        except (OperationalError, ProgrammingError) as e:
+            click.echo(f'Could not create the search index: {e.orig}', err=True)
+
+        _print_plans(conn, 'Query plans after', user_id)
+
+
+def _widen_statements(conn):
+    """ALTER statements for String columns the database holds narrower than the models declare"""
+    inspector = inspect(conn)
+    statements = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            length = getattr(column.type, 'length', None)
+            current = getattr(existing.get(column.name), 'length', None)
+            if length and current and current < length:
+                statements.append(
+                    f'ALTER TABLE "{table.name}" ALTER COLUMN "{column.name}" TYPE varchar({length})'
+                )
+    return statements
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Widen columns an existing database created by an older version holds too narrow."""
+    db.session.remove()
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'sqlite':
+            # SQLite doesn't enforce VARCHAR lengths, so there is nothing to widen
+            click.echo('Nothing to upgrade on SQLite')
+            return
+        statements = _widen_statements(conn)
+        for statement in statements:
+            conn.execute(text(statement))
+            click.echo(statement)
+    click.echo(f'Widened {len(statements)} columns')
+
+
+@click.command('run-jobs')
+@click.option('--threads', type=int, default=None, help='Worker threads (default JOB_WORKER_THREADS).')
+@click.option('--once', is_flag=True, help='Run the jobs that are due now, then exit.')
+@with_appcontext
+def run_jobs_command(threads, once):
+    """Process background jobs until interrupted."""
+    if once:
+        click.echo(f'Ran {run_pending()} jobs')
+        return
+
+    worker = JobWorker(current_app._get_current_object(), threads=threads)
+    worker.start()
+    click.echo(f'Job worker running with {worker.threads} threads')
+    try:
+        worker.stop_event.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+
+
+@click.command('gc-uploads')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed.')
+@click.option('--quarantine', is_flag=True, help='Move orphans to UPLOAD_FOLDER/quarantine instead of deleting them.')
+@click.option('--rate', type=float, default=None, help='Most files removed per second (default GC_DELETES_PER_SECOND).')
+@click.option('--background', is_flag=True, help='Queue the collection for the job worker instead of running it here.')
+@with_appcontext
+def gc_uploads_command(dry_run, quarantine, rate, background):
+    """Remove uploaded files that no task refers to any more."""
+    if background:
+        job = enqueue('gc_uploads', payload={'dry_run': dry_run, 'quarantine': quarantine})
+        click.echo(f'Queued job {job.id}')
+        return
+
+    stats = collect_uploads(dry_run=dry_run, quarantine=quarantine, rate=rate)
+    verb = 'Would remove' if dry_run else 'Removed'
+    click.echo(f"Scanned {stats['scanned']} files, found {stats['orphans']} orphans")
+    click.echo(f"{verb} {stats['orphans'] if dry_run else stats['removed']} files, "
+               f"{stats['refcounts_fixed']} reference counts out of date")
+
+
+@click.command('migrate-attachments')
+@with_appcontext
+def migrate_attachments_command():
+    """Move single task file_path values from older databases into attachments."""
+    db.create_all()
+    click.echo(f'Migrated {migrate_file_paths()} attachments')
+
+
+@click.command('import-tasks')
+@click.option('--user', 'username', required=True, help='Username the tasks are created for.')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def import_tasks_command(username, path):
+    """Import tasks from a CSV or .ics file."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username!r}')
+    try:
+        with open(path, 'rb') as stream:
+            report = import_tasks(user.id, stream, path)
+    except ImportRowError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Imported {report['imported']} tasks, created {report['categories_created']} categories")
+    for error in report['errors']:
+        click.echo(f"Line {error['line']}: {error['error']}" if error['line'] else error['error'], err=True)
+    if report['error_count'] > len(report['errors']):
+        click.echo(f"... and {report['error_count'] - len(report['errors'])} more errors", err=True)
+
+
+@click.command('purge-sessions')
+@with_appcontext
+def purge_sessions_command():
+    """Delete expired server-side sessions."""
+    click.echo(f'Removed {purge_expired_sessions()} expired sessions')
+
+
+@click.command('benchmark-passwords')
+@click.option('--method', default=None, help='Hash method to measure (default PASSWORD_HASH_METHOD).')
+@click.option('--seconds', type=float, default=2.0, help='How long to measure each way.')
+@click.option('--workers', type=int, default=None, help='Pool processes (default one per CPU).')
+@with_appcontext
+def benchmark_passwords_command(method, seconds, workers):
+    """Report password hashes per second, per core, for sizing PASSWORD_HASH_WORKERS."""
+    result = passwords.benchmark(method or current_app.config['PASSWORD_HASH_METHOD'], seconds, workers)
+    click.echo(f"Method {result['method']}")
+    click.echo(f"One process: {result['single']:.1f} hashes/s")
+    click.echo(f"{result['workers']} processes: {result['pool']:.1f} hashes/s, "
+               f"{result['per_core']:.1f} hashes/s per core")
+
+
+def register_commands(app):
+    """Attach the maintenance commands to the app's CLI"""
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(run_jobs_command)
+    app.cli.add_command(gc_uploads_command)
+    app.cli.add_command(migrate_attachments_command)
+    app.cli.add_command(import_tasks_command)
+    app.cli.add_command(purge_sessions_command)
+    app.cli.add_command(benchmark_passwords_command)
+
+
+if __name__ == '__main__':
+    # `flask --app` can't import this project because its root is itself a
+    # package, so the commands are also runnable as `python commands.py ...`
+    from flask.cli import FlaskGroup
+    from __init__ import create_app
+
+    FlaskGroup(create_app=create_app)()
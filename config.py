@@ -10,12 +10,110 @@ class Config:
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     
+    # Chunked, resumable uploads for files larger than MAX_CONTENT_LENGTH
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # largest chunk accepted per request
+    MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
+    UPLOAD_SESSION_TTL = 24 * 3600  # seconds an idle upload can be resumed
+    
+    # Where uploaded files are stored: 'local', 'sharded' or 's3' (any S3-compatible
+    # service such as MinIO; needs boto3 and the usual AWS_* credential variables)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sharded')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', 'uploads/')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+    S3_REGION = os.environ.get('S3_REGION')
+    # Callable building the S3 client from the app config (None uses boto3)
+    S3_CLIENT_FACTORY = None
+    PRESIGNED_URL_EXPIRES = 300  # seconds a direct download link stays valid
+    
+    # Serving uploads: set to nginx's internal location (e.g. '/_protected_uploads/')
+    # to hand transfers off with X-Accel-Redirect, or set USE_X_SENDFILE = True
+    # for Apache/lighttpd. Otherwise files are sent by the app itself.
+    UPLOAD_ACCEL_REDIRECT_PREFIX = None
+    UPLOAD_CACHE_MAX_AGE = 3600
+    
+    # Image attachment thumbnails (needs Pillow)
+    THUMBNAIL_SIZES = (80, 320)  # longest edge in pixels
+    THUMBNAIL_QUALITY = 80  # WebP quality
+    THUMBNAIL_WORKERS = 2  # processes rendering thumbnails (0 renders in the request)
+    THUMBNAIL_TIMEOUT = 10  # seconds a request waits for a missing thumbnail
+    
+    # Garbage collection of orphaned upload files (python commands.py gc-uploads)
+    GC_MIN_AGE = 3600  # seconds before an unreferenced file counts as orphaned
+    GC_BATCH_SIZE = 500  # stored names checked against the database per query
+    GC_DELETES_PER_SECOND = 50  # 0 for no limit
+    
+    # Task listing pagination
+    TASKS_PER_PAGE = 20
+    MAX_TASKS_PER_PAGE = 100
+    
+    # Most tasks one bulk update or delete request may touch
+    BULK_MAX_TASKS = 500
+    
+    # Importing tasks from CSV/ICS files
+    IMPORT_BATCH_SIZE = 500  # rows per INSERT
+    IMPORT_MAX_ROWS = 5000  # rows read from one file
+    IMPORT_MAX_ERRORS = 100  # row errors listed in the report
+    
+    # How task listings load each task's category: 'joined', 'selectin' or 'lazy'
+    TASK_CATEGORY_LOADING = 'joined'
+    
+    # Background jobs
+    EXPORT_FOLDER = 'exports'
+    JOB_MAX_ATTEMPTS = 5
+    JOB_BACKOFF_BASE = 30  # seconds before the first retry, doubled after each failure
+    JOB_BACKOFF_MAX = 3600
+    JOB_LEASE_SECONDS = 600  # a running job whose worker disappeared is retried after this
+    JOB_WORKER_THREADS = 4
+    JOB_POLL_INTERVAL = 1.0
+    
+    # Where session data lives: 'database' keeps it server-side behind a random
+    # token cookie, 'cookie' uses Flask's signed cookie sessions
+    SESSION_BACKEND = 'database'
+    SESSION_TOUCH_INTERVAL = 3600  # seconds between expiry refreshes of an unchanged session
+    # Seconds to cache the logged-in user across requests (0 loads it every
+    # request). A cached user can be that many seconds behind changes made by
+    # other processes, so only turn it on where that is acceptable
+    USER_CACHE_TTL = 0
+    
+    # Password hashing: a Werkzeug method with its cost ('scrypt:N:r:p' or
+    # 'pbkdf2:sha256:iterations'); older hashes are upgraded on login
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    PASSWORD_HASH_WORKERS = 2  # processes hashing passwords (0 hashes in the request)
+    PASSWORD_HASH_MAX_PENDING = 8  # hashes queued or running per web process
+    PASSWORD_HASH_QUEUE_TIMEOUT = 1  # seconds to wait for a free slot before answering 503
+    PASSWORD_HASH_TIMEOUT = 10  # seconds one hash may take in the pool
+    PASSWORD_HASH_RETRY_AFTER = 5  # Retry-After seconds sent with the 503
+    
+    # Login throttling: attempts allowed per sliding window, per username and
+    # per client IP (0 disables either). 'memory' counts in each process,
+    # 'database' shares the counts between workers
+    LOGIN_THROTTLE_BACKEND = 'memory'
+    LOGIN_THROTTLE_WINDOW = 300  # seconds
+    LOGIN_THROTTLE_PER_USERNAME = 10
+    LOGIN_THROTTLE_PER_IP = 100
+    LOGIN_THROTTLE_MAX_KEYS = 100000  # keys the memory backend remembers
+    
+    # Reverse proxies in front of the app whose X-Forwarded-For and
+    # X-Forwarded-Proto are trusted (0 uses the connecting address as is)
+    PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 0))
+    
+    # Seconds to cache per-user task statistics (0 disables caching). Writes
+    # only drop the cache of the process that made them, so with several
+    # workers the others can show counts that many seconds old
+    STATS_CACHE_TTL = 0
+    
+    # Report the number of SQL statements per request in an X-Query-Count header
+    QUERY_COUNT_HEADER = False
+    
     # Google Calendar settings
     GOOGLE_CLIENT_SECRETS_FILE = 'credentials.json'
     GOOGLE_SCOPES = ['https://www.googleapis.com/auth/calendar.events']
+    # Callable building the Calendar API client from stored credentials (None uses the real API)
+    GOOGLE_CALENDAR_SERVICE_FACTORY = None
     
     # Allowed file extensions
     ALLOWED_EXTENSIONS = {
         'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx',
-        'xls', 'xlsx', 'ppt', 'pptx'
+        'xls', 'xlsx', 'ppt', 'pptx', 'mp3', 'm4a', 'mp4', 'webm'
     } 
\ No newline at end of file
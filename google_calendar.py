@@ -0,0 +1,167 @@
+"""
+Incremental Google Calendar sync
+
+Each synced task is linked to the Google event created for it, and every
+user has a watermark recording when their last successful sync started.
+A sync therefore only sends inserts for dated tasks without an event,
+updates for linked tasks changed since the watermark, and deletes for
+events whose task was deleted or lost its due date. All calls are grouped
+into Google batch requests.
+"""
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import and_, or_
+from models import db, Task, GoogleEventLink, GoogleSyncState
+from jobs import job_handler, renew_lease
+
+# Google accepts up to 1000 calls per batch but recommends staying far below
+GOOGLE_BATCH_SIZE = 50
+
+
+def build_calendar_service(creds_data):
+    """Build a Google Calendar API client from stored OAuth credentials"""
+    # Imported here so workers that never sync don't pay for the Google client libraries
+    from googleapiclient.discovery import build
+    from google.oauth2.credentials import Credentials
+    creds = Credentials(
+        creds_data['token'],
+        refresh_token=creds_data.get('refresh_token'),
+        token_uri=creds_data['token_uri'],
+        client_id=creds_data['client_id'],
+        client_secret=creds_data['client_secret'],
+        scopes=creds_data['scopes']
+    )
+    return build('calendar', 'v3', credentials=creds)
+
+
+def calendar_service(creds_data):
+    """Return the Calendar client, letting GOOGLE_CALENDAR_SERVICE_FACTORY stand in for Google"""
+    factory = current_app.config.get('GOOGLE_CALENDAR_SERVICE_FACTORY') or build_calendar_service
+    return factory(creds_data)
+
+
+def task_event_body(task):
+    """Google Calendar event resource for a task"""
+    day = task.due_date.strftime('%Y-%m-%d')
+    next_day = (task.due_date + timedelta(days=1)).strftime('%Y-%m-%d')
+    return {
+        'summary': task.title,
+        'description': task.description or '',
+        'start': {'date': day},
+        # All-day event end dates are exclusive
+        'end': {'date': next_day},
+    }
+
+
+def _is_gone(exception):
+    """Whether a Google API error means the event no longer exists"""
+    status = getattr(getattr(exception, 'resp', None), 'status', None)
+    return status in (404, 410)
+
+
+def _execute_batched(service, calls, heartbeat=None):
+    """Run (request_id, request) pairs in batches, returning {request_id: (response, exception)}"""
+    results = {}
+
+    def collect(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    for start in range(0, len(calls), GOOGLE_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        for request_id, request in calls[start:start + GOOGLE_BATCH_SIZE]:
+            batch.add(request, request_id=request_id)
+        batch.execute()
+        if heartbeat is not None:
+            heartbeat()
+    return results
+
+
+def sync_tasks(user_id, service, calendar_id='primary', heartbeat=None):
+    """Push the user's task changes since the last sync to Google Calendar.
+
+    heartbeat, if given, is called after each batch request. Returns a dict
+    counting created, updated, deleted and failed events.
+    """
+    started = datetime.now(timezone.utc)
+    state = db.session.get(GoogleSyncState, user_id)
+    watermark = state.synced_at if state else None
+    events = service.events()
+
+    link_join = and_(GoogleEventLink.user_id == user_id, GoogleEventLink.task_id == Task.id)
+    dated = Task.query.filter(Task.user_id == user_id, Task.due_date.isnot(None))
+
+    new_tasks = dated.outerjoin(GoogleEventLink, link_join).filter(GoogleEventLink.id.is_(None)).all()
+    changed = dated.join(GoogleEventLink, link_join).add_entity(GoogleEventLink)
+    if watermark:
+        changed = changed.filter(Task.updated_at > watermark)
+    changed = changed.all()
+    # A link whose task id now belongs to another user is as stale as one whose task is gone
+    stale_links = GoogleEventLink.query.filter(GoogleEventLink.user_id == user_id).outerjoin(
+        Task, and_(GoogleEventLink.task_id == Task.id, Task.user_id == user_id)
+    ).filter(or_(Task.id.is_(None), Task.due_date.is_(None))).all()
+
+    calls = []
+    for task in new_tasks:
+        calls.append((f'insert-{task.id}', events.insert(calendarId=calendar_id, body=task_event_body(task))))
+    for task, link in changed:
+        calls.append((f'update-{link.id}', events.update(
+            calendarId=calendar_id, eventId=link.event_id, body=task_event_body(task)
+        )))
+    for link in stale_links:
+        calls.append((f'delete-{link.id}', events.delete(calendarId=calendar_id, eventId=link.event_id)))
+
+    results = _execute_batched(service, calls, heartbeat) if calls else {}
+    counts = {'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+
+    for task in new_tasks:
+        response, exception = results[f'insert-{task.id}']
+        if exception is not None:
+            counts['failed'] += 1
+            continue
+        db.session.add(GoogleEventLink(user_id=user_id, task_id=task.id, event_id=response['id'], synced_at=started))
+        counts['created'] += 1
+
+    for task, link in changed:
+        response, exception = results[f'update-{link.id}']
+        if exception is None:
+            link.synced_at = started
+            counts['updated'] += 1
+        elif _is_gone(exception):
+            # Deleted on the Google side: forget it so the next sync re-creates it
+            db.session.delete(link)
+            counts['failed'] += 1
+        else:
+            counts['failed'] += 1
+
+    for link in stale_links:
+        response, exception = results[f'delete-{link.id}']
+        if exception is None or _is_gone(exception):
+            db.session.delete(link)
+            counts['deleted'] += 1
+        else:
+            counts['failed'] += 1
+
+    # Only move the watermark forward once every change has reached Google
+    if counts['failed'] == 0:
+        if state is None:
+            state = GoogleSyncState(user_id=user_id)
+            db.session.add(state)
+        state.synced_at = started
+    db.session.commit()
+    return counts
+
+
+@job_handler('google_sync')
+def google_sync_job(job, payload):
+    """Background job running sync_tasks with the credentials captured at enqueue time"""
+    job_id, attempt = job.id, job.attempts
+
+    def heartbeat():
+        # A large first sync can outlast JOB_LEASE_SECONDS
+        renew_lease(job_id, attempt)
+
+    counts = sync_tasks(job.user_id, calendar_service(payload['credentials']), heartbeat=heartbeat)
+    if counts['failed']:
+        # Everything that did succeed is committed; the retry only resends the rest
+        raise RuntimeError(f"{counts['failed']} Google Calendar calls failed")
+    return counts
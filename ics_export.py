@@ -0,0 +1,88 @@
+"""
+iCalendar export of a user's dated tasks
+
+The export is generated one VEVENT at a time so it can be streamed straight
+to the client, or written to disk by the ics_export background job.
+"""
+import os
+from datetime import datetime
+from flask import current_app
+from models import Task
+from jobs import job_handler
+
+# Rows fetched from the database per round trip while generating an export
+ICS_EXPORT_BATCH_SIZE = 500
+
+
+def parse_range_param(value):
+    """Parse a FullCalendar start/end parameter into a naive datetime"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    # Due dates are stored as naive calendar dates, so compare wall-clock times
+    return parsed.replace(tzinfo=None)
+
+
+def dated_tasks_query(user_id, start, end, category_id=None):
+    """Query the user's dated tasks falling inside [start, end)"""
+    query = Task.query.filter(Task.user_id == user_id, Task.due_date.isnot(None))
+    if start:
+        query = query.filter(Task.due_date >= start)
+    if end:
+        query = query.filter(Task.due_date < end)
+    if category_id:
+        query = query.filter(Task.category_id == category_id)
+    return query
+
+
+def ics_stream(query):
+    """Yield an iCalendar document one VEVENT at a time"""
+    from icalendar import Calendar, Event
+    cal = Calendar()
+    cal.add('prodid', '-//Student Study Planner//')
+    cal.add('version', '2.0')
+    footer = b'END:VCALENDAR\r\n'
+    yield cal.to_ical()[:-len(footer)]
+
+    rows = query.with_entities(
+        Task.id, Task.title, Task.description, Task.due_date, Task.priority
+    ).order_by(Task.due_date, Task.id).yield_per(ICS_EXPORT_BATCH_SIZE)
+    for task in rows:
+        event = Event()
+        event.add('uid', f'task-{task.id}@student-study-planner')
+        event.add('summary', task.title)
+        event.add('dtstart', task.due_date.date())
+        event.add('dtend', task.due_date.date())
+        event.add('description', task.description or '')
+        event.add('priority', {'High': 1, 'Medium': 5, 'Low': 9}.get(task.priority, 5))
+        yield event.to_ical()
+
+    yield footer
+
+
+def export_path(job_id):
+    """Where the ics_export job writes its file"""
+    return os.path.abspath(os.path.join(current_app.config['EXPORT_FOLDER'], f'{job_id}.ics'))
+
+
+@job_handler('ics_export')
+def export_ics_job(job, payload):
+    """Write the user's export to EXPORT_FOLDER, returning the number of events"""
+    query = dated_tasks_query(
+        job.user_id,
+        parse_range_param(payload.get('start')),
+        parse_range_param(payload.get('end')),
+        payload.get('category')
+    )
+    path = export_path(job.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    events = 0
+    with open(path + '.part', 'wb') as f:
+        for chunk in ics_stream(query):
+            f.write(chunk)
+            events += chunk.startswith(b'BEGIN:VEVENT')
+    os.replace(path + '.part', path)
+    return {'events': events}
@@ -0,0 +1,227 @@
+"""
+Persistent background job queue
+
+Jobs are rows in the job table, so they survive restarts and can be
+processed by any number of worker threads or processes. A worker claims a
+due job with a conditional UPDATE, which gives it a lease of
+JOB_LEASE_SECONDS; if the worker dies the lease expires and another worker
+picks the job up. Failed jobs are retried with exponential backoff until
+max_attempts is reached; a job whose lease expires on its last attempt is
+failed instead. Long jobs call renew_lease as they make progress so their
+lease doesn't run out while they are still working.
+"""
+import json
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import update
+from models import db, Job
+
+JOB_HANDLERS = {}
+
+
+class LeaseLost(Exception):
+    """Raised in a job whose lease expired and was taken over by another worker"""
+
+
+def job_handler(kind):
+    """Register a function(job, payload) as the handler for a job kind"""
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return decorator
+
+
+def _now():
+    # Stored datetimes are naive UTC, so compare against the same
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def enqueue(kind, user_id=None, payload=None, max_attempts=None):
+    """Queue a job and commit it, returning the Job"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'No handler registered for job kind {kind!r}')
+    job = Job(
+        kind=kind,
+        user_id=user_id,
+        payload=json.dumps(payload or {}),
+        max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+        run_after=_now()
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def active_job(kind, user_id):
+    """The user's queued or running job of this kind, or None"""
+    return Job.query.filter(
+        Job.kind == kind,
+        Job.user_id == user_id,
+        Job.status.in_(('queued', 'running'))
+    ).order_by(Job.id).first()
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retrying a job that has failed attempts times"""
+    base = current_app.config['JOB_BACKOFF_BASE']
+    return min(base * 2 ** (attempts - 1), current_app.config['JOB_BACKOFF_MAX'])
+
+
+def claim_next_job(now=None):
+    """Atomically take the oldest due job, returning it or None"""
+    now = now or _now()
+    lease = now + timedelta(seconds=current_app.config['JOB_LEASE_SECONDS'])
+    candidates = Job.query.filter(
+        Job.status.in_(('queued', 'running')),
+        Job.run_after <= now
+    ).order_by(Job.run_after, Job.id).limit(5).all()
+
+    for job in candidates:
+        if job.status == 'running' and job.attempts >= job.max_attempts:
+            # Its worker died during the last attempt: fail it rather than retry
+            Job.query.filter_by(id=job.id, status='running', run_after=job.run_after).update({
+                'status': 'failed',
+                'error': 'Lease expired during the last attempt',
+                'payload': _scrub(json.loads(job.payload or '{}')),
+                'updated_at': now,
+            }, synchronize_session=False)
+            db.session.commit()
+            continue
+        # Only one worker can move the job away from the state it read
+        claimed = Job.query.filter_by(id=job.id, status=job.status, run_after=job.run_after).update({
+            'status': 'running',
+            'run_after': lease,
+            'attempts': Job.attempts + 1,
+            'updated_at': now,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            db.session.refresh(job)
+            return job
+    return None
+
+
+def renew_lease(job_id, attempt, now=None):
+    """Extend the lease of a running job, raising LeaseLost if it is gone.
+
+    attempt is the job's attempts count when it was claimed; once the lease
+    expired and another worker reclaimed the job the count has moved on, so
+    the stale worker can tell it should stop.
+    """
+    now = now or _now()
+    # Its own transaction, so the job's work in progress isn't committed or expired
+    with db.engine.begin() as conn:
+        renewed = conn.execute(update(Job).where(
+            Job.id == job_id,
+            Job.status == 'running',
+            Job.attempts == attempt
+        ).values(
+            run_after=now + timedelta(seconds=current_app.config['JOB_LEASE_SECONDS']),
+            updated_at=now
+        )).rowcount
+    if not renewed:
+        raise LeaseLost(f'Job {job_id} is no longer leased to this worker')
+
+
+def run_job(job):
+    """Run a claimed job's handler and record the outcome"""
+    handler = JOB_HANDLERS.get(job.kind)
+    payload = json.loads(job.payload or '{}')
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job kind {job.kind!r}')
+        result = handler(job, payload)
+    except LeaseLost:
+        # The job now belongs to the worker that reclaimed it
+        db.session.rollback()
+        return db.session.get(Job, job.id)
+    except Exception:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.error = traceback.format_exc(limit=5)
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.payload = _scrub(payload)
+        else:
+            job.status = 'queued'
+            job.run_after = _now() + timedelta(seconds=backoff_delay(job.attempts))
+        db.session.commit()
+        return job
+
+    job.status = 'succeeded'
+    job.result = json.dumps(result)
+    job.error = None
+    job.payload = _scrub(payload)
+    db.session.commit()
+    return job
+
+
+def _scrub(payload):
+    """Drop secrets from a payload once the job no longer needs them"""
+    payload.pop('credentials', None)
+    return json.dumps(payload)
+
+
+def run_pending(limit=None):
+    """Run due jobs in the current app context until none are left; returns how many ran"""
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+class JobWorker:
+    """Pool of threads that poll the job table and run due jobs"""
+
+    def __init__(self, app, threads=None, poll_interval=None):
+        self.app = app
+        self.threads = threads or app.config['JOB_WORKER_THREADS']
+        self.poll_interval = poll_interval or app.config['JOB_POLL_INTERVAL']
+        self.stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._loop, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            # A fresh app context per job gives each one a clean session
+            with self.app.app_context():
+                try:
+                    job = claim_next_job()
+                    if job is not None:
+                        run_job(job)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Job worker error')
+                    job = None
+            if job is None:
+                self.stop_event.wait(self.poll_interval)
+
+
+def job_to_dict(job):
+    """Public view of a job for status polling"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error.strip().splitlines()[-1] if job.error else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+    }
@@ -0,0 +1,180 @@
+"""
+Login throttling
+
+Failed login attempts are counted per username and per client IP with a sliding
+window counter: the count of the current fixed window plus the previous
+window's count weighted by how much of it still overlaps the sliding
+window. That needs two integers per key instead of a timestamp per attempt.
+
+The check runs before the user is looked up or any password is hashed, so
+a credential-stuffing bot that is over its limit costs one dictionary
+lookup. Counts live in process memory by default; with
+LOGIN_THROTTLE_BACKEND = 'database' they are kept in a table shared by all
+workers. Only failed logins are counted, and a successful login clears the
+username's count. Behind a reverse proxy set PROXY_FIX_HOPS so the IP is
+the client's rather than the proxy's.
+"""
+import math
+import threading
+import time
+from flask import current_app
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, LoginWindow
+
+
+class MemoryBackend:
+    """Window counts in this process, bounded to max_keys keys"""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._windows = {}  # key -> [window_start, count, previous_count]
+        self._lock = threading.Lock()
+
+    def _current(self, key, window_start, window):
+        entry = self._windows.get(key)
+        if entry is None or entry[0] < window_start - window:
+            return [window_start, 0, 0]
+        if entry[0] < window_start:
+            return [window_start, 0, entry[1]]
+        return entry
+
+    def counts(self, key, window_start, window):
+        """(current, previous) window counts of key"""
+        with self._lock:
+            _, count, previous = self._current(key, window_start, window)
+        return count, previous
+
+    def add(self, key, window_start, window):
+        with self._lock:
+            entry = self._current(key, window_start, window)
+            entry[1] += 1
+            self._windows[key] = entry
+            if len(self._windows) > self.max_keys:
+                self._prune(window_start, window)
+
+    def reset(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def _prune(self, window_start, window):
+        expired = [key for key, entry in self._windows.items() if entry[0] < window_start - window]
+        for key in expired:
+            del self._windows[key]
+        # Still full under attack: forget the keys that were quiet longest
+        excess = len(self._windows) - self.max_keys
+        if excess > 0:
+            for key in sorted(self._windows, key=lambda key: self._windows[key][0])[:excess]:
+                del self._windows[key]
+
+
+class DatabaseBackend:
+    """Window counts in the login_window table, shared between workers"""
+
+    @staticmethod
+    def _execute(statements):
+        # Its own connection, so throttling never touches the request's session
+        with db.engine.begin() as conn:
+            return [conn.execute(statement) for statement in statements]
+
+    def counts(self, key, window_start, window):
+        [result] = self._execute([
+            select(LoginWindow.window_start, LoginWindow.count)
+            .where(LoginWindow.key == key, LoginWindow.window_start >= window_start - window)
+        ])
+        counts = dict(result.all())
+        return counts.get(window_start, 0), counts.get(window_start - window, 0)
+
+    def add(self, key, window_start, window):
+        increment = (
+            update(LoginWindow)
+            .where(LoginWindow.key == key, LoginWindow.window_start == window_start)
+            .values(count=LoginWindow.count + 1)
+        )
+        results = self._execute([
+            increment,
+            delete(LoginWindow).where(LoginWindow.window_start < window_start - window),
+        ])
+        if results[0].rowcount:
+            return
+        try:
+            self._execute([LoginWindow.__table__.insert().values(key=key, window_start=window_start, count=1)])
+        except IntegrityError:
+            # Another worker opened the window first
+            self._execute([increment])
+
+    def reset(self, key):
+        self._execute([delete(LoginWindow).where(LoginWindow.key == key)])
+
+
+def _backend():
+    backends = current_app.extensions.setdefault('login_throttle', {})
+    name = current_app.config['LOGIN_THROTTLE_BACKEND']
+    if name not in backends:
+        if name == 'database':
+            backends[name] = DatabaseBackend()
+        else:
+            backends[name] = MemoryBackend(current_app.config['LOGIN_THROTTLE_MAX_KEYS'])
+    return backends[name]
+
+
+def _retry_after(count, previous, limit, elapsed, window):
+    """Seconds until the weighted count drops below limit"""
+    if count >= limit:
+        return window - elapsed
+    # previous * (1 - (elapsed + wait) / window) + count < limit
+    return max(1, window * (1 - (limit - count) / previous) - elapsed + 1)
+
+
+def _keys(username, ip):
+    config = current_app.config
+    keys = [(f'ip:{ip}', config['LOGIN_THROTTLE_PER_IP'])]
+    if username:
+        keys.append((f'user:{username.strip().lower()}', config['LOGIN_THROTTLE_PER_USERNAME']))
+    return [(key, limit) for key, limit in keys if limit]
+
+
+def _window(now):
+    window = current_app.config['LOGIN_THROTTLE_WINDOW']
+    now = time.time() if now is None else now
+    window_start = int(now // window * window)
+    return window, window_start, now - window_start
+
+
+def check_login(username, ip, now=None):
+    """Return the seconds to wait if the username or IP is over its limit of failed logins, else 0"""
+    keys = _keys(username, ip)
+    if not keys:
+        return 0
+    window, window_start, elapsed = _window(now)
+    backend = _backend()
+
+    wait = 0
+    for key, limit in keys:
+        count, previous = backend.counts(key, window_start, window)
+        if previous * (1 - elapsed / window) + count >= limit:
+            wait = max(wait, _retry_after(count, previous, limit, elapsed, window))
+    return math.ceil(wait)
+
+
+def record_failed_login(username, ip, now=None):
+    """Count a failed login against the username and the IP.
+
+    Only attempts that got as far as a password check are counted: refused
+    ones aren't, so a client that backs off gets back in once the window
+    slides past its earlier failures, and successful logins never are, so
+    many users behind one address don't lock each other out.
+    """
+    keys = _keys(username, ip)
+    if not keys:
+        return
+    window, window_start, _ = _window(now)
+    backend = _backend()
+    for key, _ in keys:
+        backend.add(key, window_start, window)
+
+
+def reset_login(username):
+    """Forget a username's failed attempts after it logged in"""
+    if username:
+        _backend().reset(f'user:{username.strip().lower()}')
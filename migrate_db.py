@@ -59,6 +59,15 @@ def migrate_database():
             else:
                 print("category_id column already exists!")
             
+            # Blobs record the MIME type sniffed from their content
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='blob'")
+            if cursor.fetchone() is not None:
+                cursor.execute("PRAGMA table_info(blob)")
+                if 'mime' not in [column[1] for column in cursor.fetchall()]:
+                    print("Adding mime column to blob table...")
+                    cursor.execute("ALTER TABLE blob ADD COLUMN mime VARCHAR(100)")
+                    print("mime column added successfully!")
+            
             # Commit changes
             conn.commit()
             print("Database migration completed successfully!")
@@ -7,15 +7,23 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)  # scrypt hashes are 162 characters
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     tasks = db.relationship('Task', backref='user', lazy=True, cascade='all, delete-orphan')
     categories = db.relationship('Category', backref='user', lazy=True, cascade='all, delete-orphan')
+    google_event_links = db.relationship('GoogleEventLink', lazy=True, cascade='all, delete-orphan')
+    google_sync_state = db.relationship('GoogleSyncState', lazy=True, uselist=False, cascade='all, delete-orphan')
+    jobs = db.relationship('Job', lazy=True, cascade='all, delete-orphan')
+    chunked_uploads = db.relationship('ChunkedUpload', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<User {self.username}>'
 
 class Category(db.Model):
+    __table_args__ = (
+        db.Index('uq_category_user_name', 'user_id', 'name', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
     color = db.Column(db.String(7), default='#007bff')  # Hex color code
@@ -28,17 +36,173 @@ class Category(db.Model):
         return f'<Category {self.name}>'
 
 class Task(db.Model):
+    # Every listing filters on user_id first, so it leads each composite index
+    __table_args__ = (
+        db.Index('ix_task_user_created', 'user_id', 'created_at'),
+        db.Index('ix_task_user_status', 'user_id', 'status'),
+        db.Index('ix_task_user_priority', 'user_id', 'priority'),
+        db.Index('ix_task_user_due_date', 'user_id', 'due_date'),
+        db.Index('ix_task_category_id', 'category_id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     due_date = db.Column(db.DateTime)
     status = db.Column(db.String(20), default='pending')  # pending, in_progress, completed
-    file_path = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     priority = db.Column(db.String(10), default='Medium')  # High, Medium, Low
+    chunked_uploads = db.relationship('ChunkedUpload', lazy=True, cascade='all, delete-orphan')
+    # Loaded only when a single task's files are shown; listings use attachment_summaries
+    attachments = db.relationship('Attachment', backref='task', lazy='select', cascade='all, delete-orphan',
+                                  order_by='Attachment.id')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'description': self.description,
+            'due_date': self.due_date.isoformat() if self.due_date else None,
+            'status': self.status,
+            'priority': self.priority,
+            'category_id': self.category_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+    
+    def __repr__(self):
+        return f'<Task {self.title}>' 
+class GoogleEventLink(db.Model):
+    # task_id is deliberately not a foreign key: the link has to outlive a
+    # deleted task so the next sync knows which Google event to remove
+    __table_args__ = (
+        db.Index('uq_google_event_link_user_task', 'user_id', 'task_id', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    task_id = db.Column(db.Integer, nullable=False)
+    event_id = db.Column(db.String(1024), nullable=False)
+    synced_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<GoogleEventLink task={self.task_id} event={self.event_id}>'
+
+class GoogleSyncState(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    synced_at = db.Column(db.DateTime)  # Watermark: tasks updated after this are re-sent
+    
+    def __repr__(self):
+        return f'<GoogleSyncState user={self.user_id}>'
+
+class Job(db.Model):
+    # Workers look for due jobs by status and run_after
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    payload = db.Column(db.Text)  # JSON
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    # Earliest time a queued job may run; for a running job, when its lease expires
+    run_after = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+class Blob(db.Model):
+    # One row per distinct uploaded file, keyed by the SHA-256 of its contents
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    mime = db.Column(db.String(100))  # Sniffed from the content when it was stored
+    refcount = db.Column(db.Integer, default=0, nullable=False)  # Attachments referring to this blob
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<Blob {self.sha256[:12]} refs={self.refcount}>'
+
+class ChunkedUpload(db.Model):
+    # A resumable upload in progress; chunks are appended to a partial file on disk
+    id = db.Column(db.String(32), primary_key=True)  # Random token, also names the partial file
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)  # Declared total size
+    received = db.Column(db.BigInteger, default=0, nullable=False)  # Bytes acknowledged so far
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<ChunkedUpload {self.id} {self.received}/{self.size}>'
+
+class Attachment(db.Model):
+    # A file attached to a task. key is its blob store key "<sha256>_<filename>";
+    # size and mime are copied from the blob so listings needn't join it
+    __table_args__ = (
+        db.Index('ix_attachment_task_id', 'task_id', 'id'),
+        # Keys start with the content hash, so the upload collector can
+        # range-scan the attachments referring to a batch of blobs
+        db.Index('ix_attachment_key', 'key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    key = db.Column(db.String(500), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    mime = db.Column(db.String(100), nullable=False)
+    sha256 = db.Column(db.String(64))  # None for files stored before the blob store
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    @property
+    def filename(self):
+        return self.key.split('_', 1)[1] if '_' in self.key else self.key
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'filename': self.filename,
+            'size': self.size,
+            'mime': self.mime,
+            'sha256': self.sha256,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+    
+    def __repr__(self):
+        return f'<Attachment {self.key}>'
+
+class WebSession(db.Model):
+    # Server-side session data; the cookie only carries a random token whose
+    # SHA-256 is the id, so a leaked table can't be replayed as cookies
+    id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, index=True)  # Logged-in user, if any
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<WebSession {self.id[:12]} user={self.user_id}>'
+
+class LoginWindow(db.Model):
+    # Login attempts of one throttling key ('ip:...' or 'user:...') in one
+    # fixed window, for the shared login throttle backend
+    __table_args__ = (
+        db.Index('ix_login_window_window_start', 'window_start'),
+    )
+    
+    key = db.Column(db.String(200), primary_key=True)
+    window_start = db.Column(db.Integer, primary_key=True)  # Unix time the window began
+    count = db.Column(db.Integer, default=0, nullable=False)
     
     def __repr__(self):
-        return f'<Task {self.title}>' 
\ No newline at end of file
+        return f'<LoginWindow {self.key} {self.window_start}: {self.count}>'
@@ -0,0 +1,134 @@
+"""
+Keyset (cursor) pagination helpers for task listings
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class Page:
+    """A single page of keyset-paginated results"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, per_page=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Encode a list of sort key values into an opaque URL-safe cursor"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """Decode a cursor produced by encode_cursor, returning None if it is invalid"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+
+    decoded = []
+    for value, (column, _descending) in zip(values, keys):
+        value = _coerce(value, column)
+        if value is None:
+            return None
+        decoded.append(value)
+    return decoded
+
+
+def _coerce(value, column):
+    """A cursor value as the Python type of its key column, or None if it isn't one"""
+    try:
+        python_type = column.type.python_type
+    except (AttributeError, NotImplementedError):
+        return value
+    if python_type is datetime:
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+    # bool is an int subclass, but true is no id
+    if isinstance(value, bool) and python_type is not bool:
+        return None
+    if python_type is float and isinstance(value, int):
+        return float(value)
+    return value if isinstance(value, python_type) else None
+
+
+def _seek_condition(keys, values, forward):
+    """Build the WHERE clause selecting rows strictly after (or before) the cursor"""
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        # Moving forward through a descending key means looking for smaller values
+        if descending == forward:
+            comparison = column < values[i]
+        else:
+            comparison = column > values[i]
+        equal_prefix = [keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, comparison))
+    return or_(*clauses)
+
+
+def paginate(query, keys, cursor=None, direction='next', per_page=20):
+    """Return a Page of query results ordered by keys, seeking past cursor.
+
+    keys is a list of (column, descending) pairs that must form a unique
+    ordering, e.g. [(Task.created_at, True), (Task.id, True)].
+    """
+    values = decode_cursor(cursor, keys)
+    backwards = values is not None and direction == 'prev'
+
+    labels = [column.label(f'_key{i}') for i, (column, _descending) in enumerate(keys)]
+    query = query.add_columns(*labels)
+
+    if values is not None:
+        query = query.filter(_seek_condition(keys, values, forward=not backwards))
+
+    ordering = []
+    for column, descending in keys:
+        # Walking backwards flips every key so the closest rows come first
+        ordering.append(column.asc() if descending == backwards else column.desc())
+    rows = query.order_by(*ordering).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    items = [row[0] for row in rows]
+    if not rows:
+        return Page(items, per_page=per_page)
+
+    first_key = encode_cursor(list(rows[0][1:]))
+    last_key = encode_cursor(list(rows[-1][1:]))
+    if backwards:
+        next_cursor = last_key
+        prev_cursor = first_key if has_more else None
+    else:
+        next_cursor = last_key if has_more else None
+        prev_cursor = first_key if values is not None else None
+    return Page(items, next_cursor=next_cursor, prev_cursor=prev_cursor, per_page=per_page)
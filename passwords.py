@@ -0,0 +1,112 @@
+"""
+Password hashing off the request thread
+
+Hashing and checking passwords is deliberately slow. Instead of running it
+on the web workers, hashes are computed in a small process pool of
+PASSWORD_HASH_WORKERS processes, and at most PASSWORD_HASH_MAX_PENDING
+hashes per web process may be queued or running. When no slot frees up
+within PASSWORD_HASH_QUEUE_TIMEOUT seconds HashingBusy is raised, which the
+auth views turn into a 503 with a Retry-After header rather than letting a
+login burst pile up behind the CPU.
+
+PASSWORD_HASH_METHOD sets the algorithm and cost. Hashes made with another
+method keep working and are replaced on the user's next successful login.
+"""
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+class HashingBusy(RuntimeError):
+    """Every password hashing slot is taken; retry after retry_after seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__('Password hashing is saturated')
+        self.retry_after = retry_after
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Created on first use so forked web workers each start their own
+            _pool = ProcessPoolExecutor(max_workers=current_app.config['PASSWORD_HASH_WORKERS'])
+        return _pool
+
+
+def _limiter():
+    global _slots
+    with _pool_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(current_app.config['PASSWORD_HASH_MAX_PENDING'])
+        return _slots
+
+
+def _run(fn, *args):
+    config = current_app.config
+    slots = _limiter()
+    if not slots.acquire(timeout=config['PASSWORD_HASH_QUEUE_TIMEOUT']):
+        raise HashingBusy(config['PASSWORD_HASH_RETRY_AFTER'])
+    try:
+        if not config['PASSWORD_HASH_WORKERS']:
+            return fn(*args)
+        try:
+            return _executor().submit(fn, *args).result(timeout=config['PASSWORD_HASH_TIMEOUT'])
+        except FutureTimeoutError:
+            raise HashingBusy(config['PASSWORD_HASH_RETRY_AFTER'])
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    """Hash a password with the configured method; raises HashingBusy"""
+    return _run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def verify_password(password_hash, password):
+    """Check a password against a stored hash of any supported method; raises HashingBusy"""
+    return _run(check_password_hash, password_hash, password)
+
+
+@functools.lru_cache(maxsize=None)
+def _canonical_method(method):
+    # Werkzeug fills in default costs ('scrypt' is stored as 'scrypt:32768:8:1'),
+    # so compare against what it actually writes
+    return generate_password_hash('', method, salt_length=1).split('$', 1)[0]
+
+
+def needs_rehash(password_hash):
+    """Whether a stored hash was made with another method or cost than configured"""
+    return password_hash.split('$', 1)[0] != _canonical_method(current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def benchmark(method, seconds=2.0, workers=None):
+    """Measure hashes per second of method in this process and across a pool of workers.
+
+    Returns a dict with the single-process rate and the pool's total and per-core rates.
+    """
+    workers = workers or os.cpu_count() or 1
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        generate_password_hash('benchmark', method)
+        count += 1
+    single = count / (time.perf_counter() - start)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Warm the workers up so process start-up isn't measured
+        list(pool.map(generate_password_hash, ['warm-up'] * workers, [method] * workers))
+        count, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            list(pool.map(generate_password_hash, ['benchmark'] * workers, [method] * workers))
+            count += workers
+        total = count / (time.perf_counter() - start)
+
+    return {'method': method, 'single': single, 'workers': workers, 'pool': total, 'per_core': total / workers}
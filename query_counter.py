@@ -0,0 +1,36 @@
+"""
+Request-scoped SQL statement counter
+
+Every statement executed while handling a request is counted on flask.g.
+With QUERY_COUNT_HEADER enabled the total is returned in an X-Query-Count
+response header, which the test suite uses to catch N+1 query regressions.
+"""
+from flask import g, has_request_context
+from sqlalchemy import event
+from models import db
+
+
+def init_query_counter(app):
+    """Start counting the statements each request sends to the database"""
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _count_statement)
+
+    @app.before_request
+    def reset_query_count():
+        g.query_count = 0
+
+    @app.after_request
+    def add_query_count_header(response):
+        if app.config.get('QUERY_COUNT_HEADER'):
+            response.headers['X-Query-Count'] = str(query_count())
+        return response
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def query_count():
+    """Number of statements issued so far by the current request"""
+    return g.get('query_count', 0)
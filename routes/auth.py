@@ -1,11 +1,26 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import timedelta
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
+from sqlalchemy.exc import SQLAlchemyError
 from models import db, User
 from utils import login_required
+from stats import task_stats
+from sessions import get_current_user, regenerate_session, end_user_sessions
+from passwords import HashingBusy, hash_password, verify_password, needs_rehash
+from login_throttle import check_login, record_failed_login, reset_login
+from accounts import AccountConflict, check_available, commit_account
 
 auth = Blueprint('auth', __name__)
 
+@auth.errorhandler(HashingBusy)
+def hashing_busy(error):
+    # Too many passwords are being hashed right now: ask the client to come back
+    flash('The server is busy, please try again in a moment.', 'error')
+    if request.endpoint == 'auth.change_password':
+        user = get_current_user()
+        body = render_template('profile.html', user=user, stats=task_stats(user.id))
+    else:
+        body = render_template('register.html' if request.endpoint == 'auth.register' else 'login.html')
+    return body, 503, {'Retry-After': str(error.retry_after)}
+
 @auth.route('/')
 def index():
     if 'user_id' in session:
@@ -24,22 +39,20 @@ def register():
             flash('Passwords do not match!', 'error')
             return render_template('register.html')
         
-        if User.query.filter_by(username=username).first():
-            flash('Username already exists!', 'error')
-            return render_template('register.html')
-        
-        if User.query.filter_by(email=email).first():
-            flash('Email already registered!', 'error')
+        # One lookup for both names; the unique indexes catch concurrent registrations
+        try:
+            check_available(username, email)
+            user = User(
+                username=username,
+                email=email,
+                password_hash=hash_password(password)
+            )
+            db.session.add(user)
+            commit_account()
+        except AccountConflict as e:
+            flash(str(e), 'error')
             return render_template('register.html')
         
-        user = User(
-            username=username,
-            email=email,
-            password_hash=generate_password_hash(password)
-        )
-        db.session.add(user)
-        db.session.commit()
-        
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('auth.login'))
     
@@ -52,9 +65,29 @@ def login():
         password = request.form['password']
         remember = request.form.get('remember') == 'on'
         
+        # Refuse throttled clients before spending a query or a hash on them
+        retry_after = check_login(username, request.remote_addr)
+        if retry_after:
+            flash(f'Too many login attempts. Please try again in {retry_after} seconds.', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
+        
         user = User.query.filter_by(username=username).first()
         
-        if user and check_password_hash(user.password_hash, password):
+        if user and verify_password(user.password_hash, password):
+            if needs_rehash(user.password_hash):
+                # Move hashes made with an older method or cost to the current one
+                try:
+                    user.password_hash = hash_password(password)
+                    db.session.commit()
+                except HashingBusy:
+                    pass  # keep the old hash until a quieter login
+                except SQLAlchemyError:
+                    # e.g. a column too narrow for the new hash before upgrade-db has run
+                    db.session.rollback()
+                    current_app.logger.exception('Could not store the rehashed password of user %s', user.id)
+            
+            reset_login(username)
+            regenerate_session()
             session['user_id'] = user.id
             session['username'] = user.username
             
@@ -66,6 +99,7 @@ def login():
             flash('Login successful!', 'success')
             return redirect(url_for('main.dashboard'))
         else:
+            record_failed_login(username, request.remote_addr)
             flash('Invalid username or password!', 'error')
     
     return render_template('login.html')
@@ -79,15 +113,21 @@ def logout():
 @auth.route('/profile')
 @login_required
 def profile():
-    user = db.session.get(User, session['user_id'])
+    user = get_current_user()
     if not user:
         flash('User not found!', 'error')
         return redirect(url_for('auth.logout'))
-    return render_template('profile.html', user=user)
+    return render_template('profile.html', user=user, stats=task_stats(user.id))
+
+@auth.route('/profile/stats')
+@login_required
+def profile_stats():
+    return jsonify(task_stats(session['user_id']))
 
 @auth.route('/profile/update', methods=['POST'])
 @login_required
 def update_profile():
+    # Fresh from the database, never the cached copy, since this writes to it
     user = db.session.get(User, session['user_id'])
     if not user:
         flash('User not found!', 'error')
@@ -96,28 +136,23 @@ def update_profile():
     username = request.form['username']
     email = request.form['email']
     
-    # Check if username is already taken by another user
-    existing_user = User.query.filter_by(username=username).first()
-    if existing_user and existing_user.id != user.id:
-        flash('Username already exists!', 'error')
-        return redirect(url_for('auth.profile'))
-    
-    # Check if email is already taken by another user
-    existing_email = User.query.filter_by(email=email).first()
-    if existing_email and existing_email.id != user.id:
-        flash('Email already registered!', 'error')
+    # Check both against other users in one query; the unique indexes catch races
+    try:
+        check_available(username, email, user_id=user.id)
+        user.username = username
+        user.email = email
+        commit_account()
+    except AccountConflict as e:
+        flash(str(e), 'error')
         return redirect(url_for('auth.profile'))
     
-    user.username = username
-    user.email = email
-    db.session.commit()
-    
     flash('Profile updated successfully!', 'success')
     return redirect(url_for('auth.profile'))
 
 @auth.route('/profile/change-password', methods=['POST'])
 @login_required
 def change_password():
+    # Fresh from the database, never the cached copy, since this writes to it
     user = db.session.get(User, session['user_id'])
     if not user:
         flash('User not found!', 'error')
@@ -128,7 +163,7 @@ def change_password():
     confirm_new_password = request.form['confirm_new_password']
     
     # Verify current password
-    if not check_password_hash(user.password_hash, current_password):
+    if not verify_password(user.password_hash, current_password):
         flash('Current password is incorrect!', 'error')
         return redirect(url_for('auth.profile'))
     
@@ -138,7 +173,9 @@ def change_password():
         return redirect(url_for('auth.profile'))
     
     # Update password
-    user.password_hash = generate_password_hash(new_password)
+    user.password_hash = hash_password(new_password)
+    # Sign out every other browser that still knows the old password
+    end_user_sessions(user.id)
     db.session.commit()
     
     flash('Password changed successfully!', 'success')
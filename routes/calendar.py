@@ -1,13 +1,15 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, make_response
-from datetime import timedelta
-from icalendar import Calendar, Event
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response, stream_with_context, send_file
+import hashlib
 from flask import session as flask_session
+from sqlalchemy import func
+from werkzeug.http import is_resource_modified
 import os
-from models import db, User, Task
+from models import db, Task, Job
 from utils import login_required
+from ics_export import parse_range_param, dated_tasks_query, ics_stream, export_path
+from jobs import active_job, enqueue
+from sessions import get_current_user
+import google_calendar  # registers the google_sync job handler
 from config import Config
 
 calendar_bp = Blueprint('calendar', __name__)
@@ -15,17 +17,31 @@ calendar_bp = Blueprint('calendar', __name__)
 @calendar_bp.route('/calendar')
 @login_required
 def calendar():
-    user = db.session.get(User, session['user_id'])
-    return render_template('calendar.html', user=user)
+    user = get_current_user()
+    # Jobs started from this page are polled until they finish
+    job_id = request.args.get('job', type=int)
+    return render_template('calendar.html', user=user, job_id=job_id)
 
 @calendar_bp.route('/calendar/events')
 @login_required
 def calendar_events():
-    user = db.session.get(User, session['user_id'])
-    tasks = Task.query.filter_by(user_id=user.id).all()
-    events = []
-    for task in tasks:
-        if task.due_date:
+    user_id = session['user_id']
+    start = parse_range_param(request.args.get('start'))
+    end = parse_range_param(request.args.get('end'))
+    query = dated_tasks_query(user_id, start, end)
+    
+    # Fingerprint the visible window: any edit bumps the latest updated_at and
+    # any task moving in or out of the window (or being deleted) changes the count.
+    # No Last-Modified: a deletion changes the window without making it newer
+    latest, count = query.with_entities(func.max(Task.updated_at), func.count(Task.id)).one()
+    etag = hashlib.sha1(f'{user_id}:{start}:{end}:{latest}:{count}'.encode('utf-8')).hexdigest()
+    
+    if not is_resource_modified(request.environ, etag=etag):
+        response = make_response('', 304)
+    else:
+        rows = query.with_entities(Task.id, Task.title, Task.due_date, Task.priority).all()
+        events = []
+        for task in rows:
             events.append({
                 'id': task.id,
                 'title': task.title,
@@ -33,31 +49,64 @@ def calendar_events():
                 'url': url_for('main.view_task', task_id=task.id),
                 'color': '#dc3545' if task.priority == 'High' else '#ffc107' if task.priority == 'Medium' else '#28a745',
             })
-    return jsonify(events)
+        response = jsonify(events)
+    
+    response.set_etag(etag)
+    # Browsers must revalidate, which costs only the fingerprint query when nothing changed
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @calendar_bp.route('/calendar/export')
 @login_required
 def calendar_export():
-    user = db.session.get(User, session['user_id'])
-    tasks = Task.query.filter_by(user_id=user.id).all()
-    cal = Calendar()
-    cal.add('prodid', '-//Student Study Planner//')
-    cal.add('version', '2.0')
-    for task in tasks:
-        if task.due_date:
-            event = Event()
-            event.add('summary', task.title)
-            event.add('dtstart', task.due_date.date())
-            event.add('dtend', task.due_date.date())
-            event.add('description', task.description or '')
-            event.add('priority', {'High': 1, 'Medium': 5, 'Low': 9}.get(task.priority, 5))
-            cal.add_component(event)
-    ics_bytes = cal.to_ical()
-    response = make_response(ics_bytes)
+    start = parse_range_param(request.args.get('start'))
+    end = parse_range_param(request.args.get('end'))
+    query = dated_tasks_query(session['user_id'], start, end, request.args.get('category', type=int))
+    
+    response = Response(stream_with_context(ics_stream(query)))
     response.headers['Content-Disposition'] = 'attachment; filename=tasks.ics'
     response.headers['Content-Type'] = 'text/calendar'
     return response
 
+@calendar_bp.route('/calendar/export/jobs', methods=['POST'])
+@login_required
+def calendar_export_job():
+    job = enqueue('ics_export', user_id=session['user_id'], payload={
+        'start': request.form.get('start') or None,
+        'end': request.form.get('end') or None,
+        'category': request.form.get('category', type=int),
+    })
+    flash('Your calendar export is being prepared.', 'info')
+    return redirect(url_for('calendar.calendar', job=job.id))
+
+@calendar_bp.route('/calendar/export/<int:job_id>/download')
+@login_required
+def download_export(job_id):
+    job = db.session.get(Job, job_id)
+    if not job or job.user_id != session['user_id'] or job.kind != 'ics_export':
+        flash('Export not found!', 'error')
+        return redirect(url_for('calendar.calendar'))
+    if job.status != 'succeeded':
+        flash('That export is not ready yet.', 'info')
+        return redirect(url_for('calendar.calendar', job=job.id))
+    if not os.path.exists(export_path(job.id)):
+        # Written to the local EXPORT_FOLDER of the node whose worker ran the job
+        flash('That export is no longer available. Please export again.', 'error')
+        return redirect(url_for('calendar.calendar'))
+    return send_file(export_path(job.id), mimetype='text/calendar', as_attachment=True, download_name='tasks.ics')
+
+def _oauth_flow(**kwargs):
+    # google_auth_oauthlib takes longer to import than the rest of the app, and
+    # only these two endpoints need it
+    from google_auth_oauthlib.flow import Flow
+    return Flow.from_client_secrets_file(
+        Config.GOOGLE_CLIENT_SECRETS_FILE,
+        scopes=Config.GOOGLE_SCOPES,
+        redirect_uri=url_for('calendar.google_callback', _external=True),
+        **kwargs
+    )
+
 @calendar_bp.route('/google/auth')
 @login_required
 def google_auth():
@@ -70,11 +119,7 @@ def google_auth():
         return redirect(url_for('calendar.calendar'))
     
     try:
-        flow = Flow.from_client_secrets_file(
-            Config.GOOGLE_CLIENT_SECRETS_FILE,
-            scopes=Config.GOOGLE_SCOPES,
-            redirect_uri=url_for('calendar.google_callback', _external=True)
-        )
+        flow = _oauth_flow()
         auth_url, state = flow.authorization_url(
             access_type='offline',
             include_granted_scopes='true',
@@ -109,12 +154,7 @@ def google_callback():
     
     try:
         state = flask_session.get('google_oauth_state')
-        flow = Flow.from_client_secrets_file(
-            Config.GOOGLE_CLIENT_SECRETS_FILE,
-            scopes=Config.GOOGLE_SCOPES,
-            state=state,
-            redirect_uri=url_for('calendar.google_callback', _external=True)
-        )
+        flow = _oauth_flow(state=state)
         flow.fetch_token(authorization_response=request.url)
         credentials = flow.credentials
         flask_session['google_credentials'] = {
@@ -139,33 +179,13 @@ def google_sync():
         flash('Google authentication required. Please authenticate first.', 'error')
         return redirect(url_for('calendar.calendar'))
     
-    try:
-        creds = Credentials(
-            creds_data['token'],
-            refresh_token=creds_data.get('refresh_token'),
-            token_uri=creds_data['token_uri'],
-            client_id=creds_data['client_id'],
-            client_secret=creds_data['client_secret'],
-            scopes=creds_data['scopes']
-        )
-        service = build('calendar', 'v3', credentials=creds)
-        user = db.session.get(User, session['user_id'])
-        tasks = Task.query.filter_by(user_id=user.id).all()
-        
-        synced_count = 0
-        for task in tasks:
-            if task.due_date:
-                event = {
-                    'summary': task.title,
-                    'description': task.description or '',
-                    'start': {'date': task.due_date.strftime('%Y-%m-%d')},
-                    'end': {'date': task.due_date.strftime('%Y-%m-%d')},
-                }
-                service.events().insert(calendarId='primary', body=event).execute()
-                synced_count += 1
-        
-        flash(f'Successfully synced {synced_count} tasks to your Google Calendar!', 'success')
-    except Exception as e:
-        flash(f'Error syncing with Google Calendar: {str(e)}', 'error')
+    # A second sync would resend the same inserts and duplicate events
+    running = active_job('google_sync', session['user_id'])
+    if running:
+        flash('A Google Calendar sync is already in progress.', 'info')
+        return redirect(url_for('calendar.calendar', job=running.id))
     
-    return redirect(url_for('calendar.calendar')) 
\ No newline at end of file
+    # The sync runs on a background worker; the calendar page polls its progress
+    job = enqueue('google_sync', user_id=session['user_id'], payload={'credentials': creds_data})
+    flash('Google Calendar sync started.', 'info')
+    return redirect(url_for('calendar.calendar', job=job.id)) 
\ No newline at end of file
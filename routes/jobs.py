@@ -0,0 +1,24 @@
+from flask import Blueprint, jsonify, session, url_for
+from models import db, Job
+from utils import login_required
+from jobs import job_to_dict
+
+jobs_bp = Blueprint('jobs', __name__)
+
+# Where to fetch the output of a finished job, by job kind
+JOB_RESULT_ENDPOINTS = {
+    'ics_export': 'calendar.download_export',
+}
+
+@jobs_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = db.session.get(Job, job_id)
+    if not job or job.user_id != session['user_id']:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    data = job_to_dict(job)
+    endpoint = JOB_RESULT_ENDPOINTS.get(job.kind)
+    if endpoint and job.status == 'succeeded':
+        data['download_url'] = url_for(endpoint, job_id=job.id)
+    return jsonify(data)
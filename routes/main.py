@@ -1,61 +1,158 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_from_directory
-from werkzeug.utils import secure_filename
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app, abort
 from datetime import datetime
-import uuid
-import os
-from sqlalchemy import or_
-from models import db, User, Task, Category
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, Task, Category, Attachment
 from utils import login_required, allowed_file
-from config import Config
+from pagination import paginate
+from search import apply_search
+from sessions import get_current_user
+from stats import category_task_counts, category_has_tasks, invalidate_task_stats
+import attachments
+import blobstore
+import bulk_tasks
+import filetypes
+import task_import
+import thumbnails
 
 main = Blueprint('main', __name__)
 
-@main.route('/dashboard')
-@login_required
-def dashboard():
-    user = db.session.get(User, session['user_id'])
-    if not user:
-        flash('User not found!', 'error')
-        return redirect(url_for('auth.logout'))
-    
-    # Get search query
-    search_query = request.args.get('search', '')
+# Newest first; id breaks ties between tasks created in the same instant
+TASK_LISTING_KEYS = [(Task.created_at, True), (Task.id, True)]
+
+def _filtered_task_query(user_id, search_query, status_filter, priority_filter, category_filter):
+    """Build the filtered task query shared by the dashboard and search pages.
     
-    # Build query
-    query = Task.query.filter_by(user_id=user.id)
+    Returns (query, rank); rank orders full-text matches best first and is
+    None when there is no search query or the database can't rank results.
+    """
+    query = Task.query.filter_by(user_id=user_id)
+    rank = None
     
-    # Apply search filter if query provided
+    # Apply full-text search filter if query provided
     if search_query:
-        query = query.filter(
-            or_(
-                Task.title.ilike(f'%{search_query}%'),
-                Task.description.ilike(f'%{search_query}%')
-            )
-        )
+        query, rank = apply_search(query, search_query, user_id)
     
     # Apply status filter
-    status_filter = request.args.get('status', '')
     if status_filter:
         query = query.filter(Task.status == status_filter)
     
     # Apply priority filter
-    priority_filter = request.args.get('priority', '')
     if priority_filter:
         query = query.filter(Task.priority == priority_filter)
     
     # Apply category filter
-    category_filter = request.args.get('category', '')
     if category_filter:
         query = query.filter(Task.category_id == category_filter)
     
-    # Order by creation date
-    tasks = query.order_by(Task.created_at.desc()).all()
+    return query, rank
+
+def _status_counts(query):
+    """Count the tasks matching query per status without loading them"""
+    rows = query.with_entities(Task.status, func.count(Task.id)).group_by(Task.status).all()
+    return {status: count for status, count in rows}
+
+def _with_category(query, strategy=None):
+    """Eager-load Task.category so listing templates don't issue a query per task.
+    
+    strategy is 'joined', 'selectin' or 'lazy' and defaults to TASK_CATEGORY_LOADING.
+    """
+    strategy = strategy or current_app.config['TASK_CATEGORY_LOADING']
+    if strategy == 'joined':
+        return query.options(joinedload(Task.category))
+    if strategy == 'selectin':
+        return query.options(selectinload(Task.category))
+    return query
+
+def _paginate_tasks(query, keys=TASK_LISTING_KEYS):
+    """Fetch one page of tasks using the cursor arguments of the current request"""
+    per_page = request.args.get('per_page', type=int) or current_app.config['TASKS_PER_PAGE']
+    per_page = max(1, min(per_page, current_app.config['MAX_TASKS_PER_PAGE']))
+    return paginate(
+        query,
+        keys,
+        cursor=request.args.get('cursor'),
+        direction=request.args.get('direction', 'next'),
+        per_page=per_page
+    )
+
+def _user_attachment(key):
+    """An attachment of one of the current user's tasks with this key, or None"""
+    return db.session.query(Attachment).join(Task).filter(
+        Task.user_id == session['user_id'],
+        Attachment.key == key
+    ).first()
+
+def _attach_uploads(task):
+    """Attach the files posted with the form to task, returning the new attachments"""
+    added = []
+    for file in request.files.getlist('file'):
+        if file and file.filename and file.filename != '' and allowed_file(file.filename):
+            # Identical files are stored once and shared between tasks
+            added.append(attachments.attach_upload(task, file))
+    return added
+
+def _schedule_thumbnails(added):
+    for attachment in added:
+        thumbnails.schedule_thumbnails(attachment.key)
+
+def _page_url(cursor, direction):
+    """Build a link to another page of the current listing, keeping its filters"""
+    if cursor is None:
+        return None
+    args = request.args.to_dict()
+    args.update(cursor=cursor, direction=direction)
+    return url_for(request.endpoint, **args)
+
+def _page_json(page):
+    """Serialize a page of tasks for the JSON variant of the listing pages"""
+    summaries = attachments.attachment_summaries(task.id for task in page.items)
+    tasks = []
+    for task in page.items:
+        data = task.to_dict()
+        summary = summaries.get(task.id)
+        data['attachment_count'] = summary.count if summary else 0
+        tasks.append(data)
+    return jsonify({
+        'tasks': tasks,
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'next_url': _page_url(page.next_cursor, 'next'),
+        'prev_url': _page_url(page.prev_cursor, 'prev'),
+        'per_page': page.per_page
+    })
+
+@main.route('/dashboard')
+@login_required
+def dashboard():
+    user = get_current_user()
+    if not user:
+        flash('User not found!', 'error')
+        return redirect(url_for('auth.logout'))
+    
+    # Get search query and filters
+    search_query = request.args.get('search', '')
+    status_filter = request.args.get('status', '')
+    priority_filter = request.args.get('priority', '')
+    category_filter = request.args.get('category', '')
+    
+    query, _rank = _filtered_task_query(user.id, search_query, status_filter, priority_filter, category_filter)
+    
+    # Fetch a single page, newest first
+    page = _paginate_tasks(_with_category(query))
+    if request.args.get('format') == 'json':
+        return _page_json(page)
     
     # Get categories for filter dropdown
     categories = Category.query.filter_by(user_id=user.id).all()
     
     return render_template('dashboard.html', 
-                         tasks=tasks, 
+                         tasks=page.items, 
+                         attachment_summaries=attachments.attachment_summaries(t.id for t in page.items),
+                         page=page,
+                         next_url=_page_url(page.next_cursor, 'next'),
+                         prev_url=_page_url(page.prev_cursor, 'prev'),
+                         status_counts=_status_counts(query),
                          user=user, 
                          search_query=search_query,
                          status_filter=status_filter,
@@ -66,7 +163,7 @@ def dashboard():
 @main.route('/search')
 @login_required
 def search_tasks():
-    user = db.session.get(User, session['user_id'])
+    user = get_current_user()
     if not user:
         flash('User not found!', 'error')
         return redirect(url_for('auth.logout'))
@@ -76,33 +173,23 @@ def search_tasks():
     priority_filter = request.args.get('priority', '')
     category_filter = request.args.get('category', '')
     
-    # Build query
-    task_query = Task.query.filter_by(user_id=user.id)
-    
-    # Apply search filter
-    if query:
-        task_query = task_query.filter(
-            or_(
-                Task.title.ilike(f'%{query}%'),
-                Task.description.ilike(f'%{query}%')
-            )
-        )
-    
-    # Apply filters
-    if status_filter:
-        task_query = task_query.filter(Task.status == status_filter)
+    task_query, rank = _filtered_task_query(user.id, query, status_filter, priority_filter, category_filter)
     
-    if priority_filter:
-        task_query = task_query.filter(Task.priority == priority_filter)
-    
-    if category_filter:
-        task_query = task_query.filter(Task.category_id == category_filter)
+    # Best matches first when the search can be ranked, newest first otherwise
+    keys = TASK_LISTING_KEYS if rank is None else [(rank, False)] + TASK_LISTING_KEYS
+    page = _paginate_tasks(_with_category(task_query), keys)
+    if request.args.get('format') == 'json':
+        return _page_json(page)
     
-    tasks = task_query.order_by(Task.created_at.desc()).all()
     categories = Category.query.filter_by(user_id=user.id).all()
     
     return render_template('search_results.html', 
-                         tasks=tasks, 
+                         tasks=page.items, 
+                         attachment_summaries=attachments.attachment_summaries(t.id for t in page.items),
+                         page=page,
+                         next_url=_page_url(page.next_cursor, 'next'),
+                         prev_url=_page_url(page.prev_cursor, 'prev'),
+                         total_count=task_query.count(),
                          query=query,
                          status_filter=status_filter,
                          priority_filter=priority_filter,
@@ -139,19 +226,17 @@ def create_task():
             category_id=category_id if category_id else None
         )
         
-        # Handle file upload
-        if 'file' in request.files:
-            file = request.files['file']
-            if file and file.filename and file.filename != '' and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Add unique identifier to prevent filename conflicts
-                unique_filename = f"{uuid.uuid4().hex}_{filename}"
-                file_path = os.path.join(Config.UPLOAD_FOLDER, unique_filename)
-                file.save(file_path)
-                task.file_path = unique_filename
+        # Handle file uploads
+        try:
+            added = _attach_uploads(task)
+        except filetypes.FileTypeMismatch:
+            flash('The file content does not match its type!', 'error')
+            categories = Category.query.filter_by(user_id=session['user_id']).order_by(Category.name).all()
+            return render_template('create_task.html', categories=categories)
         
         db.session.add(task)
         db.session.commit()
+        _schedule_thumbnails(added)
         
         flash('Task created successfully!', 'success')
         return redirect(url_for('main.dashboard'))
@@ -203,23 +288,16 @@ def edit_task(task_id):
         # Update category
         task.category_id = category_id if category_id else None
         
-        # Handle file upload
-        if 'file' in request.files:
-            file = request.files['file']
-            if file and file.filename and file.filename != '' and allowed_file(file.filename):
-                # Delete old file if exists
-                if task.file_path:
-                    old_file_path = os.path.join(Config.UPLOAD_FOLDER, task.file_path)
-                    if os.path.exists(old_file_path):
-                        os.remove(old_file_path)
-                
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4().hex}_{filename}"
-                file_path = os.path.join(Config.UPLOAD_FOLDER, unique_filename)
-                file.save(file_path)
-                task.file_path = unique_filename
+        # New files are added to the task's attachments
+        try:
+            added = _attach_uploads(task)
+        except filetypes.FileTypeMismatch:
+            db.session.rollback()
+            flash('The file content does not match its type!', 'error')
+            return redirect(url_for('main.edit_task', task_id=task_id))
         
         db.session.commit()
+        _schedule_thumbnails(added)
         flash('Task updated successfully!', 'success')
         return redirect(url_for('main.dashboard'))
     
@@ -238,21 +316,77 @@ def delete_task(task_id):
         flash('Access denied!', 'error')
         return redirect(url_for('main.dashboard'))
     
-    # Delete associated file if exists
-    if task.file_path:
-        file_path = os.path.join(Config.UPLOAD_FOLDER, task.file_path)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    # Drop the task's references to its files; each file goes once nothing refers to it
+    attachments.release_task_attachments(task)
     
     db.session.delete(task)
     db.session.commit()
     flash('Task deleted successfully!', 'success')
     return redirect(url_for('main.dashboard'))
 
+@main.route('/task/<int:task_id>/attachments', methods=['POST'])
+@login_required
+def add_attachment(task_id):
+    task = db.session.get(Task, task_id)
+    if not task or task.user_id != session['user_id']:
+        flash('Task not found!', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    try:
+        added = _attach_uploads(task)
+    except filetypes.FileTypeMismatch:
+        db.session.rollback()
+        flash('The file content does not match its type!', 'error')
+        return redirect(url_for('main.view_task', task_id=task_id))
+    if not added:
+        flash('Choose a file of an allowed type to attach.', 'error')
+        return redirect(url_for('main.view_task', task_id=task_id))
+    
+    db.session.commit()
+    _schedule_thumbnails(added)
+    flash('Attachment added!' if len(added) == 1 else f'{len(added)} attachments added!', 'success')
+    return redirect(url_for('main.view_task', task_id=task_id))
+
+@main.route('/task/<int:task_id>/attachments/<int:attachment_id>/delete', methods=['POST'])
+@login_required
+def delete_attachment(task_id, attachment_id):
+    attachment = db.session.get(Attachment, attachment_id)
+    if not attachment or attachment.task_id != task_id or attachment.task.user_id != session['user_id']:
+        flash('Attachment not found!', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    attachments.remove_attachment(attachment)
+    db.session.commit()
+    flash('Attachment removed!', 'success')
+    return redirect(url_for('main.view_task', task_id=task_id))
+
 @main.route('/uploads/<filename>')
 @login_required
 def uploaded_file(filename):
-    return send_from_directory(Config.UPLOAD_FOLDER, filename)
+    attachment = _user_attachment(filename)
+    if attachment is None:
+        abort(404)
+    # The type sniffed at upload time, not one guessed from the name
+    return blobstore.send_upload(filename, mimetype=attachment.mime)
+
+@main.route('/uploads/<filename>/thumb/<int:size>')
+@login_required
+def uploaded_thumbnail(filename, size):
+    if _user_attachment(filename) is None:
+        abort(404)
+    thumbnail = thumbnails.get_thumbnail(filename, size)
+    if thumbnail is None:
+        # Not an image, an unknown size or Pillow isn't installed
+        return redirect(url_for('main.uploaded_file', filename=filename))
+    sha256 = blobstore.blob_sha(filename)
+    backend, name = thumbnail
+    return blobstore.send_stored(
+        backend,
+        name,
+        f'{blobstore.key_filename(filename)}.{size}.webp',
+        etag=f'{sha256}-{size}' if sha256 else None,
+        mimetype='image/webp'
+    )
 
 @main.route('/task/<int:task_id>/toggle_status', methods=['POST'])
 @login_required
@@ -276,16 +410,100 @@ def toggle_task_status(task_id):
     flash('Task status updated!', 'success')
     return redirect(url_for('main.dashboard')) 
 
+def _bulk_response(message, status=200):
+    """JSON for API clients, otherwise a flash message and back to the dashboard"""
+    if request.is_json:
+        return jsonify(message), status
+    flash(message.get('error') or message['message'], 'error' if status >= 400 else 'success')
+    return redirect(request.referrer or url_for('main.dashboard'))
+
+def _bulk_task_ids():
+    data = request.get_json(silent=True) or {}
+    values = data.get('task_ids') if request.is_json else request.form.getlist('task_ids')
+    if not isinstance(values, list):
+        raise bulk_tasks.BulkError('task_ids must be a list')
+    return bulk_tasks.parse_task_ids(values, current_app.config['BULK_MAX_TASKS'])
+
+@main.route('/tasks/bulk/update', methods=['POST'])
+@login_required
+def bulk_update_tasks():
+    user_id = session['user_id']
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        fields = {'status': data.get('status'), 'priority': data.get('priority')}
+        if 'category_id' in data:
+            # null clears the category
+            fields['category_id'] = '' if data['category_id'] is None else data['category_id']
+    else:
+        # Empty selects mean "leave as is"; the "none" category clears it
+        category_id = request.form.get('category_id') or None
+        fields = {'status': request.form.get('status') or None,
+                  'priority': request.form.get('priority') or None,
+                  'category_id': '' if category_id == 'none' else category_id}
+    
+    try:
+        task_ids = _bulk_task_ids()
+        changes = bulk_tasks.validate_changes(user_id, **fields)
+    except bulk_tasks.BulkError as e:
+        return _bulk_response({'error': str(e)}, 400)
+    
+    updated = bulk_tasks.bulk_update(user_id, task_ids, changes)
+    db.session.commit()
+    invalidate_task_stats(user_id)
+    return _bulk_response({'updated': updated, 'message': f'{updated} task(s) updated!'})
+
+@main.route('/tasks/bulk/delete', methods=['POST'])
+@login_required
+def bulk_delete_tasks():
+    user_id = session['user_id']
+    try:
+        task_ids = _bulk_task_ids()
+    except bulk_tasks.BulkError as e:
+        return _bulk_response({'error': str(e)}, 400)
+    
+    deleted = bulk_tasks.bulk_delete(user_id, task_ids)
+    db.session.commit()
+    invalidate_task_stats(user_id)
+    return _bulk_response({'deleted': deleted, 'message': f'{deleted} task(s) deleted!'})
+
+@main.route('/tasks/import', methods=['GET', 'POST'])
+@login_required
+def import_tasks_view():
+    wants_json = request.args.get('format') == 'json'
+    report = None
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename:
+            if wants_json:
+                return jsonify({'error': 'No file selected'}), 400
+            flash('Choose a CSV or .ics file to import.', 'error')
+            return redirect(url_for('main.import_tasks_view'))
+        
+        try:
+            report = task_import.import_tasks(session['user_id'], file.stream, file.filename)
+        except task_import.ImportRowError as e:
+            if wants_json:
+                return jsonify({'error': str(e)}), 400
+            flash(str(e), 'error')
+            return redirect(url_for('main.import_tasks_view'))
+        
+        if wants_json:
+            return jsonify(report)
+        flash(f"{report['imported']} task(s) imported!", 'success' if report['imported'] else 'warning')
+    
+    return render_template('import_tasks.html', report=report)
+
 @main.route('/categories')
 @login_required
 def categories():
-    user = db.session.get(User, session['user_id'])
+    user = get_current_user()
     if not user:
         flash('User not found!', 'error')
         return redirect(url_for('auth.logout'))
     
     categories = Category.query.filter_by(user_id=user.id).order_by(Category.name).all()
-    return render_template('categories.html', categories=categories, user=user)
+    task_counts = category_task_counts(user.id)
+    return render_template('categories.html', categories=categories, task_counts=task_counts, user=user)
 
 @main.route('/category/create', methods=['GET', 'POST'])
 @login_required
@@ -360,7 +578,7 @@ def delete_category(category_id):
         return redirect(url_for('main.categories'))
     
     # Check if category has tasks
-    if category.tasks:
+    if category_has_tasks(category.id):
         flash('Cannot delete category that has tasks. Please move or delete the tasks first.', 'error')
         return redirect(url_for('main.categories'))
     
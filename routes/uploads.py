@@ -0,0 +1,216 @@
+from flask import Blueprint, request, jsonify, session, url_for, current_app
+from datetime import datetime, timedelta, timezone
+from werkzeug.exceptions import ClientDisconnected
+import hashlib
+import os
+import uuid
+from models import db, Task, ChunkedUpload
+from utils import login_required, allowed_file
+import attachments
+import blobstore
+import filetypes
+import thumbnails
+
+uploads_bp = Blueprint('uploads', __name__)
+
+def partial_path(upload_id):
+    """Where the chunks received so far for an upload are kept"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'partial', upload_id)
+
+def _get_upload(upload_id):
+    """The current user's upload, or None if it doesn't exist or has expired"""
+    upload = db.session.get(ChunkedUpload, upload_id)
+    if not upload or upload.user_id != session['user_id']:
+        return None
+    # Stored datetimes are naive UTC
+    idle_since = upload.updated_at or upload.created_at
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    if idle_since < now - timedelta(seconds=current_app.config['UPLOAD_SESSION_TTL']):
+        _discard(upload)
+        return None
+    return upload
+
+def _discard(upload):
+    path = partial_path(upload.id)
+    if os.path.exists(path):
+        os.remove(path)
+    db.session.delete(upload)
+    db.session.commit()
+
+def _release_claim(upload, claimed_end, received):
+    """Move an upload's offset back from a claimed range to what was actually written"""
+    ChunkedUpload.query.filter_by(id=upload.id, received=claimed_end).update({
+        'received': received,
+        'updated_at': datetime.now(timezone.utc),
+    }, synchronize_session=False)
+    db.session.commit()
+
+def _upload_json(upload):
+    return {
+        'id': upload.id,
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': upload.received,
+        'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE'],
+        'url': url_for('uploads.upload_chunk', upload_id=upload.id),
+    }
+
+@uploads_bp.route('/upload-sessions', methods=['POST'])
+@login_required
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename')
+    size = data.get('size')
+    task_id = data.get('task_id')
+    task = db.session.get(Task, task_id) if isinstance(task_id, int) else None
+    
+    if not task or task.user_id != session['user_id']:
+        return jsonify({'error': 'Task not found'}), 404
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'size must be a positive number of bytes'}), 400
+    if size > current_app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({'error': 'File is too large'}), 413
+    
+    upload = ChunkedUpload(
+        id=uuid.uuid4().hex,
+        user_id=session['user_id'],
+        task_id=task.id,
+        filename=filename,
+        size=size
+    )
+    db.session.add(upload)
+    db.session.commit()
+    os.makedirs(os.path.dirname(partial_path(upload.id)), exist_ok=True)
+    open(partial_path(upload.id), 'wb').close()
+    return jsonify(_upload_json(upload)), 201
+
+@uploads_bp.route('/upload-sessions/<upload_id>')
+@login_required
+def upload_status(upload_id):
+    # A client resuming after a dropped connection asks where to continue from
+    upload = _get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(_upload_json(upload))
+
+@uploads_bp.route('/upload-sessions/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    upload = _get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    offset = request.args.get('offset', type=int)
+    if offset != upload.received:
+        # Tell the client where to resume instead of accepting a gap or overlap
+        return jsonify({'error': 'Unexpected offset', 'offset': upload.received}), 409
+    length = request.content_length
+    if not length:
+        return jsonify({'error': 'Content-Length required', 'offset': offset}), 411
+    if length > current_app.config['UPLOAD_CHUNK_SIZE'] or offset + length > upload.size:
+        return jsonify({'error': 'Chunk too large', 'offset': offset}), 413
+    
+    # Claim the chunk's range before writing it: of two requests for the same
+    # offset only one moves it forward, and the other is told where to resume
+    end = offset + length
+    claimed = ChunkedUpload.query.filter_by(id=upload.id, received=offset).update({
+        'received': end,
+        'updated_at': datetime.now(timezone.utc),
+    }, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        db.session.refresh(upload)
+        return jsonify({'error': 'Concurrent upload to the same offset', 'offset': upload.received}), 409
+    
+    path = partial_path(upload.id)
+    if not os.path.exists(path):
+        # Partial files are on the local disk of the server that started the upload
+        _release_claim(upload, end, offset)
+        return jsonify({'error': 'Upload is held by another server', 'offset': offset}), 409
+    on_disk = os.path.getsize(path)
+    if on_disk < offset:
+        # The request that claimed the previous chunk never finished writing it
+        _release_claim(upload, end, on_disk)
+        return jsonify({'error': 'Unexpected offset', 'offset': on_disk}), 409
+    
+    # Stream the body to disk a block at a time so memory use doesn't grow with the chunk
+    digest = hashlib.sha256()
+    written = 0
+    disconnected = False
+    with open(path, 'r+b') as f:
+        # Drop bytes past the acknowledged offset left by an interrupted request
+        f.truncate(offset)
+        f.seek(offset)
+        try:
+            if offset == 0:
+                # Reject the wrong kind of file before the rest of it is sent
+                block = filetypes.read_head(request.stream)
+                try:
+                    filetypes.sniff(block, upload.filename)
+                except filetypes.FileTypeMismatch:
+                    _release_claim(upload, end, 0)
+                    return jsonify({'error': 'File content does not match its type', 'offset': 0}), 415
+            else:
+                block = request.stream.read(blobstore.UPLOAD_CHUNK_SIZE)
+            while block:
+                digest.update(block)
+                f.write(block)
+                written += len(block)
+                block = request.stream.read(blobstore.UPLOAD_CHUNK_SIZE)
+        except ClientDisconnected:
+            # Keep what arrived so the client only resends the rest
+            disconnected = True
+        
+        expected = request.headers.get('X-Chunk-SHA256')
+        if expected and not disconnected and expected.lower() != digest.hexdigest():
+            f.truncate(offset)
+            _release_claim(upload, end, offset)
+            return jsonify({'error': 'Chunk checksum mismatch', 'offset': offset}), 400
+    
+    if written != length:
+        _release_claim(upload, end, offset + written)
+    if disconnected:
+        raise ClientDisconnected()
+    return jsonify({'offset': offset + written, 'size': upload.size})
+
+@uploads_bp.route('/upload-sessions/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    upload = _get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    path = partial_path(upload.id)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Upload is held by another server', 'offset': upload.received}), 409
+    if upload.received != upload.size or os.path.getsize(path) != upload.size:
+        # Not all sent, or the last chunk is still being written
+        return jsonify({'error': 'Upload is incomplete', 'offset': upload.received}), 409
+    
+    task = db.session.get(Task, upload.task_id)
+    if not task or task.user_id != session['user_id']:
+        _discard(upload)
+        return jsonify({'error': 'Task not found'}), 404
+    
+    # The partial file is renamed into the blob store, not copied
+    try:
+        attachment = attachments.attach_file(task, path, upload.filename)
+    except filetypes.FileTypeMismatch:
+        _discard(upload)
+        return jsonify({'error': 'File content does not match its type'}), 415
+    db.session.delete(upload)
+    db.session.commit()
+    thumbnails.schedule_thumbnails(attachment.key)
+    data = attachment.to_dict()
+    data['url'] = url_for('main.uploaded_file', filename=attachment.key)
+    return jsonify(data)
+
+@uploads_bp.route('/upload-sessions/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    upload = _get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    _discard(upload)
+    return '', 204
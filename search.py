@@ -0,0 +1,173 @@
+"""
+Full-text search over task titles and descriptions
+
+SQLite databases get an FTS5 external-content table kept in sync with the
+task table by triggers; PostgreSQL databases get a generated tsvector column
+with a GIN index. Other databases (or SQLite builds without FTS5) fall back
+to substring matching.
+
+Adding the PostgreSQL column rewrites the task table, so it is left to
+`python commands.py create-indexes` rather than done at startup; until it
+has run, PostgreSQL searches use substring matching too.
+"""
+import re
+from flask import current_app
+from sqlalchemy import cast, text, func, literal_column, or_
+from sqlalchemy.exc import OperationalError
+from models import db, Task
+
+# Upper bound on terms per query so a pasted essay can't build a huge MATCH expression
+MAX_SEARCH_TERMS = 16
+
+# Decimal places ranks are rounded to, so the value a cursor carries is
+# exactly the one the seek compares against on the next page
+RANK_PRECISION = 6
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_FTS_STATEMENTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS task_fts USING fts5(
+        title, description,
+        content='task', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS task_fts_ai AFTER INSERT ON task BEGIN
+        INSERT INTO task_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS task_fts_ad AFTER DELETE ON task BEGIN
+        INSERT INTO task_fts(task_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS task_fts_au AFTER UPDATE OF title, description ON task BEGIN
+        INSERT INTO task_fts(task_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO task_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+]
+
+POSTGRES_FTS_STATEMENTS = [
+    """
+    ALTER TABLE task ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_task_search_vector ON task USING GIN (search_vector)",
+]
+
+
+def search_terms(query_string):
+    """Split a user query into the word tokens understood by the index"""
+    return _TERM_RE.findall(query_string or '')[:MAX_SEARCH_TERMS]
+
+
+def init_search(app):
+    """Create the full-text index for the app's database if it is supported"""
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        backend = None
+        if dialect == 'sqlite':
+            backend = _init_sqlite()
+        elif dialect == 'postgresql':
+            backend = _init_postgres()
+        app.extensions['task_search'] = backend
+
+
+def _init_sqlite():
+    with db.engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='task_fts'"
+        )).first() is not None
+        try:
+            for statement in SQLITE_FTS_STATEMENTS:
+                conn.execute(text(statement))
+        except OperationalError:
+            # SQLite was compiled without FTS5
+            return None
+        if not exists:
+            # Index the tasks that were written before the table existed
+            conn.execute(text("INSERT INTO task_fts(task_fts) VALUES ('rebuild')"))
+    return 'fts5'
+
+
+def _init_postgres():
+    # Only look: every worker runs this at startup, and the DDL locks the table
+    with db.engine.connect() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'task' AND column_name = 'search_vector'"
+        )).first() is not None
+    return 'tsvector' if exists else None
+
+
+def create_search_index(conn):
+    """Add the PostgreSQL search column and its index if missing; conn must be in autocommit mode"""
+    if conn.dialect.name != 'postgresql':
+        return False
+    for statement in POSTGRES_FTS_STATEMENTS:
+        conn.execute(text(statement))
+    return True
+
+
+def _backend():
+    return current_app.extensions.get('task_search')
+
+
+def _rounded(rank):
+    # PostgreSQL only rounds numerics to a number of places
+    return cast(func.round(cast(rank, db.Numeric), RANK_PRECISION), db.Float)
+
+
+def apply_search(query, query_string, user_id=None):
+    """Restrict a Task query to tasks matching query_string.
+
+    Pass the user_id the query is already limited to so only that user's
+    matches are ranked. Returns (query, rank) where rank is a SQL expression
+    that sorts the best matches first when ordered ascending, or None when
+    results can't be ranked.
+    """
+    terms = search_terms(query_string)
+    backend = _backend()
+
+    if backend == 'fts5' and terms:
+        # Quote every term so FTS5 operators typed by the user are matched literally
+        match = ' '.join(f'"{term}"*' for term in terms)
+        if user_id is None:
+            matches = text(
+                "SELECT rowid, bm25(task_fts, 10.0, 1.0) AS rank FROM task_fts WHERE task_fts MATCH :match"
+            ).bindparams(match=match)
+        else:
+            # Score only this user's matches, not every user's
+            matches = text(
+                "SELECT task_fts.rowid AS rowid, bm25(task_fts, 10.0, 1.0) AS rank FROM task_fts "
+                "JOIN task ON task.id = task_fts.rowid "
+                "WHERE task_fts MATCH :match AND task.user_id = :user_id"
+            ).bindparams(match=match, user_id=user_id)
+        matches = matches.columns(rowid=db.Integer, rank=db.Float).subquery('task_matches')
+        query = query.join(matches, matches.c.rowid == Task.id)
+        return query, _rounded(matches.c.rank)
+
+    if backend == 'tsvector' and terms:
+        tsquery = func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+        vector = literal_column('task.search_vector')
+        query = query.filter(vector.op('@@')(tsquery))
+        return query, _rounded(-func.ts_rank(vector, tsquery))
+
+    query = query.filter(
+        or_(
+            Task.title.ilike(f'%{query_string}%'),
+            Task.description.ilike(f'%{query_string}%')
+        )
+    )
+    return query, None
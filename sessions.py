@@ -0,0 +1,229 @@
+"""
+Server-side sessions and the logged-in user
+
+With SESSION_BACKEND = 'database' the session cookie holds only a random
+token; the session data (including Google OAuth credentials) stays in the
+web_session table and never travels with a request. Rows are written only
+when the session changed, or at most once per SESSION_TOUCH_INTERVAL to
+extend their expiry, so an ordinary page view costs one indexed SELECT.
+Expired rows are deleted by `python commands.py purge-sessions`.
+
+get_current_user loads the logged-in user at most once per request and,
+if USER_CACHE_TTL is set, from a process-wide cache for that many seconds.
+The cache is dropped whenever this process writes a user row through the
+ORM, but not when another process does, so views that change the user
+load its row from the database instead.
+"""
+import hashlib
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app, g, session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import delete, event, inspect, select, update
+from sqlalchemy.orm import Session, make_transient_to_detached
+from werkzeug.datastructures import CallbackDict
+from models import db, User, WebSession
+
+_serializer = TaggedJSONSerializer()
+
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _session_id(token):
+    return hashlib.sha256(token.encode('ascii')).hexdigest()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data loaded from the web_session table"""
+
+    def __init__(self, initial=None, token=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.token = token
+        self.expires_at = expires_at
+        self.previous_token = None
+        self.modified = False
+
+    def regenerate(self):
+        """Move the data to a fresh token, e.g. on login to prevent session fixation"""
+        if self.token and not self.previous_token:
+            self.previous_token = self.token
+        self.token = None
+        self.modified = True
+
+
+class DatabaseSessionInterface(SessionInterface):
+    """Keeps session data in the database behind a compact random cookie"""
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if not token or len(token) > 64:
+            return ServerSession()
+        row = db.session.execute(
+            select(WebSession.data, WebSession.expires_at)
+            .where(WebSession.id == _session_id(token), WebSession.expires_at > _utcnow())
+        ).first()
+        if row is None:
+            return ServerSession()
+        try:
+            data = _serializer.loads(row.data)
+        except ValueError:
+            return ServerSession()
+        return ServerSession(data, token=token, expires_at=row.expires_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        statements = []
+        if session.previous_token:
+            statements.append(delete(WebSession).where(WebSession.id == _session_id(session.previous_token)))
+
+        if not session:
+            if session.token:
+                statements.append(delete(WebSession).where(WebSession.id == _session_id(session.token)))
+            self._execute(statements)
+            if session.token or session.previous_token:
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        now = _utcnow()
+        lifetime = app.permanent_session_lifetime
+        touch_interval = timedelta(seconds=app.config['SESSION_TOUCH_INTERVAL'])
+        stale = session.expires_at is not None and session.expires_at - lifetime + touch_interval <= now
+        if not (session.modified or session.token is None or stale):
+            self._execute(statements)
+            return
+
+        values = {
+            'user_id': session.get('user_id'),
+            'data': _serializer.dumps(dict(session)),
+            'expires_at': now + lifetime,
+        }
+        if session.token is None:
+            session.token = secrets.token_urlsafe(32)
+            statements.append(WebSession.__table__.insert().values(id=_session_id(session.token), **values))
+        else:
+            statements.append(update(WebSession).where(WebSession.id == _session_id(session.token)).values(**values))
+        self._execute(statements)
+
+        response.set_cookie(
+            name, session.token,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    @staticmethod
+    def _execute(statements):
+        # A connection of its own, so saving the session never commits (or
+        # waits on) whatever the view left unfinished in db.session
+        if statements:
+            with db.engine.begin() as conn:
+                for statement in statements:
+                    conn.execute(statement)
+
+
+def regenerate_session():
+    """Give the current session a new token if the backend supports it"""
+    if isinstance(session, ServerSession):
+        session.regenerate()
+
+
+def end_user_sessions(user_id, keep_current=True):
+    """Log a user out everywhere, optionally except in the current session"""
+    statement = delete(WebSession).where(WebSession.user_id == user_id)
+    if keep_current and isinstance(session, ServerSession) and session.token:
+        statement = statement.where(WebSession.id != _session_id(session.token))
+    return db.session.execute(statement).rowcount
+
+
+def purge_expired_sessions():
+    """Delete expired session rows, returning how many were removed"""
+    result = db.session.execute(delete(WebSession).where(WebSession.expires_at <= _utcnow()))
+    db.session.commit()
+    return result.rowcount
+
+
+def get_current_user():
+    """The logged-in User (None when logged out), loaded at most once per request"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+    user = g.get('current_user')
+    if user is None or user.id != user_id:
+        user = g.current_user = _load_user(user_id)
+    return user
+
+
+def _load_user(user_id):
+    ttl = current_app.config['USER_CACHE_TTL']
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+    if cached and cached[0] > now:
+        # Attach a copy to this session without a SELECT
+        user = User(**cached[1])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None and ttl:
+        columns = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+        with _user_cache_lock:
+            _user_cache[user_id] = (now + ttl, columns)
+    return user
+
+
+def invalidate_user(*user_ids):
+    """Drop cached users"""
+    with _user_cache_lock:
+        for user_id in user_ids:
+            _user_cache.pop(user_id, None)
+
+
+def init_sessions(app):
+    """Install the configured session backend and the per-request user cache"""
+    if app.config['SESSION_BACKEND'] == 'database':
+        app.session_interface = DatabaseSessionInterface()
+
+    @app.before_request
+    def forget_current_user():
+        # g outlives a request when an app context was pushed around it
+        g.pop('current_user', None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_user_writes(session, flush_context):
+    users = session.info.setdefault('user_cache_dirty', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            users.add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    users = session.info.pop('user_cache_dirty', None)
+    if users:
+        invalidate_user(*users)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back_users(session, previous_transaction):
+    session.info.pop('user_cache_dirty', None)
@@ -0,0 +1,101 @@
+"""
+Aggregate task statistics computed in SQL
+
+Per-user task statistics can be cached in process memory for
+STATS_CACHE_TTL seconds (off by default). Any flushed write to a user's
+tasks drops that user's entry once the transaction commits, but only in
+the process that made it; code that changes tasks with set-based UPDATE
+or DELETE statements must call invalidate_task_stats itself.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import event, func, case, and_
+from sqlalchemy.orm import Session
+from models import db, Task
+
+STATUSES = ('pending', 'in_progress', 'completed')
+PRIORITIES = ('High', 'Medium', 'Low')
+
+_stats_cache = {}
+_stats_cache_lock = threading.Lock()
+
+
+def category_task_counts(user_id):
+    """Map each of the user's category ids to its number of tasks"""
+    rows = db.session.query(Task.category_id, func.count(Task.id)).filter(
+        Task.user_id == user_id,
+        Task.category_id.isnot(None)
+    ).group_by(Task.category_id).all()
+    return {category_id: count for category_id, count in rows}
+
+
+def category_has_tasks(category_id):
+    """Check whether any task belongs to the category without loading them"""
+    return db.session.query(Task.query.filter_by(category_id=category_id).exists()).scalar()
+
+
+def compute_task_stats(user_id):
+    """Count the user's tasks by status and priority, plus overdue ones, in one query"""
+    now = datetime.now(timezone.utc)
+    overdue = case((and_(Task.due_date < now, Task.status != 'completed'), 1), else_=0)
+    rows = db.session.query(
+        Task.status, Task.priority, func.count(Task.id), func.sum(overdue)
+    ).filter(Task.user_id == user_id).group_by(Task.status, Task.priority).all()
+
+    stats = {
+        'total': 0,
+        'overdue': 0,
+        'by_status': {status: 0 for status in STATUSES},
+        'by_priority': {priority: 0 for priority in PRIORITIES},
+    }
+    for status, priority, count, overdue_count in rows:
+        stats['total'] += count
+        stats['overdue'] += overdue_count or 0
+        stats['by_status'][status] = stats['by_status'].get(status, 0) + count
+        stats['by_priority'][priority] = stats['by_priority'].get(priority, 0) + count
+    return stats
+
+
+def task_stats(user_id):
+    """Return the user's task statistics, served from the cache while fresh"""
+    ttl = current_app.config['STATS_CACHE_TTL']
+    now = time.monotonic()
+    with _stats_cache_lock:
+        cached = _stats_cache.get(user_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    stats = compute_task_stats(user_id)
+    if ttl:
+        with _stats_cache_lock:
+            _stats_cache[user_id] = (now + ttl, stats)
+    return stats
+
+
+def invalidate_task_stats(*user_ids):
+    """Drop cached statistics for the given users"""
+    with _stats_cache_lock:
+        for user_id in user_ids:
+            _stats_cache.pop(user_id, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_task_writes(session, flush_context):
+    users = session.info.setdefault('stats_dirty_users', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Task) and obj.user_id is not None:
+            users.add(obj.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_writes(session):
+    users = session.info.pop('stats_dirty_users', None)
+    if users:
+        invalidate_task_stats(*users)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back_writes(session, previous_transaction):
+    session.info.pop('stats_dirty_users', None)
@@ -0,0 +1,258 @@
+"""
+Storage backends for uploaded files
+
+The blob store addresses files by name only and leaves where the bytes
+live to a backend chosen with STORAGE_BACKEND:
+
+- 'local':   one directory, name -> <root>/<name>
+- 'sharded': name -> <root>/<ab>/<cd>/<name>, keeping directories small
+- 's3':      an S3-compatible bucket (AWS, MinIO, ...), so stored files
+             need no shared disk; downloads use presigned URLs
+
+Only finished files go through the backend. Partial resumable uploads,
+staging files and calendar exports stay on the local UPLOAD_FOLDER and
+EXPORT_FOLDER, so several web nodes need sticky routing per user or a
+shared disk for those.
+
+Every backend streams: put reads from a file object in chunks and open
+returns a file object, so no file is ever held in memory whole.
+"""
+import os
+import shutil
+from flask import current_app
+
+# Bytes copied per step when streaming between files
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class StorageBackend:
+    """Interface every storage backend implements"""
+
+    def put(self, name, stream):
+        """Store the contents of a binary stream under name"""
+        raise NotImplementedError
+
+    def put_file(self, name, path):
+        """Store a local file under name; the file at path is consumed"""
+        with open(path, 'rb') as f:
+            self.put(name, f)
+        os.remove(path)
+
+    def open(self, name):
+        """Open a stored file for streaming reads"""
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def touch(self, name):
+        """Set a stored file's modification time to now, returning False if it doesn't exist"""
+        raise NotImplementedError
+
+    def delete(self, name):
+        """Remove a stored file; missing files are ignored"""
+        raise NotImplementedError
+
+    def list(self, prefix=''):
+        """Yield the names of stored files starting with prefix, in name order"""
+        raise NotImplementedError
+
+    def modified(self, name):
+        """Last modification time of a stored file, as a Unix timestamp"""
+        raise NotImplementedError
+
+    def local_path(self, name):
+        """Filesystem path of a stored file, or None if it isn't on local disk"""
+        return None
+
+    def url(self, name, expires, download_name=None, mimetype=None):
+        """Time-limited URL a browser can download from directly, or None"""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Files in a single local directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def put(self, name, stream):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.part'
+        with open(tmp, 'wb') as out:
+            shutil.copyfileobj(stream, out, COPY_CHUNK_SIZE)
+        os.replace(tmp, path)
+
+    def put_file(self, name, path):
+        # Same filesystem as the staging area, so a rename rather than a copy
+        dest = self.path(name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(path, dest)
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def touch(self, name):
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix=''):
+        if not os.path.isdir(self.root):
+            return
+        yield from _file_names(self.root, prefix)
+
+    def modified(self, name):
+        return os.path.getmtime(self.path(name))
+
+    def local_path(self, name):
+        return self.path(name)
+
+
+class ShardedStorage(LocalStorage):
+    """Local files spread over <ab>/<cd>/ subdirectories by the first characters of the name"""
+
+    def path(self, name):
+        return os.path.join(self.root, name[:2], name[2:4], name)
+
+    def list(self, prefix=''):
+        if len(prefix) >= 4:
+            # Everything with this prefix lives in one shard
+            directory = os.path.dirname(self.path(prefix))
+            if os.path.isdir(directory):
+                yield from _file_names(directory, prefix)
+            return
+        # Shards are named after the leading characters, so walking them in
+        # order keeps the names in order
+        for top in _subdirectories(self.root):
+            for shard in _subdirectories(top):
+                yield from _file_names(shard, prefix)
+
+
+class S3Storage(StorageBackend):
+    """Objects in an S3-compatible bucket, through a boto3-style client"""
+
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def put(self, name, stream):
+        # upload_fileobj reads in parts and switches to multipart uploads for large files
+        self.client.upload_fileobj(stream, self.bucket, self._key(name))
+
+    def open(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(name))['Body']
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+        return True
+
+    def touch(self, name):
+        # Copying an object onto itself is the only way to renew LastModified
+        key = self._key(name)
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket, Key=key, CopySource={'Bucket': self.bucket, 'Key': key},
+                MetadataDirective='REPLACE'
+            )
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+        return True
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for obj in page.get('Contents', ()):
+                yield obj['Key'][len(self.prefix):]
+
+    def modified(self, name):
+        head = self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        return head['LastModified'].timestamp()
+
+    def url(self, name, expires, download_name=None, mimetype=None):
+        params = {'Bucket': self.bucket, 'Key': self._key(name)}
+        if download_name:
+            params['ResponseContentDisposition'] = f'inline; filename="{download_name}"'
+        if mimetype:
+            params['ResponseContentType'] = mimetype
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+
+
+def _file_names(directory, prefix):
+    """Sorted names of the files in one directory starting with prefix"""
+    with os.scandir(directory) as entries:
+        return sorted(entry.name for entry in entries if entry.name.startswith(prefix) and entry.is_file())
+
+
+def _subdirectories(path):
+    if not os.path.isdir(path):
+        return []
+    with os.scandir(path) as entries:
+        return sorted(entry.path for entry in entries if entry.is_dir())
+
+
+def _is_not_found(exception):
+    """Whether a botocore ClientError means the object doesn't exist"""
+    code = getattr(exception, 'response', {}).get('Error', {}).get('Code')
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+def build_s3_client(config):
+    """boto3 S3 client for the configured endpoint"""
+    import boto3
+    return boto3.client(
+        's3',
+        endpoint_url=config['S3_ENDPOINT_URL'],
+        region_name=config['S3_REGION']
+    )
+
+
+def create_storage(config):
+    """Build the backend selected by STORAGE_BACKEND"""
+    backend = config['STORAGE_BACKEND']
+    root = os.path.join(config['UPLOAD_FOLDER'], 'blobs')
+    if backend == 'local':
+        return LocalStorage(root)
+    if backend == 'sharded':
+        return ShardedStorage(root)
+    if backend == 's3':
+        factory = config.get('S3_CLIENT_FACTORY') or build_s3_client
+        return S3Storage(factory(config), config['S3_BUCKET'], config['S3_PREFIX'])
+    raise ValueError(f'Unknown STORAGE_BACKEND {backend!r}')
+
+
+def get_storage():
+    """The current app's storage backend, created on first use"""
+    storage = current_app.extensions.get('storage')
+    if storage is None:
+        storage = current_app.extensions['storage'] = create_storage(current_app.config)
+    return storage
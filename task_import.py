@@ -0,0 +1,228 @@
+"""
+Bulk import of tasks from CSV and iCalendar files
+
+Files are parsed as a stream, one row or event at a time, and valid rows
+are written with bulk_insert_mappings in chunks of IMPORT_BATCH_SIZE, so a
+syllabus with hundreds of deadlines costs a handful of INSERTs rather than
+one request per task. Invalid rows are reported with their line number and
+skipped; they don't stop the rest of the import.
+
+CSV files need a header row with a title column and may also have
+description, due_date (YYYY-MM-DD, optionally with a time), status,
+priority and category. Calendar files may hold VEVENTs or VTODOs.
+"""
+import codecs
+import csv
+from datetime import date, datetime
+from flask import current_app
+from models import db, Task, Category
+from stats import STATUSES, PRIORITIES, invalidate_task_stats
+
+# Longest title a task column can hold
+MAX_TITLE_LENGTH = 200
+
+_ICS_STATUSES = {'COMPLETED': 'completed', 'IN-PROCESS': 'in_progress', 'NEEDS-ACTION': 'pending'}
+
+
+class ImportRowError(ValueError):
+    """A row that can't become a task"""
+
+
+def iter_csv_rows(stream):
+    """Iterator of (line number, row dict) over a binary CSV stream.
+
+    The header is read and checked straight away, so a file without a title
+    column raises ImportRowError here rather than partway through an import.
+    """
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    reader = csv.DictReader(lines)
+    try:
+        fieldnames = reader.fieldnames
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ImportRowError(f'Unreadable CSV file: {e}') from e
+    if not fieldnames or 'title' not in [(name or '').strip().lower() for name in fieldnames]:
+        raise ImportRowError('The CSV file needs a header row with a title column')
+    return _csv_rows(reader)
+
+
+def _csv_rows(reader):
+    for row in reader:
+        yield reader.line_num, {
+            (key or '').strip().lower().replace(' ', '_'): value.strip() if isinstance(value, str) else ''
+            for key, value in row.items()
+        }
+
+
+def _unfolded_lines(stream):
+    """Yield (line number, logical line) from a binary iCalendar stream, joining folded lines"""
+    current, start = None, 0
+    for number, raw in enumerate(stream, 1):
+        line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, number
+    if current is not None:
+        yield start, current
+
+
+def iter_ics_rows(stream):
+    """Yield (line number, row dict) for each VEVENT/VTODO of a binary iCalendar stream.
+
+    Only one component is held in memory at a time.
+    """
+    from icalendar import Component
+    block, start = None, 0
+    for number, line in _unfolded_lines(stream):
+        if line in ('BEGIN:VEVENT', 'BEGIN:VTODO'):
+            block, start = [line], number
+        elif block is not None:
+            block.append(line)
+            if line in ('END:VEVENT', 'END:VTODO'):
+                try:
+                    row = _ics_row(Component.from_ical('\r\n'.join(block)))
+                except (ValueError, TypeError) as e:
+                    row = ImportRowError(f'Unreadable event: {e}')
+                yield start, row
+                block = None
+
+
+def _ics_row(component):
+    due = component.get('due') or component.get('dtstart')
+    categories = component.get('categories')
+    if isinstance(categories, list):
+        categories = categories[0] if categories else None
+    category = categories.cats[0] if categories is not None and categories.cats else ''
+    priority = component.get('priority')
+    return {
+        'title': str(component.get('summary', '')).strip(),
+        'description': str(component.get('description', '')).strip(),
+        'due_date': due.dt if due is not None else None,
+        'status': _ICS_STATUSES.get(str(component.get('status', '')).upper(), 'pending'),
+        # RFC 5545: 1-4 high, 5 medium, 6-9 low, 0 undefined
+        'priority': 'Medium' if not priority else 'High' if int(priority) < 5 else 'Medium' if int(priority) == 5 else 'Low',
+        'category': str(category).strip(),
+    }
+
+
+def _parse_due_date(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        # Due dates are naive wall-clock times, as in the calendar export
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ImportRowError(f'Invalid due date {value!r}, expected YYYY-MM-DD')
+
+
+def _normalize_choice(value, choices, default, label):
+    if not value:
+        return default
+    for choice in choices:
+        if value.strip().lower().replace(' ', '_') == choice.lower():
+            return choice
+    raise ImportRowError(f'Unknown {label} {value!r}')
+
+
+class TaskImporter:
+    """Validates rows and inserts them for one user in batches"""
+
+    def __init__(self, user_id, batch_size=None, max_rows=None):
+        self.user_id = user_id
+        self.batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+        self.max_rows = max_rows or current_app.config['IMPORT_MAX_ROWS']
+        self.max_errors = current_app.config['IMPORT_MAX_ERRORS']
+        # Category names (case-insensitive) to ids, loaded once for the whole import
+        self.categories = {
+            name.lower(): category_id
+            for category_id, name in db.session.query(Category.id, Category.name).filter_by(user_id=user_id)
+        }
+        self.pending = []
+        self.result = {'imported': 0, 'categories_created': 0, 'errors': [], 'error_count': 0}
+
+    def _category_id(self, name):
+        if not name:
+            return None
+        name = name[:50]
+        key = name.lower()
+        if key not in self.categories:
+            category = Category(name=name, user_id=self.user_id)
+            db.session.add(category)
+            db.session.flush()
+            self.categories[key] = category.id
+            self.result['categories_created'] += 1
+        return self.categories[key]
+
+    def _mapping(self, row):
+        title = row.get('title') or ''
+        if not title:
+            raise ImportRowError('Missing title')
+        if len(title) > MAX_TITLE_LENGTH:
+            raise ImportRowError(f'Title longer than {MAX_TITLE_LENGTH} characters')
+        return {
+            'title': title,
+            'description': row.get('description') or '',
+            'due_date': _parse_due_date(row.get('due_date')),
+            'status': _normalize_choice(row.get('status'), STATUSES, 'pending', 'status'),
+            'priority': _normalize_choice(row.get('priority'), PRIORITIES, 'Medium', 'priority'),
+            'category_id': self._category_id(row.get('category')),
+            'user_id': self.user_id,
+        }
+
+    def _error(self, line, message):
+        self.result['error_count'] += 1
+        # Keep the report bounded however broken the file is
+        if len(self.result['errors']) < self.max_errors:
+            self.result['errors'].append({'line': line, 'error': message})
+
+    def _flush(self):
+        if self.pending:
+            db.session.bulk_insert_mappings(Task, self.pending)
+            db.session.commit()
+            self.result['imported'] += len(self.pending)
+            self.pending = []
+
+    def run(self, rows):
+        """Import (line number, row dict or ImportRowError) pairs, returning the report"""
+        seen = 0
+        try:
+            for line, row in rows:
+                seen += 1
+                if seen > self.max_rows:
+                    self._error(line, f'Stopped after {self.max_rows} rows')
+                    break
+                try:
+                    if isinstance(row, ImportRowError):
+                        raise row
+                    self.pending.append(self._mapping(row))
+                except ImportRowError as e:
+                    self._error(line, str(e))
+                    continue
+                if len(self.pending) >= self.batch_size:
+                    self._flush()
+        except (ImportRowError, UnicodeDecodeError, csv.Error) as e:
+            # The file itself is unreadable from here on; keep what was imported
+            self._error(None, str(e))
+        self._flush()
+        # bulk_insert_mappings skips the ORM events that normally do this
+        invalidate_task_stats(self.user_id)
+        return self.result
+
+
+def import_tasks(user_id, stream, filename):
+    """Import tasks from a CSV or .ics binary stream for a user, returning the report"""
+    if filename.lower().endswith('.ics'):
+        rows = iter_ics_rows(stream)
+    elif filename.lower().endswith('.csv'):
+        rows = iter_csv_rows(stream)
+    else:
+        raise ImportRowError('Import files must be .csv or .ics')
+    return TaskImporter(user_id).run(rows)
@@ -1,6 +1,7 @@
 """
 Pytest configuration and fixtures for Student Study Planner tests
 """
+import io
 import os
 import tempfile
 import pytest
@@ -14,6 +15,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from __init__ import create_app
 from models import db, User, Task, Category
+from stats import _stats_cache
+from sessions import _user_cache
 
 
 @pytest.fixture
@@ -22,19 +25,28 @@ def app():
     # Create a temporary file to isolate the database for each test
     db_fd, db_path = tempfile.mkstemp()
     
-    app = create_app()
-    app.config.update({
+    # Applied before the app binds its engine, so tests never touch instance/
+    app = create_app(test_config={
         'TESTING': True,
         'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
         'WTF_CSRF_ENABLED': False,
         'SECRET_KEY': 'test-secret-key',
-        'UPLOAD_FOLDER': tempfile.mkdtemp()
+        'QUERY_COUNT_HEADER': True,
+        'UPLOAD_FOLDER': tempfile.mkdtemp(),
+        'EXPORT_FOLDER': tempfile.mkdtemp(),
+        'THUMBNAIL_WORKERS': 0,
+        'PASSWORD_HASH_WORKERS': 0
     })
+    # Ids restart in every test database, so drop per-process caches keyed by them
+    _stats_cache.clear()
+    _user_cache.clear()
 
     # Create the database and load test data
     with app.app_context():
         db.create_all()
         yield app
+        db.session.remove()
+        db.engine.dispose()
 
     # Clean up the temporary database
     os.close(db_fd)
@@ -110,6 +122,32 @@ def test_task(app, test_user, test_category):
         return {'id': task_id, 'title': task.title, 'user_id': test_user['id'], 'category_id': test_category['id']}
 
 
+@pytest.fixture
+def add_task(app):
+    """Return a function adding a task for a user and returning it."""
+    def add(user_id, title='Test task', description='', status='pending', **fields):
+        task = Task(title=title, description=description, status=status, user_id=user_id, **fields)
+        db.session.add(task)
+        db.session.commit()
+        return task
+    return add
+
+
+@pytest.fixture
+def create_task_with_files(client):
+    """Return a function posting a new task with (content, filename) attachments."""
+    def create(title, files):
+        return client.post('/task/create', data={
+            'title': title,
+            'description': '',
+            'due_date': '',
+            'status': 'pending',
+            'priority': 'Medium',
+            'file': [(io.BytesIO(content), filename) for content, filename in files]
+        })
+    return create
+
+
 @pytest.fixture
 def auth_headers(client, test_user):
     """Get authentication headers for API requests."""
@@ -0,0 +1,94 @@
+"""
+Tests for username and email uniqueness
+"""
+import threading
+import uuid
+import pytest
+
+from models import User
+import routes.auth
+
+
+def register(client, username, email, password='pass12345'):
+    return client.post('/register', data={
+        'username': username, 'email': email, 'password': password, 'confirm_password': password
+    })
+
+
+@pytest.fixture
+def names():
+    """A username and email no other test uses."""
+    unique = uuid.uuid4().hex[:8]
+    return f'student_{unique}', f'student_{unique}@example.com'
+
+
+@pytest.fixture(autouse=True)
+def cheap_hashes(app):
+    """Hash quickly; these tests are about the writes."""
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+
+class TestRegister:
+    """Test cases for registering with taken names."""
+
+    def test_two_statements(self, client, names):
+        """Test a registration is one combined lookup and one insert."""
+        response = register(client, *names)
+        assert response.status_code == 302
+        assert response.headers['X-Query-Count'] == '2'
+
+    def test_taken_username_and_email(self, client, test_user, names):
+        """Test each taken value gets its own message."""
+        response = register(client, test_user['username'], names[1])
+        assert b'Username already exists!' in response.data
+        response = register(client, names[0], test_user['email'])
+        assert b'Email already registered!' in response.data
+
+    def test_integrity_error_mapped(self, client, app, test_user, names, monkeypatch):
+        """Test a conflict only the unique index sees gets the right message."""
+        # As if a concurrent request registered the names between lookup and insert
+        monkeypatch.setattr(routes.auth, 'check_available', lambda *args, **kwargs: None)
+        response = register(client, names[0], test_user['email'])
+        assert b'Email already registered!' in response.data
+        response = register(client, test_user['username'], names[1])
+        assert b'Username already exists!' in response.data
+        with app.app_context():
+            assert User.query.filter_by(username=names[0]).first() is None
+
+    def test_concurrent_registrations(self, app, names):
+        """Test the same username registered from many threads at once creates one account."""
+        barrier = threading.Barrier(8)
+        statuses = []
+
+        def race(i):
+            client = app.test_client()
+            barrier.wait()
+            response = register(client, names[0], f'racer{i}_{names[1]}')
+            statuses.append((response.status_code, b'Username already exists!' in response.data))
+
+        threads = [threading.Thread(target=race, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(statuses) == [(200, True)] * 7 + [(302, False)]
+        with app.app_context():
+            assert User.query.filter_by(username=names[0]).count() == 1
+
+
+class TestProfileUpdate:
+    """Test cases for changing the username or email."""
+
+    def test_taken_by_another_user(self, client, auth, app, test_user, names):
+        """Test another account's email is refused but the user's own names are kept fine."""
+        other = app.test_client()
+        register(other, *names)
+        auth.login()
+        response = client.post('/profile/update', data={'username': test_user['username'], 'email': names[1]},
+                               follow_redirects=True)
+        assert b'Email already registered!' in response.data
+
+        response = client.post('/profile/update', data={'username': test_user['username'], 'email': test_user['email']},
+                               follow_redirects=True)
+        assert b'Profile updated successfully!' in response.data
@@ -0,0 +1,135 @@
+"""
+Tests for multiple attachments per task
+"""
+import hashlib
+import io
+import os
+from sqlalchemy import text
+
+from models import db, Task, Blob, Attachment
+from attachments import attachment_summaries, migrate_file_paths
+import blobstore
+
+
+PDF = b'%PDF-1.4 reading list'
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+
+
+def task_id(app, title):
+    with app.app_context():
+        return Task.query.filter_by(title=title).order_by(Task.id.desc()).first().id
+
+
+class TestAttachments:
+    """Test cases for adding and removing attachments."""
+
+    def test_create_with_several_files(self, client, auth, app, test_user, create_task_with_files):
+        """Test every file posted with a new task becomes an attachment."""
+        auth.login()
+        create_task_with_files('Reading', [(PDF, 'list.pdf'), (PNG, 'cover.png')])
+        with app.app_context():
+            task = db.session.get(Task, task_id(app, 'Reading'))
+            assert [(a.filename, a.mime, a.size) for a in task.attachments] == [
+                ('list.pdf', 'application/pdf', len(PDF)),
+                ('cover.png', 'image/png', len(PNG)),
+            ]
+            assert task.attachments[0].sha256 == hashlib.sha256(PDF).hexdigest()
+
+        response = client.get(f"/task/{task_id(app, 'Reading')}")
+        assert b'list.pdf' in response.data
+        assert b'cover.png' in response.data
+
+    def test_add_and_remove(self, client, auth, app, test_task):
+        """Test files can be attached to and detached from an existing task."""
+        auth.login()
+        response = client.post(f"/task/{test_task['id']}/attachments", data={
+            'file': [(io.BytesIO(PDF), 'a.pdf'), (io.BytesIO(b'plain notes'), 'b.txt')]
+        })
+        assert response.status_code == 302
+        with app.app_context():
+            attachment_ids = [a.id for a in db.session.get(Task, test_task['id']).attachments]
+            assert len(attachment_ids) == 2
+
+        client.post(f"/task/{test_task['id']}/attachments/{attachment_ids[0]}/delete")
+        with app.app_context():
+            assert [a.filename for a in db.session.get(Task, test_task['id']).attachments] == ['b.txt']
+            assert db.session.get(Blob, hashlib.sha256(PDF).hexdigest()) is None
+
+    def test_other_users_attachment(self, client, auth, app, test_task):
+        """Test attachments can't be added to or removed from someone else's task."""
+        with app.app_context():
+            other = Task(title='Other', description='', user_id=test_task['user_id'] + 1000)
+            other.attachments.append(Attachment(key='b' * 32 + '_x.pdf', size=1, mime='application/pdf'))
+            db.session.add(other)
+            db.session.commit()
+            other_id, attachment_id = other.id, other.attachments[0].id
+        auth.login()
+
+        client.post(f'/task/{other_id}/attachments', data={'file': (io.BytesIO(PDF), 'a.pdf')})
+        client.post(f'/task/{other_id}/attachments/{attachment_id}/delete')
+        with app.app_context():
+            assert [a.id for a in db.session.get(Task, other_id).attachments] == [attachment_id]
+
+    def test_delete_task_releases_all(self, client, auth, app, test_user, create_task_with_files):
+        """Test deleting a task releases the blob of every attachment."""
+        auth.login()
+        create_task_with_files('Doomed', [(PDF, 'list.pdf'), (PNG, 'cover.png')])
+        doomed = task_id(app, 'Doomed')
+        client.post(f'/task/{doomed}/delete')
+        with app.app_context():
+            assert Blob.query.count() == 0
+            assert Attachment.query.filter_by(task_id=doomed).count() == 0
+
+
+class TestListingSummaries:
+    """Test cases for attachment counts on listing pages."""
+
+    def test_summaries(self, client, auth, app, test_user, create_task_with_files):
+        """Test counts and the first image come back for a batch of tasks."""
+        auth.login()
+        create_task_with_files('Mixed', [(PDF, 'list.pdf'), (PNG, 'cover.png'), (PNG, 'again.png')])
+        create_task_with_files('Papers', [(PDF, 'list.pdf')])
+        create_task_with_files('Bare', [])
+        mixed, papers, bare = (task_id(app, title) for title in ('Mixed', 'Papers', 'Bare'))
+        with app.app_context():
+            summaries = attachment_summaries([mixed, papers, bare])
+        png_key = f'{hashlib.sha256(PNG).hexdigest()}_cover.png'
+        assert summaries[mixed] == (3, png_key)
+        assert summaries[papers] == (1, None)
+        assert bare not in summaries
+
+        response = client.get('/dashboard')
+        assert b'3 attachments' in response.data
+        assert png_key.encode() in response.data
+
+    def test_listing_queries_dont_grow(self, client, auth, app, test_user, create_task_with_files):
+        """Test the dashboard doesn't load attachments task by task."""
+        auth.login()
+        create_task_with_files('Counted 0', [(PDF, 'list.pdf'), (PNG, 'cover.png')])
+        baseline = int(client.get('/dashboard').headers['X-Query-Count'])
+        for i in range(1, 6):
+            create_task_with_files(f'Counted {i}', [(PDF, 'list.pdf'), (PNG, 'cover.png')])
+        assert int(client.get('/dashboard').headers['X-Query-Count']) == baseline
+
+
+class TestMigration:
+    """Test cases for moving single file_path values into attachments."""
+
+    def test_migrate_file_paths(self, app, test_task):
+        """Test old file_path values become attachments exactly once."""
+        with app.app_context():
+            columns = [row[1] for row in db.session.execute(text('PRAGMA table_info(task)'))]
+            if 'file_path' not in columns:
+                db.session.execute(text('ALTER TABLE task ADD COLUMN file_path VARCHAR(500)'))
+            key = 'c' * 32 + '_syllabus.pdf'
+            with open(os.path.join(app.config['UPLOAD_FOLDER'], key), 'wb') as f:
+                f.write(PDF)
+            db.session.execute(text('UPDATE task SET file_path = :key WHERE id = :id'), {'key': key, 'id': test_task['id']})
+            db.session.commit()
+
+            assert migrate_file_paths() == 1
+            [attachment] = db.session.get(Task, test_task['id']).attachments
+            assert (attachment.key, attachment.size, attachment.mime) == (key, len(PDF), 'application/pdf')
+            assert attachment.sha256 is None
+            assert blobstore.key_path(key).endswith(key)
+            assert migrate_file_paths() == 0
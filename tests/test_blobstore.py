@@ -0,0 +1,214 @@
+"""
+Tests for the content-addressed upload store
+"""
+import hashlib
+import io
+import os
+import pytest
+
+from models import db, Task, Blob, Attachment
+import blobstore
+
+
+CONTENT = b'%PDF-1.4 lecture notes' * 100
+SHA = hashlib.sha256(CONTENT).hexdigest()
+
+
+class TestBlobStore:
+    """Test cases for storing and releasing blobs."""
+
+    def test_identical_uploads_share_one_blob(self, client, auth, app, test_user, create_task_with_files):
+        """Test the same bytes uploaded twice are stored once."""
+        auth.login()
+        create_task_with_files('First', [(CONTENT, 'notes.pdf')])
+        create_task_with_files('Second', [(CONTENT, 'copy.pdf')])
+
+        with app.app_context():
+            keys = [a.key for a in Attachment.query.join(Task).filter(Task.user_id == test_user['id']).order_by(Attachment.id)]
+            assert keys == [f'{SHA}_notes.pdf', f'{SHA}_copy.pdf']
+            blob = db.session.get(Blob, SHA)
+            assert blob.refcount == 2
+            assert blob.size == len(CONTENT)
+
+            path = blobstore.blob_path(SHA)
+            assert path.endswith(os.path.join('blobs', SHA[:2], SHA[2:4], SHA))
+            with open(path, 'rb') as f:
+                assert f.read() == CONTENT
+            # Nothing left behind in the staging directory
+            assert os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')) == []
+
+    def test_delete_releases_reference(self, client, auth, app, test_user, create_task_with_files):
+        """Test deleting tasks decrements the count and removes the last copy."""
+        auth.login()
+        create_task_with_files('First', [(CONTENT, 'notes.pdf')])
+        create_task_with_files('Second', [(CONTENT, 'notes.pdf')])
+        with app.app_context():
+            first, second = [t.id for t in Task.query.filter_by(user_id=test_user['id']).order_by(Task.id)]
+            path = blobstore.blob_path(SHA)
+
+        client.post(f'/task/{first}/delete')
+        with app.app_context():
+            assert db.session.get(Blob, SHA).refcount == 1
+            assert os.path.exists(path)
+
+        client.post(f'/task/{second}/delete')
+        with app.app_context():
+            assert db.session.get(Blob, SHA) is None
+        assert not os.path.exists(path)
+
+    def test_removing_attachment_releases_reference(self, client, auth, app, test_user, create_task_with_files):
+        """Test removing an attachment releases its blob and keeps the others."""
+        auth.login()
+        create_task_with_files('Task', [(CONTENT, 'notes.pdf')])
+        with app.app_context():
+            task_id = Task.query.filter_by(user_id=test_user['id']).one().id
+
+        client.post(f'/task/{task_id}/edit', data={
+            'title': 'Task',
+            'description': '',
+            'due_date': '',
+            'status': 'pending',
+            'priority': 'Medium',
+            'file': (io.BytesIO(b'new notes'), 'new.txt')
+        })
+        new_sha = hashlib.sha256(b'new notes').hexdigest()
+        with app.app_context():
+            keys = [a.key for a in db.session.get(Task, task_id).attachments]
+            assert keys == [f'{SHA}_notes.pdf', f'{new_sha}_new.txt']
+            first_id = db.session.get(Task, task_id).attachments[0].id
+
+        client.post(f'/task/{task_id}/attachments/{first_id}/delete')
+        with app.app_context():
+            assert [a.key for a in db.session.get(Task, task_id).attachments] == [f'{new_sha}_new.txt']
+            assert db.session.get(Blob, SHA) is None
+            assert db.session.get(Blob, new_sha).refcount == 1
+            assert not os.path.exists(blobstore.blob_path(SHA))
+
+    def test_duplicate_upload_renews_file(self, app):
+        """Test storing bytes that are already stored makes the file look new to garbage collection."""
+        with app.app_context():
+            blobstore.store_stream(io.BytesIO(CONTENT), 'notes.pdf')
+            db.session.commit()
+            path = blobstore.blob_path(SHA)
+            os.utime(path, (0, 0))
+
+            blobstore.store_stream(io.BytesIO(CONTENT), 'copy.pdf')
+            assert os.path.getmtime(path) > 0
+
+    def test_file_restored_after_racing_release(self, app):
+        """Test a duplicate upload puts the file back if a concurrent release removed it before commit."""
+        with app.app_context():
+            blobstore.store_stream(io.BytesIO(CONTENT), 'notes.pdf')
+            db.session.commit()
+            path = blobstore.blob_path(SHA)
+
+            blobstore.store_stream(io.BytesIO(CONTENT), 'copy.pdf')
+            # As if another request released the last reference and deleted the file meanwhile
+            os.remove(path)
+            db.session.commit()
+            with open(path, 'rb') as f:
+                assert f.read() == CONTENT
+            assert db.session.get(Blob, SHA).refcount == 2
+            assert os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')) == []
+
+    def test_rollback_keeps_file(self, app):
+        """Test a release that is rolled back does not delete the file."""
+        with app.app_context():
+            key = blobstore.store_stream(io.BytesIO(CONTENT), 'notes.pdf').key
+            db.session.commit()
+
+            blobstore.release(key)
+            db.session.rollback()
+            assert os.path.exists(blobstore.blob_path(SHA))
+            assert db.session.get(Blob, SHA).refcount == 1
+
+    def test_legacy_upload_removed(self, app):
+        """Test files saved before the blob store are still cleaned up."""
+        with app.app_context():
+            key = 'a' * 32 + '_old.txt'
+            path = os.path.join(app.config['UPLOAD_FOLDER'], key)
+            with open(path, 'wb') as f:
+                f.write(b'old')
+
+            assert blobstore.blob_sha(key) is None
+            blobstore.release(key)
+            db.session.commit()
+            assert not os.path.exists(path)
+
+    def test_serve_blob(self, client, auth, app, test_user, create_task_with_files):
+        """Test blobs are served under their original filename."""
+        auth.login()
+        create_task_with_files('Task', [(CONTENT, 'notes.pdf')])
+
+        response = client.get(f'/uploads/{SHA}_notes.pdf')
+        assert response.status_code == 200
+        assert response.data == CONTENT
+        assert response.mimetype == 'application/pdf'
+
+        assert client.get(f'/uploads/{"0" * 64}_missing.pdf').status_code == 404
+
+
+class TestUploadServing:
+    """Test cases for serving attachments."""
+
+    @pytest.fixture
+    def url(self, client, auth, test_user, create_task_with_files):
+        """Log in and attach a file, returning its URL."""
+        auth.login()
+        create_task_with_files('Task', [(CONTENT, 'notes.pdf')])
+        return f'/uploads/{SHA}_notes.pdf'
+
+    def test_only_owner_can_download(self, client, app, url):
+        """Test another user's attachment is not served."""
+        with app.app_context():
+            other = Task(title='Other', description='', user_id=999999)
+            other.attachments.append(Attachment(key=f'{SHA}_other.pdf', size=len(CONTENT), mime='application/pdf', sha256=SHA))
+            db.session.add(other)
+            db.session.commit()
+        assert client.get(url).status_code == 200
+        assert client.get(f'/uploads/{SHA}_other.pdf').status_code == 404
+
+    def test_recorded_mimetype_served(self, client, app, test_user, url):
+        """Test the attachment's sniffed type is sent rather than one guessed from its name."""
+        with app.app_context():
+            task = Task(title='Renamed', description='', user_id=test_user['id'])
+            task.attachments.append(Attachment(key=f'{SHA}_notes', size=len(CONTENT), mime='application/pdf', sha256=SHA))
+            db.session.add(task)
+            db.session.commit()
+        response = client.get(f'/uploads/{SHA}_notes')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/pdf'
+
+    def test_strong_etag_and_conditional_get(self, client, url):
+        """Test the content hash is a strong ETag honoured by If-None-Match."""
+        response = client.get(url)
+        assert response.headers['ETag'] == f'"{SHA}"'
+        assert 'private' in response.headers['Cache-Control']
+
+        response = client.get(url, headers={'If-None-Match': f'"{SHA}"'})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    def test_byte_range(self, client, url):
+        """Test partial content is served for Range requests."""
+        response = client.get(url, headers={'Range': 'bytes=10-19'})
+        assert response.status_code == 206
+        assert response.data == CONTENT[10:20]
+        assert response.headers['Content-Range'] == f'bytes 10-19/{len(CONTENT)}'
+        assert response.headers['Accept-Ranges'] == 'bytes'
+
+    def test_x_accel_redirect(self, client, app, url):
+        """Test nginx is handed the transfer when configured."""
+        app.config['UPLOAD_ACCEL_REDIRECT_PREFIX'] = '/_protected_uploads/'
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.data == b''
+        assert response.headers['X-Accel-Redirect'] == f'/_protected_uploads/blobs/{SHA[:2]}/{SHA[2:4]}/{SHA}'
+        assert response.mimetype == 'application/pdf'
+
+    def test_x_sendfile(self, client, app, url):
+        """Test Flask's X-Sendfile support is used when enabled."""
+        app.config['USE_X_SENDFILE'] = True
+        response = client.get(url)
+        with app.app_context():
+            assert response.headers['X-Sendfile'] == os.path.abspath(blobstore.blob_path(SHA))
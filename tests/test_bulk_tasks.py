@@ -0,0 +1,163 @@
+"""
+Tests for bulk task operations
+"""
+import hashlib
+import io
+import os
+import pytest
+
+from models import db, Task, Blob, Attachment, Category
+import blobstore
+
+
+PDF = b'%PDF-1.4 semester notes'
+SHA = hashlib.sha256(PDF).hexdigest()
+
+
+@pytest.fixture
+def tasks(app, test_user):
+    """Five tasks of the test user and one of somebody else, returning their ids."""
+    with app.app_context():
+        mine = [Task(title=f'Bulk {i}', description='', status='pending', priority='Medium', user_id=test_user['id'])
+                for i in range(5)]
+        other = Task(title='Not mine', description='', status='pending', priority='Medium', user_id=test_user['id'] + 1000)
+        db.session.add_all(mine + [other])
+        db.session.commit()
+        return [task.id for task in mine], other.id
+
+
+def statuses(app, ids):
+    with app.app_context():
+        return [db.session.get(Task, task_id).status for task_id in ids]
+
+
+class TestBulkUpdate:
+    """Test cases for changing many tasks at once."""
+
+    def test_status_change(self, client, auth, app, tasks):
+        """Test one request changes the status of every selected task the user owns."""
+        mine, other = tasks
+        auth.login()
+        response = client.post('/tasks/bulk/update', json={'task_ids': mine[:3] + [other], 'status': 'completed'})
+        assert response.status_code == 200
+        assert response.get_json()['updated'] == 3
+        assert statuses(app, mine) == ['completed'] * 3 + ['pending'] * 2
+        assert statuses(app, [other]) == ['pending']
+
+    def test_updated_at_is_bumped(self, client, auth, app, tasks):
+        """Test set-based updates still mark tasks as changed for the calendar sync."""
+        mine, _ = tasks
+        with app.app_context():
+            before = db.session.get(Task, mine[0]).updated_at
+        auth.login()
+        client.post('/tasks/bulk/update', json={'task_ids': mine[:1], 'priority': 'High'})
+        with app.app_context():
+            task = db.session.get(Task, mine[0])
+            assert task.priority == 'High'
+            assert task.updated_at > before
+
+    def test_form_move_to_category(self, client, auth, app, tasks, test_category):
+        """Test the dashboard form moves tasks to a category and can clear it again."""
+        mine, _ = tasks
+        auth.login()
+        response = client.post('/tasks/bulk/update', data={
+            'task_ids': [str(i) for i in mine], 'category_id': str(test_category['id'])
+        })
+        assert response.status_code == 302
+        with app.app_context():
+            assert {db.session.get(Task, i).category_id for i in mine} == {test_category['id']}
+
+        client.post('/tasks/bulk/update', data={'task_ids': [str(mine[0])], 'category_id': 'none'})
+        with app.app_context():
+            assert db.session.get(Task, mine[0]).category_id is None
+
+    def test_stats_cache_invalidated(self, client, auth, app, tasks):
+        """Test cached statistics reflect a bulk change straight away."""
+        mine, _ = tasks
+        auth.login()
+        assert client.get('/profile/stats').get_json()['by_status']['completed'] == 0
+        client.post('/tasks/bulk/update', json={'task_ids': mine, 'status': 'completed'})
+        assert client.get('/profile/stats').get_json()['by_status']['completed'] == 5
+
+    @pytest.mark.parametrize('payload', [
+        {'status': 'archived'},
+        {'priority': 'Urgent'},
+        {},
+        {'task_ids': [], 'status': 'completed'},
+        {'task_ids': 'all', 'status': 'completed'},
+        {'task_ids': [1.5], 'status': 'completed'},
+        {'task_ids': [True], 'status': 'completed'},
+        {'task_ids': ['1e3'], 'status': 'completed'},
+        {'task_ids': list(range(1, 600)), 'status': 'completed'},
+    ])
+    def test_invalid_requests(self, client, auth, tasks, payload):
+        """Test bad values, empty selections and oversized batches are refused."""
+        mine, _ = tasks
+        auth.login()
+        response = client.post('/tasks/bulk/update', json={'task_ids': mine, **payload})
+        assert response.status_code == 400
+
+    def test_other_users_category_refused(self, client, auth, app, tasks):
+        """Test tasks can't be moved into someone else's category."""
+        mine, other = tasks
+        with app.app_context():
+            category = Category(name='Theirs', user_id=other + 1000)
+            db.session.add(category)
+            db.session.commit()
+            category_id = category.id
+        auth.login()
+        response = client.post('/tasks/bulk/update', json={'task_ids': mine, 'category_id': category_id})
+        assert response.status_code == 400
+
+
+class TestBulkDelete:
+    """Test cases for deleting many tasks at once."""
+
+    def test_delete(self, client, auth, app, tasks):
+        """Test only the user's selected tasks are deleted."""
+        mine, other = tasks
+        auth.login()
+        response = client.post('/tasks/bulk/delete', json={'task_ids': mine[:2] + [other]})
+        assert response.get_json()['deleted'] == 2
+        with app.app_context():
+            assert db.session.get(Task, mine[0]) is None
+            assert db.session.get(Task, mine[2]) is not None
+            assert db.session.get(Task, other) is not None
+
+    def test_files_released_in_one_batch(self, client, auth, app, tasks):
+        """Test attachments go with their tasks and shared blobs keep their other references."""
+        mine, _ = tasks
+        auth.login()
+        for task_id in mine[:3]:
+            client.post(f'/task/{task_id}/attachments', data={'file': (io.BytesIO(PDF), 'notes.pdf')})
+        with app.app_context():
+            assert db.session.get(Blob, SHA).refcount == 3
+            path = blobstore.blob_path(SHA)
+
+        client.post('/tasks/bulk/delete', json={'task_ids': mine[:2]})
+        with app.app_context():
+            assert db.session.get(Blob, SHA).refcount == 1
+            assert Attachment.query.filter(Attachment.task_id.in_(mine[:2])).count() == 0
+        assert os.path.exists(path)
+
+        client.post('/tasks/bulk/delete', json={'task_ids': mine[2:3]})
+        with app.app_context():
+            assert db.session.get(Blob, SHA) is None
+        assert not os.path.exists(path)
+
+    def test_query_count_is_constant(self, client, auth, app, test_user):
+        """Test deleting more tasks doesn't issue more statements."""
+        auth.login()
+        counts = []
+        for n in (2, 10):
+            with app.app_context():
+                batch = [Task(title=f'Gone {i}', description='', user_id=test_user['id']) for i in range(n)]
+                for task in batch:
+                    task.attachments.append(Attachment(key=f'{os.urandom(32).hex()}_x.pdf', size=1, mime='application/pdf'))
+                db.session.add_all(batch)
+                db.session.commit()
+                ids = [task.id for task in batch]
+            response = client.post('/tasks/bulk/delete', json={'task_ids': ids})
+            assert response.get_json()['deleted'] == n
+            counts.append(int(response.headers['X-Query-Count']))
+        assert counts[0] == counts[1]
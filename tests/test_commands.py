@@ -0,0 +1,74 @@
+"""
+Tests for Flask CLI maintenance commands
+"""
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Category
+from commands import _widen_statements
+
+
+@pytest.fixture
+def isolated_db(app):
+    """The engine, after checking it is bound to this test's own temporary database."""
+    assert str(db.engine.url) == app.config['SQLALCHEMY_DATABASE_URI']
+    assert 'instance' not in db.engine.url.database.split('/')
+    return db.engine
+
+
+class TestCreateIndexesCommand:
+    """Test cases for the create-indexes command."""
+    
+    def test_indexes_declared_on_models(self, app):
+        """Test the composite indexes exist on a fresh database."""
+        task_indexes = {index['name'] for index in inspect(db.engine).get_indexes('task')}
+        assert {'ix_task_user_created', 'ix_task_user_status', 'ix_task_user_due_date'} <= task_indexes
+        
+        category_indexes = {index['name']: index for index in inspect(db.engine).get_indexes('category')}
+        assert category_indexes['uq_category_user_name']['unique']
+    
+    def test_rebuilds_missing_index(self, app, runner, isolated_db):
+        """Test the command creates an index missing from an older database."""
+        with isolated_db.begin() as conn:
+            conn.execute(text('DROP INDEX ix_task_user_created'))
+        
+        result = runner.invoke(args=['create-indexes'])
+        assert result.exit_code == 0
+        assert 'Index ix_task_user_created ready' in result.output
+        assert 'ix_task_user_created' in {index['name'] for index in inspect(db.engine).get_indexes('task')}
+    
+    def test_prints_plans_before_and_after(self, app, runner):
+        """Test the command reports query plans around the index build."""
+        result = runner.invoke(args=['create-indexes'])
+        assert result.exit_code == 0
+        before, after = result.output.split('== Query plans after ==')
+        assert '== Query plans before ==' in before
+        assert 'dashboard listing:' in after
+        assert 'ix_task_user_created' in after
+    
+    def test_duplicate_category_names_rejected(self, app, test_user):
+        """Test the unique index refuses two categories with the same name."""
+        db.session.add(Category(name='Duplicate', user_id=test_user['id']))
+        db.session.commit()
+        db.session.add(Category(name='Duplicate', user_id=test_user['id']))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+class TestUpgradeDbCommand:
+    """Test cases for the upgrade-db command."""
+    
+    def test_narrow_columns_found(self, app):
+        """Test a password_hash column created by an older version is widened for scrypt hashes."""
+        engine = create_engine('sqlite://')
+        with engine.begin() as conn:
+            conn.execute(text('CREATE TABLE "user" (id INTEGER PRIMARY KEY, username VARCHAR(80), password_hash VARCHAR(120))'))
+            assert _widen_statements(conn) == ['ALTER TABLE "user" ALTER COLUMN "password_hash" TYPE varchar(255)']
+    
+    def test_nothing_to_do_on_sqlite(self, runner):
+        """Test the command leaves SQLite alone."""
+        result = runner.invoke(args=['upgrade-db'])
+        assert result.exit_code == 0
+        assert 'Nothing to upgrade on SQLite' in result.output
@@ -0,0 +1,89 @@
+"""
+Tests for upload content sniffing
+"""
+import io
+import pytest
+
+from models import db, Task, Blob, Attachment
+from filetypes import sniff, FileTypeMismatch
+
+
+PNG = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR'
+
+
+class TestSniff:
+    """Test cases for matching content to file types."""
+
+    @pytest.mark.parametrize('filename, head, mime', [
+        ('notes.pdf', b'%PDF-1.7\n', 'application/pdf'),
+        ('board.PNG', PNG, 'image/png'),
+        ('photo.jpg', b'\xff\xd8\xff\xe0\x00\x10JFIF', 'image/jpeg'),
+        ('anim.gif', b'GIF89a\x01\x00', 'image/gif'),
+        ('essay.docx', b'PK\x03\x04\x14\x00', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+        ('old.doc', b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1\x00', 'application/msword'),
+        ('talk.mp3', b'ID3\x04\x00', 'audio/mpeg'),
+        ('talk.m4a', b'\x00\x00\x00\x20ftypM4A ', 'audio/mp4'),
+        ('clip.webm', b'\x1a\x45\xdf\xa3\x9f', 'video/webm'),
+        ('readme.txt', 'Lecture 3 – notes'.encode(), 'text/plain'),
+        ('empty.txt', b'', 'text/plain'),
+    ])
+    def test_matching_content(self, filename, head, mime):
+        """Test content with the right signature is accepted with its MIME type."""
+        assert sniff(head, filename) == mime
+
+    @pytest.mark.parametrize('filename, head', [
+        ('notes.pdf', b'MZ\x90\x00\x03\x00'),
+        ('photo.jpg', PNG),
+        ('readme.txt', b'\x7fELF\x02\x01\x01\x00'),
+        ('notes.pdf', b''),
+        ('tool.exe', b'MZ\x90\x00'),
+    ])
+    def test_mismatched_content(self, filename, head):
+        """Test content that isn't what its name says is rejected."""
+        with pytest.raises(FileTypeMismatch):
+            sniff(head, filename)
+
+
+class TestUploadValidation:
+    """Test cases for validation while storing uploads."""
+
+    def test_mime_recorded(self, client, auth, app, test_user):
+        """Test the sniffed MIME type and size are stored with the blob."""
+        auth.login()
+        content = PNG + b'\x00' * 100
+        client.post('/task/create', data={
+            'title': 'Picture', 'description': '', 'due_date': '',
+            'status': 'pending', 'priority': 'Medium',
+            'file': (io.BytesIO(content), 'board.png')
+        })
+        with app.app_context():
+            attachment = Attachment.query.join(Task).filter(Task.user_id == test_user['id'], Task.title == 'Picture').one()
+            assert (attachment.mime, attachment.size) == ('image/png', len(content))
+            blob = db.session.get(Blob, attachment.sha256)
+            assert blob.mime == 'image/png'
+            assert blob.size == len(content)
+
+    def test_disguised_file_rejected(self, client, auth, app, test_user):
+        """Test an executable renamed to .pdf is refused and nothing is stored."""
+        auth.login()
+        response = client.post('/task/create', data={
+            'title': 'Disguised', 'description': '', 'due_date': '',
+            'status': 'pending', 'priority': 'Medium',
+            'file': (io.BytesIO(b'MZ\x90\x00' + b'\x00' * 100), 'notes.pdf')
+        }, follow_redirects=True)
+        assert b'does not match its type' in response.data
+        with app.app_context():
+            assert Task.query.filter_by(title='Disguised').count() == 0
+
+    def test_edit_rejects_mismatch(self, client, auth, app, test_task):
+        """Test a rejected file leaves the task and its attachments alone."""
+        auth.login()
+        client.post(f"/task/{test_task['id']}/edit", data={
+            'title': 'Edited', 'description': '', 'due_date': '',
+            'status': 'pending', 'priority': 'Medium',
+            'file': (io.BytesIO(b'not a picture'), 'photo.png')
+        })
+        with app.app_context():
+            task = db.session.get(Task, test_task['id'])
+            assert task.title != 'Edited'
+            assert task.attachments == []
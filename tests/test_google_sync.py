@@ -0,0 +1,264 @@
+"""
+Tests for the incremental Google Calendar sync
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+
+from models import db, User, Task, Job, GoogleEventLink, GoogleSyncState
+from google_calendar import sync_tasks, GOOGLE_BATCH_SIZE
+from jobs import enqueue, run_pending
+
+DUE = datetime(2024, 5, 1)
+
+
+class FakeHttpError(Exception):
+    """Stand-in for googleapiclient.errors.HttpError."""
+    
+    def __init__(self, status):
+        super().__init__(f'HTTP {status}')
+        self.resp = type('Resp', (), {'status': status})()
+
+
+class FakeRequest:
+    def __init__(self, service, method, kwargs):
+        self.service = service
+        self.method = method
+        self.kwargs = kwargs
+    
+    def execute(self):
+        return self.service.handle(self.method, self.kwargs)
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+    
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+    
+    def execute(self):
+        self.service.batches.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except FakeHttpError as e:
+                self.callback(request_id, None, e)
+
+
+class FakeEvents:
+    def __init__(self, service):
+        self.service = service
+    
+    def insert(self, **kwargs):
+        return FakeRequest(self.service, 'insert', kwargs)
+    
+    def update(self, **kwargs):
+        return FakeRequest(self.service, 'update', kwargs)
+    
+    def delete(self, **kwargs):
+        return FakeRequest(self.service, 'delete', kwargs)
+
+
+class FakeCalendarService:
+    """In-memory Google Calendar API exposing the calls the sync uses."""
+    
+    def __init__(self):
+        self.events_by_id = {}
+        self.calls = []
+        self.batches = []
+        self.fail_with = None
+    
+    def events(self):
+        return FakeEvents(self)
+    
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+    
+    def handle(self, method, kwargs):
+        self.calls.append(method)
+        if self.fail_with:
+            raise FakeHttpError(self.fail_with)
+        if method == 'insert':
+            event_id = f'evt{len(self.events_by_id) + len(self.calls)}'
+            self.events_by_id[event_id] = kwargs['body']
+            return {'id': event_id}
+        if kwargs['eventId'] not in self.events_by_id:
+            raise FakeHttpError(404)
+        if method == 'update':
+            self.events_by_id[kwargs['eventId']] = kwargs['body']
+            return {'id': kwargs['eventId']}
+        del self.events_by_id[kwargs['eventId']]
+        return ''
+
+
+def _touch(task, **changes):
+    """Apply changes and move updated_at past the last sync watermark."""
+    for name, value in changes.items():
+        setattr(task, name, value)
+    task.updated_at = datetime.now(timezone.utc) + timedelta(seconds=1)
+    db.session.commit()
+
+
+class TestGoogleSync:
+    """Test cases for sync_tasks."""
+    
+    def test_first_sync_creates_events(self, app, test_user, add_task):
+        """Test every dated task is inserted once and linked."""
+        add_task(test_user['id'], 'Exam', due_date=DUE)
+        add_task(test_user['id'], 'Essay', due_date=DUE)
+        add_task(test_user['id'], 'Someday', due_date=None)
+        service = FakeCalendarService()
+        
+        counts = sync_tasks(test_user['id'], service)
+        assert counts == {'created': 2, 'updated': 0, 'deleted': 0, 'failed': 0}
+        assert GoogleEventLink.query.filter_by(user_id=test_user['id']).count() == 2
+        assert db.session.get(GoogleSyncState, test_user['id']).synced_at is not None
+    
+    def test_repeat_sync_sends_nothing(self, app, test_user, add_task):
+        """Test an unchanged task list makes no API calls."""
+        add_task(test_user['id'], 'Exam', due_date=DUE)
+        service = FakeCalendarService()
+        sync_tasks(test_user['id'], service)
+        service.calls.clear()
+        
+        counts = sync_tasks(test_user['id'], service)
+        assert counts == {'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+        assert service.calls == []
+        assert len(service.events_by_id) == 1
+    
+    def test_changed_and_deleted_tasks(self, app, test_user, add_task):
+        """Test edits become updates and deleted or undated tasks become deletes."""
+        exam = add_task(test_user['id'], 'Exam', due_date=DUE)
+        essay = add_task(test_user['id'], 'Essay', due_date=DUE)
+        quiz = add_task(test_user['id'], 'Quiz', due_date=DUE)
+        service = FakeCalendarService()
+        sync_tasks(test_user['id'], service)
+        service.calls.clear()
+        
+        _touch(exam, title='Final exam')
+        _touch(quiz, due_date=None)
+        db.session.delete(essay)
+        db.session.commit()
+        
+        counts = sync_tasks(test_user['id'], service)
+        assert counts == {'created': 0, 'updated': 1, 'deleted': 2, 'failed': 0}
+        assert sorted(service.calls) == ['delete', 'delete', 'update']
+        assert [event['summary'] for event in service.events_by_id.values()] == ['Final exam']
+    
+    def test_task_id_now_another_users(self, app, test_user, add_task):
+        """Test a link whose task id now belongs to someone else has its event deleted."""
+        exam = add_task(test_user['id'], 'Exam', due_date=DUE)
+        service = FakeCalendarService()
+        sync_tasks(test_user['id'], service)
+        
+        # As if the task was deleted and its id reused for another user's task
+        other = User(username='other_sync', email='other_sync@example.com', password_hash='x')
+        db.session.add(other)
+        db.session.commit()
+        _touch(exam, user_id=other.id)
+        
+        counts = sync_tasks(test_user['id'], service)
+        assert counts == {'created': 0, 'updated': 0, 'deleted': 1, 'failed': 0}
+        assert service.events_by_id == {}
+    
+    def test_calls_are_batched(self, app, test_user):
+        """Test calls are grouped into batch requests."""
+        for i in range(GOOGLE_BATCH_SIZE + 5):
+            db.session.add(Task(title=f'Task {i}', status='pending', user_id=test_user['id'],
+                                due_date=DUE))
+        db.session.commit()
+        service = FakeCalendarService()
+        
+        sync_tasks(test_user['id'], service)
+        assert service.batches == [GOOGLE_BATCH_SIZE, 5]
+    
+    def test_failures_keep_watermark(self, app, test_user, add_task):
+        """Test failed calls are retried by the next sync."""
+        add_task(test_user['id'], 'Exam', due_date=DUE)
+        service = FakeCalendarService()
+        service.fail_with = 500
+        
+        counts = sync_tasks(test_user['id'], service)
+        assert counts['failed'] == 1
+        assert db.session.get(GoogleSyncState, test_user['id']) is None
+        
+        service.fail_with = None
+        assert sync_tasks(test_user['id'], service)['created'] == 1
+    
+    def test_event_deleted_in_google_is_recreated(self, app, test_user, add_task):
+        """Test an event removed on the Google side is re-inserted."""
+        exam = add_task(test_user['id'], 'Exam', due_date=DUE)
+        service = FakeCalendarService()
+        sync_tasks(test_user['id'], service)
+        service.events_by_id.clear()
+        
+        _touch(exam, title='Moved exam')
+        sync_tasks(test_user['id'], service)
+        assert sync_tasks(test_user['id'], service)['created'] == 1
+        assert [event['summary'] for event in service.events_by_id.values()] == ['Moved exam']
+
+
+class TestGoogleSyncRoute:
+    """Test cases for the /google/sync endpoint."""
+    
+    def test_sync_uses_injected_service(self, client, auth, app, test_user, test_task):
+        """Test the route syncs through the configured service factory."""
+        service = FakeCalendarService()
+        app.config['GOOGLE_CALENDAR_SERVICE_FACTORY'] = lambda creds: service
+        auth.login()
+        with client.session_transaction() as sess:
+            sess['google_credentials'] = {'token': 'fake'}
+        
+        response = client.get('/google/sync')
+        assert response.status_code == 302
+        job_id = int(response.headers['Location'].split('job=')[1])
+        # Nothing reaches Google until a worker picks the job up
+        assert service.calls == []
+        
+        with app.app_context():
+            run_pending()
+            job = db.session.get(Job, job_id)
+            assert job.status == 'succeeded'
+            assert json.loads(job.result)['created'] == 1
+            # The OAuth token is not kept around once the job is done
+            assert 'credentials' not in json.loads(job.payload)
+        assert service.calls == ['insert']
+    
+    def test_sync_already_in_progress(self, client, auth, app, test_user, test_task):
+        """Test a second sync is not queued while the first hasn't finished."""
+        app.config['GOOGLE_CALENDAR_SERVICE_FACTORY'] = lambda creds: FakeCalendarService()
+        auth.login()
+        with client.session_transaction() as sess:
+            sess['google_credentials'] = {'token': 'fake'}
+        
+        first = client.get('/google/sync').headers['Location']
+        second = client.get('/google/sync').headers['Location']
+        assert second == first
+        with app.app_context():
+            assert Job.query.filter_by(kind='google_sync').count() == 1
+            run_pending()
+        
+        assert client.get('/google/sync').headers['Location'] != first
+    
+    def test_sync_job_renews_lease(self, app, test_user):
+        """Test the sync job extends its lease after each batch."""
+        for i in range(GOOGLE_BATCH_SIZE + 5):
+            db.session.add(Task(title=f'Task {i}', status='pending', user_id=test_user['id'],
+                                due_date=DUE))
+        db.session.commit()
+        service = FakeCalendarService()
+        app.config['GOOGLE_CALENDAR_SERVICE_FACTORY'] = lambda creds: service
+        leases = []
+        
+        def new_batch_http_request(callback=None):
+            leases.append(db.session.execute(select(Job.run_after)).scalar_one())
+            return FakeBatch(service, callback)
+        
+        service.new_batch_http_request = new_batch_http_request
+        enqueue('google_sync', user_id=test_user['id'], payload={'credentials': {'token': 'fake'}})
+        run_pending()
+        assert len(leases) == 2
+        assert leases[1] > leases[0]
@@ -0,0 +1,227 @@
+"""
+Tests for the persistent background job queue
+"""
+import json
+import os
+import pytest
+from datetime import datetime, timedelta
+
+from models import db, Task, Job
+from jobs import (JOB_HANDLERS, LeaseLost, job_handler, enqueue, active_job, claim_next_job, renew_lease,
+                  run_job, run_pending, backoff_delay)
+import ics_export  # registers the ics_export job handler
+
+
+@pytest.fixture
+def flaky_handler():
+    """Register a handler that fails a set number of times before succeeding."""
+    state = {'failures': 0, 'calls': 0}
+
+    @job_handler('test_flaky')
+    def flaky(job, payload):
+        state['calls'] += 1
+        if state['calls'] <= state['failures']:
+            raise RuntimeError('temporary failure')
+        return {'echo': payload.get('value')}
+
+    yield state
+    JOB_HANDLERS.pop('test_flaky', None)
+
+
+class TestJobQueue:
+    """Test cases for enqueueing, claiming and retrying jobs."""
+
+    def test_enqueue_and_run(self, app, test_user, flaky_handler):
+        """Test a queued job runs and records its result."""
+        with app.app_context():
+            job = enqueue('test_flaky', user_id=test_user['id'], payload={'value': 42})
+            assert job.status == 'queued'
+
+            assert run_pending() == 1
+            job = db.session.get(Job, job.id)
+            assert job.status == 'succeeded'
+            assert job.attempts == 1
+            assert json.loads(job.result) == {'echo': 42}
+            assert run_pending() == 0
+
+    def test_unknown_kind_rejected(self, app):
+        """Test enqueueing a job nobody can run fails immediately."""
+        with app.app_context():
+            with pytest.raises(ValueError):
+                enqueue('no_such_job')
+
+    def test_failure_is_retried_with_backoff(self, app, test_user, flaky_handler):
+        """Test a failed job is requeued for later instead of failing outright."""
+        flaky_handler['failures'] = 1
+        with app.app_context():
+            job = enqueue('test_flaky', user_id=test_user['id'])
+            before = datetime.utcnow()
+            assert run_pending() == 1
+
+            job = db.session.get(Job, job.id)
+            assert job.status == 'queued'
+            assert job.attempts == 1
+            assert 'temporary failure' in job.error
+            assert job.run_after >= before + timedelta(seconds=backoff_delay(1))
+            # Not due yet, so nothing runs
+            assert run_pending() == 0
+
+            job.run_after = datetime.utcnow()
+            db.session.commit()
+            assert run_pending() == 1
+            job = db.session.get(Job, job.id)
+            assert job.status == 'succeeded'
+            assert job.attempts == 2
+
+    def test_gives_up_after_max_attempts(self, app, test_user, flaky_handler):
+        """Test a job that keeps failing ends up failed."""
+        flaky_handler['failures'] = 10
+        with app.app_context():
+            job = enqueue('test_flaky', user_id=test_user['id'], max_attempts=2)
+            for _ in range(2):
+                job.run_after = datetime.utcnow()
+                db.session.commit()
+                run_pending()
+                job = db.session.get(Job, job.id)
+            assert job.status == 'failed'
+            assert job.attempts == 2
+            assert flaky_handler['calls'] == 2
+
+    def test_backoff_is_capped(self, app):
+        """Test the retry delay grows exponentially up to JOB_BACKOFF_MAX."""
+        with app.app_context():
+            app.config.update({'JOB_BACKOFF_BASE': 10, 'JOB_BACKOFF_MAX': 100})
+            assert [backoff_delay(n) for n in range(1, 6)] == [10, 20, 40, 80, 100]
+
+    def test_job_claimed_once(self, app, test_user, flaky_handler):
+        """Test a claimed job is leased and not handed to a second worker."""
+        with app.app_context():
+            job = enqueue('test_flaky', user_id=test_user['id'])
+            claimed = claim_next_job()
+            assert claimed.id == job.id
+            assert claimed.status == 'running'
+            assert claim_next_job() is None
+
+            # Once the lease runs out another worker may take it over
+            later = datetime.utcnow() + timedelta(seconds=app.config['JOB_LEASE_SECONDS'] + 1)
+            reclaimed = claim_next_job(now=later)
+            assert reclaimed.id == job.id
+            assert reclaimed.attempts == 2
+
+    def test_expired_last_attempt_failed(self, app, test_user, flaky_handler):
+        """Test a job whose worker died on its last attempt is failed, not run again."""
+        with app.app_context():
+            job = enqueue('test_flaky', user_id=test_user['id'], max_attempts=1,
+                          payload={'credentials': {'token': 'secret'}, 'value': 1})
+            assert claim_next_job().id == job.id
+
+            later = datetime.utcnow() + timedelta(seconds=app.config['JOB_LEASE_SECONDS'] + 1)
+            assert claim_next_job(now=later) is None
+            job = db.session.get(Job, job.id)
+            assert job.status == 'failed'
+            assert job.attempts == 1
+            assert json.loads(job.payload) == {'value': 1}
+            assert flaky_handler['calls'] == 0
+
+    def test_renewed_lease_not_reclaimed(self, app, test_user, flaky_handler):
+        """Test a worker renewing its lease keeps the job past the original expiry."""
+        with app.app_context():
+            job = enqueue('test_flaky', user_id=test_user['id'])
+            claimed = claim_next_job()
+            lease = timedelta(seconds=app.config['JOB_LEASE_SECONDS'])
+            renew_lease(job.id, claimed.attempts, now=datetime.utcnow() + lease / 2)
+            # As seen from another worker's session
+            db.session.expire_all()
+
+            assert claim_next_job(now=datetime.utcnow() + lease + timedelta(seconds=1)) is None
+            assert claim_next_job(now=datetime.utcnow() + lease * 2).id == job.id
+
+    def test_lost_lease_left_to_new_worker(self, app, test_user):
+        """Test a worker whose job was reclaimed stops without touching it."""
+        @job_handler('test_slow')
+        def slow(job, payload):
+            later = datetime.utcnow() + timedelta(seconds=app.config['JOB_LEASE_SECONDS'] + 1)
+            # Another worker takes over while this one is still busy
+            claim_next_job(now=later)
+            renew_lease(job.id, payload['attempt'])
+
+        try:
+            with app.app_context():
+                job = enqueue('test_slow', user_id=test_user['id'], payload={'attempt': 1})
+                job = run_job(claim_next_job())
+                assert (job.status, job.attempts, job.error) == ('running', 2, None)
+                with pytest.raises(LeaseLost):
+                    renew_lease(job.id, 1)
+        finally:
+            JOB_HANDLERS.pop('test_slow', None)
+
+    def test_active_job(self, app, test_user, flaky_handler):
+        """Test only a queued or running job of the kind counts as active."""
+        with app.app_context():
+            assert active_job('test_flaky', test_user['id']) is None
+            job = enqueue('test_flaky', user_id=test_user['id'])
+            assert active_job('test_flaky', test_user['id']).id == job.id
+            run_pending()
+            assert active_job('test_flaky', test_user['id']) is None
+
+    def test_credentials_scrubbed_when_done(self, app, test_user, flaky_handler):
+        """Test secrets in the payload are dropped once the job finishes."""
+        with app.app_context():
+            job = enqueue('test_flaky', user_id=test_user['id'], payload={'credentials': {'token': 'secret'}, 'value': 1})
+            run_job(claim_next_job())
+            job = db.session.get(Job, job.id)
+            assert json.loads(job.payload) == {'value': 1}
+
+
+class TestJobRoutes:
+    """Test cases for job status polling and export downloads."""
+
+    def test_status_requires_owner(self, client, auth, app, test_user, flaky_handler):
+        """Test users can only see their own jobs."""
+        with app.app_context():
+            own = enqueue('test_flaky', user_id=test_user['id']).id
+            other = enqueue('test_flaky').id
+        auth.login()
+
+        response = client.get(f'/jobs/{own}')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'queued'
+        assert client.get(f'/jobs/{other}').status_code == 404
+        assert client.get('/jobs/999999').status_code == 404
+
+    def test_export_job(self, client, auth, app, test_user):
+        """Test the export is written by the worker and downloadable afterwards."""
+        with app.app_context():
+            db.session.add(Task(
+                title='Exported Task', description='', user_id=test_user['id'],
+                due_date=datetime(2030, 1, 15)
+            ))
+            db.session.commit()
+        auth.login()
+
+        response = client.post('/calendar/export/jobs')
+        assert response.status_code == 302
+        job_id = int(response.headers['Location'].split('job=')[1])
+
+        # Not ready until a worker has run it
+        data = client.get(f'/jobs/{job_id}').get_json()
+        assert 'download_url' not in data
+
+        with app.app_context():
+            assert run_pending() == 1
+            assert os.path.exists(ics_export.export_path(job_id))
+
+        data = client.get(f'/jobs/{job_id}').get_json()
+        assert data['status'] == 'succeeded'
+        assert data['result'] == {'events': 1}
+
+        response = client.get(data['download_url'])
+        assert response.status_code == 200
+        assert response.mimetype == 'text/calendar'
+        assert b'SUMMARY:Exported Task' in response.data
+
+        # Another node's worker wrote it, so this server doesn't have the file
+        os.remove(ics_export.export_path(job_id))
+        response = client.get(data['download_url'], follow_redirects=True)
+        assert response.status_code == 200
+        assert b'no longer available' in response.data
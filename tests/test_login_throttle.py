@@ -0,0 +1,139 @@
+"""
+Tests for login throttling
+"""
+import uuid
+import pytest
+
+from __init__ import create_app
+from models import db, LoginWindow
+from login_throttle import MemoryBackend, check_login, record_failed_login, reset_login
+
+
+@pytest.fixture
+def limits(app):
+    """Small limits so tests reach them quickly."""
+    app.config.update({'LOGIN_THROTTLE_PER_USERNAME': 3, 'LOGIN_THROTTLE_PER_IP': 5, 'LOGIN_THROTTLE_WINDOW': 100})
+
+
+def attempt(client, username, password='wrong', ip='10.0.0.1', headers=None):
+    return client.post('/login', data={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': ip}, headers=headers)
+
+
+def fail(username, ip, now):
+    """A wrong password as the login view handles it: checked, then counted unless refused"""
+    wait = check_login(username, ip, now=now)
+    if not wait:
+        record_failed_login(username, ip, now=now)
+    return wait
+
+
+class TestLoginRoute:
+    """Test cases for throttling the login form."""
+
+    @pytest.fixture(autouse=True)
+    def long_window(self, app, limits):
+        """A window the test can't straddle, since these requests run on the real clock."""
+        app.config['LOGIN_THROTTLE_WINDOW'] = 365 * 24 * 3600
+
+    def test_username_limit(self, client, test_user, limits):
+        """Test a username is refused after too many attempts, before any query."""
+        for _ in range(3):
+            assert attempt(client, test_user['username']).status_code == 200
+        response = attempt(client, test_user['username'], password='testpass123')
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) > 0
+        assert response.headers['X-Query-Count'] == '0'
+        assert b'Too many login attempts' in response.data
+
+    def test_ip_limit(self, client, limits):
+        """Test one address can't spread its attempts over many usernames."""
+        for i in range(5):
+            assert attempt(client, f'user{i}').status_code == 200
+        assert attempt(client, 'user9').status_code == 429
+        assert attempt(client, 'user9', ip='10.0.0.2').status_code == 200
+
+    def test_success_clears_username(self, client, test_user, limits):
+        """Test logging in forgets the username's earlier failures."""
+        for _ in range(2):
+            attempt(client, test_user['username'])
+        assert attempt(client, test_user['username'], password='testpass123').status_code == 302
+        client.get('/logout')
+        for _ in range(3):
+            assert attempt(client, test_user['username'], ip='10.0.0.3').status_code == 200
+
+    def test_successes_not_counted(self, client, test_user, limits):
+        """Test many users logging in from one address never lock it."""
+        for _ in range(20):
+            assert attempt(client, test_user['username'], password='testpass123').status_code == 302
+            client.get('/logout')
+        assert attempt(client, 'someone', ip='10.0.0.1').status_code == 200
+
+    def test_forwarded_for(self, app, test_user, limits):
+        """Test clients behind a trusted proxy are told apart by X-Forwarded-For."""
+        proxied = create_app(test_config={**app.config, 'PROXY_FIX_HOPS': 1})
+        client = proxied.test_client()
+        for _ in range(3):
+            attempt(client, test_user['username'], headers={'X-Forwarded-For': '192.0.2.1'})
+        for i in range(3):
+            # The same proxy address, but other clients and usernames
+            response = attempt(client, f'user{i}', headers={'X-Forwarded-For': f'192.0.2.{10 + i}'})
+            assert response.status_code == 200
+        for i in range(2):
+            attempt(client, f'other{i}', headers={'X-Forwarded-For': '192.0.2.1'})
+        assert attempt(client, 'other9', headers={'X-Forwarded-For': '192.0.2.1'}).status_code == 429
+
+    def test_disabled(self, client, app, test_user, limits):
+        """Test limits of 0 turn throttling off."""
+        app.config.update({'LOGIN_THROTTLE_PER_USERNAME': 0, 'LOGIN_THROTTLE_PER_IP': 0})
+        for _ in range(10):
+            assert attempt(client, test_user['username']).status_code == 200
+
+
+class TestSlidingWindow:
+    """Test cases for the sliding window counter."""
+
+    def test_window_slides(self, app, limits):
+        """Test earlier attempts stop counting as the window moves on."""
+        with app.app_context():
+            assert [fail('alice', '10.1.0.1', t) for t in (0, 1, 2)] == [0, 0, 0]
+            # Over the limit until the first window's failures have slid out
+            assert check_login('alice', '10.1.0.1', now=50) == 50
+            # The previous window's 3 failures weigh less than 3 as soon as it starts sliding out
+            assert check_login('alice', '10.1.0.1', now=100) == 1
+            assert check_login('alice', '10.1.0.1', now=101) == 0
+
+    def test_refused_attempts_not_counted(self, app, limits):
+        """Test hammering while throttled doesn't extend the lockout."""
+        with app.app_context():
+            for t in range(0, 90):
+                fail('bob', '10.1.0.2', t)
+            assert check_login('bob', '10.1.0.2', now=140) == 0
+
+    def test_memory_is_bounded(self):
+        """Test the memory backend forgets the quietest keys when full."""
+        backend = MemoryBackend(max_keys=2)
+        for i, key in enumerate(['a', 'b', 'c']):
+            backend.add(key, i * 100, 100)
+        assert backend.counts('a', 200, 100) == (0, 0)
+        assert backend.counts('c', 200, 100) == (1, 0)
+
+
+class TestDatabaseBackend:
+    """Test cases for counts shared through the database."""
+
+    def test_shared_counts(self, app, limits):
+        """Test failures are counted in the table and cleared on reset."""
+        app.config['LOGIN_THROTTLE_BACKEND'] = 'database'
+        username, ip = uuid.uuid4().hex, f'10.2.{uuid.uuid4().int % 250}.1'
+        with app.app_context():
+            assert [fail(username, ip, t) for t in (0, 1, 2)] == [0, 0, 0]
+            assert check_login(username, ip, now=3) == 97
+            assert db.session.get(LoginWindow, (f'user:{username}', 0)).count == 3
+
+            reset_login(username)
+            assert db.session.get(LoginWindow, (f'user:{username}', 0)) is None
+            # The address still remembers its failures
+            assert fail(username, ip, 4) == 0
+            fail(username, ip, 5)
+            assert check_login('someone-else', ip, now=6) == 94
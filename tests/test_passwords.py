@@ -0,0 +1,135 @@
+"""
+Tests for the password hashing service
+"""
+import threading
+import uuid
+import pytest
+from sqlalchemy.exc import DataError
+from werkzeug.security import generate_password_hash
+
+from models import db, User
+import passwords
+
+
+LEGACY_METHOD = 'pbkdf2:sha256:1000'
+
+
+@pytest.fixture
+def legacy_user(app):
+    """A user whose password hash predates the configured method."""
+    with app.app_context():
+        user = User(username=f'legacy_{uuid.uuid4().hex[:8]}', email=f'{uuid.uuid4().hex[:8]}@example.com',
+                    password_hash=generate_password_hash('oldpass123', LEGACY_METHOD))
+        db.session.add(user)
+        db.session.commit()
+        return {'id': user.id, 'username': user.username}
+
+
+@pytest.fixture
+def saturated(app, monkeypatch):
+    """Take every hashing slot, as a login burst would."""
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(passwords, '_slots', slots)
+    app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = 0
+    yield
+    slots.release()
+
+
+class TestHashing:
+    """Test cases for hashing and checking passwords."""
+
+    def test_hash_and_verify(self, app):
+        """Test hashes use the configured method and check correctly."""
+        with app.app_context():
+            password_hash = passwords.hash_password('s3cret')
+            assert password_hash.startswith('scrypt:32768:8:1$')
+            assert passwords.verify_password(password_hash, 's3cret')
+            assert not passwords.verify_password(password_hash, 'wrong')
+            assert not passwords.needs_rehash(password_hash)
+            assert passwords.needs_rehash(generate_password_hash('s3cret', LEGACY_METHOD))
+
+    def test_short_method_names(self, app):
+        """Test a method without explicit cost matches the hashes Werkzeug writes for it."""
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+        with app.app_context():
+            assert not passwords.needs_rehash(passwords.hash_password('s3cret'))
+
+    def test_process_pool(self, app):
+        """Test hashing works in worker processes."""
+        app.config['PASSWORD_HASH_WORKERS'] = 1
+        try:
+            with app.app_context():
+                password_hash = passwords.hash_password('s3cret')
+                assert passwords.verify_password(password_hash, 's3cret')
+        finally:
+            if passwords._pool is not None:
+                passwords._pool.shutdown()
+                passwords._pool = None
+
+    def test_saturated(self, app, saturated):
+        """Test a full queue raises instead of waiting."""
+        with app.app_context():
+            with pytest.raises(passwords.HashingBusy):
+                passwords.hash_password('s3cret')
+
+
+class TestLoginHashing:
+    """Test cases for hashing in the auth views."""
+
+    def test_rehash_on_login(self, client, app, legacy_user):
+        """Test a legacy hash is replaced after a successful login and still works."""
+        response = client.post('/login', data={'username': legacy_user['username'], 'password': 'oldpass123'})
+        assert response.status_code == 302
+        with app.app_context():
+            password_hash = db.session.get(User, legacy_user['id']).password_hash
+            assert password_hash.startswith('scrypt:')
+
+        client.get('/logout')
+        response = client.post('/login', data={'username': legacy_user['username'], 'password': 'oldpass123'})
+        assert response.status_code == 302
+
+    def test_rehash_write_failure_keeps_hash(self, client, app, legacy_user, monkeypatch):
+        """Test a database error storing the new hash still logs the user in with the old one kept."""
+        def too_long(*args, **kwargs):
+            raise DataError('UPDATE "user"', {}, Exception('value too long for type character varying(120)'))
+
+        monkeypatch.setattr(db.session, 'commit', too_long)
+        response = client.post('/login', data={'username': legacy_user['username'], 'password': 'oldpass123'})
+        monkeypatch.undo()
+        assert response.status_code == 302
+        with app.app_context():
+            assert db.session.get(User, legacy_user['id']).password_hash.startswith(LEGACY_METHOD)
+
+    def test_failed_login_keeps_hash(self, client, app, legacy_user):
+        """Test a wrong password doesn't touch the stored hash."""
+        client.post('/login', data={'username': legacy_user['username'], 'password': 'wrong'})
+        with app.app_context():
+            assert db.session.get(User, legacy_user['id']).password_hash.startswith(LEGACY_METHOD)
+
+    def test_login_busy(self, client, test_user, saturated):
+        """Test a saturated pool answers 503 with Retry-After."""
+        response = client.post('/login', data={'username': test_user['username'], 'password': 'testpass123'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+        assert b'server is busy' in response.data
+
+    def test_register_busy(self, client, app, saturated):
+        """Test no account is created while hashing is refused."""
+        response = client.post('/register', data={
+            'username': 'burst', 'email': 'burst@example.com',
+            'password': 'pass12345', 'confirm_password': 'pass12345'
+        })
+        assert response.status_code == 503
+        with app.app_context():
+            assert User.query.filter_by(username='burst').first() is None
+
+
+class TestBenchmark:
+    """Test cases for the hashing benchmark command."""
+
+    def test_command(self, runner):
+        """Test the benchmark reports rates per process and per core."""
+        result = runner.invoke(args=['benchmark-passwords', '--method', LEGACY_METHOD, '--seconds', '0.05', '--workers', '1'])
+        assert result.exit_code == 0
+        assert 'hashes/s per core' in result.output
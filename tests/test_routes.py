@@ -7,6 +7,7 @@ from werkzeug.security import generate_password_hash
 import io
 
 from models import User, Task, Category
+from pagination import encode_cursor
 
 
 class TestAuthRoutes:
@@ -441,4 +442,279 @@ class TestFileUpload:
         }, follow_redirects=True)
         
         # Should still succeed but without the file
-        assert response.status_code == 200 
\ No newline at end of file
+        assert response.status_code == 200 
+
+class TestPagination:
+    """Test cases for keyset pagination of task listings."""
+    
+    def _create_tasks(self, app, user_id, count):
+        """Create count tasks with strictly increasing creation times."""
+        from models import db
+        base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        with app.app_context():
+            for i in range(count):
+                db.session.add(Task(
+                    title=f'Paged Task {i:03d}',
+                    description='Paginated task',
+                    status='pending',
+                    user_id=user_id,
+                    created_at=base + timedelta(minutes=i)
+                ))
+            db.session.commit()
+    
+    def test_dashboard_first_page(self, client, auth, app, test_user):
+        """Test the dashboard only renders one page of tasks."""
+        self._create_tasks(app, test_user['id'], 5)
+        auth.login()
+        response = client.get('/dashboard?per_page=2')
+        assert response.status_code == 200
+        assert b'Paged Task 004' in response.data
+        assert b'Paged Task 003' in response.data
+        assert b'Paged Task 002' not in response.data
+        assert b'Older' in response.data
+    
+    def test_json_pages_walk_forward_and_back(self, client, auth, app, test_user):
+        """Test following next and previous cursors through the JSON variant."""
+        self._create_tasks(app, test_user['id'], 5)
+        auth.login()
+        
+        first = client.get('/dashboard?format=json&per_page=2').get_json()
+        assert [t['title'] for t in first['tasks']] == ['Paged Task 004', 'Paged Task 003']
+        assert first['prev_cursor'] is None
+        
+        second = client.get(first['next_url']).get_json()
+        assert [t['title'] for t in second['tasks']] == ['Paged Task 002', 'Paged Task 001']
+        
+        third = client.get(second['next_url']).get_json()
+        assert [t['title'] for t in third['tasks']] == ['Paged Task 000']
+        assert third['next_cursor'] is None
+        
+        back = client.get(third['prev_url']).get_json()
+        assert [t['title'] for t in back['tasks']] == ['Paged Task 002', 'Paged Task 001']
+        
+        start = client.get(back['prev_url']).get_json()
+        assert [t['title'] for t in start['tasks']] == ['Paged Task 004', 'Paged Task 003']
+        assert start['prev_cursor'] is None
+    
+    def test_search_pagination_keeps_filters(self, client, auth, app, test_user):
+        """Test search cursors keep the query and filters."""
+        self._create_tasks(app, test_user['id'], 3)
+        auth.login()
+        data = client.get('/search?q=Paged&status=pending&format=json&per_page=2').get_json()
+        assert len(data['tasks']) == 2
+        assert 'q=Paged' in data['next_url']
+        assert 'status=pending' in data['next_url']
+    
+    def test_invalid_cursor_returns_first_page(self, client, auth, app, test_user):
+        """Test a malformed cursor falls back to the first page."""
+        self._create_tasks(app, test_user['id'], 2)
+        auth.login()
+        data = client.get('/dashboard?format=json&cursor=not-a-cursor').get_json()
+        assert [t['title'] for t in data['tasks']] == ['Paged Task 001', 'Paged Task 000']
+    
+    def test_mistyped_cursor_returns_first_page(self, client, auth, app, test_user):
+        """Test a well-formed cursor with values of the wrong type falls back to the first page."""
+        self._create_tasks(app, test_user['id'], 2)
+        auth.login()
+        for values in (['2024-01-01T00:00:00', {'a': 1}], ['2024-01-01T00:00:00', '1'], [5, 1]):
+            response = client.get(f'/dashboard?format=json&cursor={encode_cursor(values)}')
+            assert response.status_code == 200
+            assert [t['title'] for t in response.get_json()['tasks']] == ['Paged Task 001', 'Paged Task 000']
+
+
+class TestListingQueryCounts:
+    """Test cases guarding listing pages against N+1 queries."""
+    
+    # Statements a listing page may issue regardless of how many tasks it shows
+    MAX_LISTING_QUERIES = 6
+    
+    def _create_categorised_tasks(self, app, user_id, count=12):
+        """Create tasks spread across several categories."""
+        from models import db
+        with app.app_context():
+            categories = [Category(name=f'Subject {i}', user_id=user_id) for i in range(4)]
+            db.session.add_all(categories)
+            db.session.flush()
+            for i in range(count):
+                db.session.add(Task(
+                    title=f'Counted Task {i}',
+                    description='Query count task',
+                    status='pending',
+                    user_id=user_id,
+                    category_id=categories[i % len(categories)].id
+                ))
+            db.session.commit()
+    
+    @pytest.mark.parametrize('strategy', ['joined', 'selectin'])
+    @pytest.mark.parametrize('url', ['/dashboard', '/search?q=counted'])
+    def test_listing_query_count_is_bounded(self, client, auth, app, test_user, strategy, url):
+        """Test listing pages issue a fixed number of statements."""
+        self._create_categorised_tasks(app, test_user['id'])
+        app.config['TASK_CATEGORY_LOADING'] = strategy
+        auth.login()
+        response = client.get(url)
+        assert response.status_code == 200
+        assert b'Subject 3' in response.data
+        assert int(response.headers['X-Query-Count']) <= self.MAX_LISTING_QUERIES
+
+
+class TestCategoryTaskCounts:
+    """Test cases for SQL-aggregated category task counts."""
+    
+    def _create_tasks(self, app, user_id, category_id, count):
+        from models import db
+        with app.app_context():
+            for i in range(count):
+                db.session.add(Task(title=f'Category Task {i}', description='', status='pending',
+                                    user_id=user_id, category_id=category_id))
+            db.session.commit()
+    
+    def test_categories_page_shows_counts(self, client, auth, app, test_user, test_category):
+        """Test the categories page shows each category's task count."""
+        self._create_tasks(app, test_user['id'], test_category['id'], 3)
+        auth.login()
+        response = client.get('/categories')
+        assert response.status_code == 200
+        assert b'3 tasks' in response.data
+    
+    def test_categories_page_query_count(self, client, auth, app, test_user):
+        """Test the categories page doesn't load each category's tasks."""
+        from models import db
+        with app.app_context():
+            categories = [Category(name=f'Counted {i}', user_id=test_user['id']) for i in range(5)]
+            db.session.add_all(categories)
+            db.session.commit()
+            category_ids = [category.id for category in categories]
+        for category_id in category_ids:
+            self._create_tasks(app, test_user['id'], category_id, 2)
+        auth.login()
+        response = client.get('/categories')
+        assert response.status_code == 200
+        assert int(response.headers['X-Query-Count']) <= 3
+    
+    def test_delete_category_with_tasks_refused(self, client, auth, app, test_user, test_category, test_task):
+        """Test a category that still has tasks can't be deleted."""
+        auth.login()
+        response = client.post(f'/category/{test_category["id"]}/delete', follow_redirects=True)
+        assert b'Cannot delete category that has tasks' in response.data
+        from models import db
+        assert db.session.get(Category, test_category['id']) is not None
+
+
+class TestCalendarEventFeed:
+    """Test cases for the windowed, conditional calendar event feed."""
+    
+    def _create_dated_tasks(self, app, user_id):
+        from models import db
+        with app.app_context():
+            for day in (5, 20, 40):
+                db.session.add(Task(title=f'Due day {day}', description='', status='pending',
+                                    user_id=user_id, due_date=datetime(2024, 1, 1) + timedelta(days=day)))
+            db.session.commit()
+    
+    def test_events_limited_to_window(self, client, auth, app, test_user):
+        """Test only tasks inside the requested range are returned."""
+        self._create_dated_tasks(app, test_user['id'])
+        auth.login()
+        response = client.get('/calendar/events?start=2024-01-15T00:00:00%2B01:00&end=2024-02-01T00:00:00%2B01:00')
+        assert [event['title'] for event in response.get_json()] == ['Due day 20']
+    
+    def test_events_without_window_returns_all(self, client, auth, app, test_user):
+        """Test the feed still returns every dated task without a range."""
+        self._create_dated_tasks(app, test_user['id'])
+        auth.login()
+        assert len(client.get('/calendar/events').get_json()) == 3
+    
+    def test_unchanged_window_returns_304(self, client, auth, app, test_user):
+        """Test revalidating an unchanged window returns Not Modified."""
+        self._create_dated_tasks(app, test_user['id'])
+        auth.login()
+        url = '/calendar/events?start=2024-01-01&end=2024-02-01'
+        first = client.get(url)
+        assert first.status_code == 200
+        assert first.headers['ETag']
+        assert 'Last-Modified' not in first.headers
+        
+        second = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 304
+        assert second.data == b''
+    
+    def test_edit_and_delete_change_etag(self, client, auth, app, test_user):
+        """Test writes inside the window invalidate the ETag."""
+        from models import db
+        self._create_dated_tasks(app, test_user['id'])
+        auth.login()
+        url = '/calendar/events?start=2024-01-01&end=2024-02-01'
+        etag = client.get(url).headers['ETag']
+        
+        task = Task.query.filter_by(user_id=test_user['id'], title='Due day 20').one()
+        task.title = 'Renamed'
+        task.updated_at = datetime.now(timezone.utc) + timedelta(seconds=1)
+        db.session.commit()
+        edited = client.get(url, headers={'If-None-Match': etag})
+        assert edited.status_code == 200
+        assert 'Renamed' in [event['title'] for event in edited.get_json()]
+        
+        db.session.delete(task)
+        db.session.commit()
+        deleted = client.get(url, headers={'If-None-Match': edited.headers['ETag']})
+        assert deleted.status_code == 200
+        assert len(deleted.get_json()) == 1
+    
+    def test_if_modified_since_ignored(self, client, auth, app, test_user):
+        """Test a date validator can't hide a deletion, which leaves the latest edit time unchanged."""
+        from models import db
+        self._create_dated_tasks(app, test_user['id'])
+        auth.login()
+        url = '/calendar/events?start=2024-01-01&end=2024-02-01'
+        client.get(url)
+        
+        task = Task.query.filter_by(user_id=test_user['id'], title='Due day 20').one()
+        db.session.delete(task)
+        db.session.commit()
+        response = client.get(url, headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        assert response.status_code == 200
+        assert len(response.get_json()) == 1
+
+
+class TestCalendarExport:
+    """Test cases for the streaming iCalendar export."""
+    
+    def _create_tasks(self, app, user_id, category_id):
+        from models import db
+        with app.app_context():
+            db.session.add(Task(title='January exam', description='Room 4', status='pending',
+                                priority='High', user_id=user_id, category_id=category_id,
+                                due_date=datetime(2024, 1, 10)))
+            db.session.add(Task(title='March essay', description='', status='pending',
+                                user_id=user_id, due_date=datetime(2024, 3, 10)))
+            db.session.add(Task(title='Undated task', description='', status='pending', user_id=user_id))
+            db.session.commit()
+    
+    def _events(self, response):
+        from icalendar import Calendar
+        cal = Calendar.from_ical(response.get_data())
+        return sorted(str(event['summary']) for event in cal.walk('VEVENT'))
+    
+    def test_export_streams_valid_calendar(self, client, auth, app, test_user, test_category):
+        """Test the export is a streamed, parseable calendar of dated tasks."""
+        self._create_tasks(app, test_user['id'], test_category['id'])
+        auth.login()
+        response = client.get('/calendar/export')
+        assert response.is_streamed
+        assert response.headers['Content-Type'] == 'text/calendar'
+        assert self._events(response) == ['January exam', 'March essay']
+    
+    def test_export_date_range(self, client, auth, app, test_user, test_category):
+        """Test the export honours start and end."""
+        self._create_tasks(app, test_user['id'], test_category['id'])
+        auth.login()
+        response = client.get('/calendar/export?start=2024-03-01&end=2024-04-01')
+        assert self._events(response) == ['March essay']
+    
+    def test_export_category_filter(self, client, auth, app, test_user, test_category):
+        """Test the export can be limited to one category."""
+        self._create_tasks(app, test_user['id'], test_category['id'])
+        auth.login()
+        response = client.get(f'/calendar/export?category={test_category["id"]}')
+        assert self._events(response) == ['January exam']
@@ -0,0 +1,111 @@
+"""
+Tests for full-text task search
+"""
+import base64
+import json
+
+from models import db, Task
+from search import search_terms, apply_search
+
+
+def _search(user_id, query_string):
+    query, rank = apply_search(Task.query.filter_by(user_id=user_id), query_string, user_id)
+    if rank is not None:
+        query = query.order_by(rank)
+    return [task.title for task in query.all()]
+
+
+class TestSearchTerms:
+    """Test cases for query tokenisation."""
+    
+    def test_search_terms_strip_operators(self):
+        """Test FTS syntax characters are dropped from user queries."""
+        assert search_terms('calc* "exam" OR -notes') == ['calc', 'exam', 'OR', 'notes']
+    
+    def test_search_terms_empty(self):
+        """Test empty queries produce no terms."""
+        assert search_terms('') == []
+        assert search_terms(None) == []
+
+
+class TestFullTextSearch:
+    """Test cases for the full-text search index."""
+    
+    def test_backend_created(self, app):
+        """Test the SQLite FTS5 index is set up."""
+        assert app.extensions['task_search'] == 'fts5'
+    
+    def test_prefix_matching(self, app, test_user, add_task):
+        """Test partial words match by prefix."""
+        add_task(test_user['id'], 'Calculus homework')
+        add_task(test_user['id'], 'History essay')
+        assert _search(test_user['id'], 'calc') == ['Calculus homework']
+    
+    def test_title_matches_rank_first(self, app, test_user, add_task):
+        """Test title matches outrank description-only matches."""
+        add_task(test_user['id'], 'Reading list', 'Includes a chapter on algebra')
+        add_task(test_user['id'], 'Algebra worksheet', 'Exercises')
+        assert _search(test_user['id'], 'algebra') == ['Algebra worksheet', 'Reading list']
+    
+    def test_all_terms_required(self, app, test_user, add_task):
+        """Test multi-word queries match tasks containing every word."""
+        add_task(test_user['id'], 'Physics lab report')
+        add_task(test_user['id'], 'Physics reading')
+        assert _search(test_user['id'], 'physics lab') == ['Physics lab report']
+    
+    def test_index_follows_edits_and_deletes(self, app, test_user, add_task):
+        """Test the index stays in sync as tasks change."""
+        task = add_task(test_user['id'], 'Biology quiz')
+        task.title = 'Chemistry quiz'
+        db.session.commit()
+        assert _search(test_user['id'], 'biology') == []
+        assert _search(test_user['id'], 'chemistry') == ['Chemistry quiz']
+        
+        db.session.delete(task)
+        db.session.commit()
+        assert _search(test_user['id'], 'chemistry') == []
+    
+    def test_results_scoped_to_user(self, app, test_user, add_task):
+        """Test search never returns another user's tasks."""
+        add_task(test_user['id'], 'Shared topic')
+        add_task(test_user['id'] + 1000, 'Shared topic elsewhere')
+        assert _search(test_user['id'], 'shared') == ['Shared topic']
+    
+    def test_only_user_matches_ranked(self, app, test_user):
+        """Test the rank subquery is limited to the user's own tasks before the outer join."""
+        query, rank = apply_search(Task.query.filter_by(user_id=test_user['id']), 'shared', test_user['id'])
+        sql = str(query.statement.compile(dialect=db.engine.dialect))
+        assert 'AND task.user_id = ?' in sql.split('AS task_matches')[0]
+    
+    def test_punctuation_only_query_falls_back(self, app, test_user, add_task):
+        """Test queries without words fall back to substring matching."""
+        add_task(test_user['id'], 'C++ project')
+        assert _search(test_user['id'], '++') == ['C++ project']
+    
+    def test_ranked_search_pages(self, client, auth, app, test_user, add_task):
+        """Test ranked search results can be paged with cursors."""
+        add_task(test_user['id'], 'Notes', 'geometry proofs')
+        add_task(test_user['id'], 'Geometry test', 'chapter review')
+        auth.login()
+        first = client.get('/search?q=geometry&format=json&per_page=1').get_json()
+        assert [t['title'] for t in first['tasks']] == ['Geometry test']
+        second = client.get(first['next_url']).get_json()
+        assert [t['title'] for t in second['tasks']] == ['Notes']
+        assert second['next_cursor'] is None
+    
+    def test_ranks_rounded_for_cursors(self, client, auth, app, test_user, add_task):
+        """Test paging one result at a time visits every match once, with cursor ranks at fixed precision."""
+        for i in range(6):
+            add_task(test_user['id'], f'Algebra {i}', 'algebra ' * i + 'worksheet')
+        auth.login()
+        seen = []
+        url = '/search?q=algebra&format=json&per_page=1'
+        while url:
+            data = client.get(url).get_json()
+            seen += [t['title'] for t in data['tasks']]
+            if data['next_cursor']:
+                cursor = data['next_cursor']
+                rank = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))[0]
+                assert rank == round(rank, 6)
+            url = data['next_url']
+        assert sorted(seen) == [f'Algebra {i}' for i in range(6)]
@@ -0,0 +1,158 @@
+"""
+Tests for server-side sessions and the current user loader
+"""
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+from flask import session
+from sqlalchemy import update
+from werkzeug.security import generate_password_hash
+
+from models import db, User, WebSession
+from query_counter import query_count
+from sessions import get_current_user
+
+
+def session_token(client):
+    cookie = client.get_cookie('session')
+    return cookie.value if cookie else None
+
+
+def session_row(app, token):
+    with app.app_context():
+        return db.session.get(WebSession, hashlib.sha256(token.encode()).hexdigest())
+
+
+class TestServerSessions:
+    """Test cases for the database session backend."""
+
+    def test_cookie_holds_only_a_token(self, client, auth, app, test_user):
+        """Test the session data stays in the database, credentials included."""
+        auth.login()
+        with client.session_transaction() as sess:
+            sess['google_credentials'] = {'token': 'secret-token', 'refresh_token': 'secret-refresh'}
+        token = session_token(client)
+        assert len(token) < 64
+        assert 'secret' not in token
+
+        row = session_row(app, token)
+        assert row.user_id == test_user['id']
+        assert 'secret-refresh' in row.data
+        assert client.get('/dashboard').status_code == 200
+
+    def test_login_issues_new_token(self, client, auth, app, test_user):
+        """Test a token planted before login doesn't survive it."""
+        with client.session_transaction() as sess:
+            sess['planted'] = True
+        planted = session_token(client)
+        auth.login()
+        assert session_token(client) != planted
+        assert session_row(app, planted) is None
+
+    def test_logout_removes_row(self, client, auth, app, test_user):
+        """Test logging out deletes the stored session and the cookie."""
+        auth.login()
+        token = session_token(client)
+        auth.logout()
+        assert session_row(app, token) is None
+        assert session_token(client) is None
+
+    def test_unchanged_session_not_rewritten(self, client, auth, app, test_user):
+        """Test plain page views don't write the session until the touch interval passes."""
+        auth.login()
+        token = session_token(client)
+        expires_at = session_row(app, token).expires_at
+        client.get('/dashboard')
+        assert session_row(app, token).expires_at == expires_at
+
+        app.config['SESSION_TOUCH_INTERVAL'] = 0
+        client.get('/dashboard')
+        assert session_row(app, token).expires_at > expires_at
+
+    def test_expired_session_ignored_and_purged(self, client, auth, app, runner, test_user):
+        """Test expired rows don't log anyone in and are removed by purge-sessions."""
+        auth.login()
+        token = session_token(client)
+        with app.app_context():
+            row = session_row(app, token)
+            row.expires_at = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=1)
+            db.session.merge(row)
+            db.session.commit()
+        assert client.get('/dashboard').status_code == 302
+
+        result = runner.invoke(args=['purge-sessions'])
+        assert 'Removed' in result.output
+        assert session_row(app, token) is None
+
+    def test_password_change_ends_other_sessions(self, app, auth, test_user):
+        """Test changing the password logs out other browsers but not this one."""
+        other = app.test_client()
+        other.post('/login', data={'username': test_user['username'], 'password': 'testpass123'})
+        auth.login()
+        auth.client.post('/profile/change-password', data={
+            'current_password': 'testpass123',
+            'new_password': 'newpass456',
+            'confirm_new_password': 'newpass456'
+        })
+        assert other.get('/dashboard').status_code == 302
+        assert auth.client.get('/dashboard').status_code == 200
+
+    def test_cookie_backend(self, app, auth, test_user):
+        """Test Flask's signed cookie sessions can still be chosen."""
+        from flask.sessions import SecureCookieSessionInterface
+        app.session_interface = SecureCookieSessionInterface()
+        auth.login()
+        assert auth.client.get('/dashboard').status_code == 200
+
+
+class TestCurrentUser:
+    """Test cases for loading the logged-in user."""
+
+    def test_loaded_once_per_request(self, app, test_user):
+        """Test repeated lookups in one request reuse the first one."""
+        with app.test_request_context():
+            app.preprocess_request()
+            session['user_id'] = test_user['id']
+            assert get_current_user().username == test_user['username']
+            count = query_count()
+            assert get_current_user().id == test_user['id']
+            assert query_count() == count
+
+    def test_logged_out(self, app):
+        """Test there is no current user without a login."""
+        with app.test_request_context():
+            assert get_current_user() is None
+
+    def test_cached_across_requests(self, app, client, auth, test_user):
+        """Test the user cache skips the SELECT and is dropped when the user changes."""
+        app.config['USER_CACHE_TTL'] = 30
+        for expected_queries in (1, 0):
+            with app.test_request_context():
+                app.preprocess_request()
+                session['user_id'] = test_user['id']
+                assert get_current_user().email == test_user['email']
+                assert query_count() == expected_queries
+
+        email = f'changed_{uuid.uuid4().hex[:8]}@example.com'
+        auth.login()
+        client.post('/profile/update', data={'username': test_user['username'], 'email': email})
+        with app.test_request_context():
+            app.preprocess_request()
+            session['user_id'] = test_user['id']
+            assert get_current_user().email == email
+
+    def test_writers_ignore_cache(self, app, client, auth, test_user):
+        """Test changing the password checks the current hash, not a cached one."""
+        app.config['USER_CACHE_TTL'] = 30
+        auth.login()
+        client.get('/profile')
+        with app.app_context():
+            # Changed by another worker, whose cache invalidation this process never sees
+            with db.engine.begin() as conn:
+                conn.execute(update(User).where(User.id == test_user['id'])
+                             .values(password_hash=generate_password_hash('otherpass1')))
+
+        response = client.post('/profile/change-password', data={
+            'current_password': 'otherpass1', 'new_password': 'newpass123', 'confirm_new_password': 'newpass123'
+        }, follow_redirects=True)
+        assert b'Password changed successfully!' in response.data
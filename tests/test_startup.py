@@ -0,0 +1,55 @@
+"""
+Tests for application start-up cost, measured with python -X importtime
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Needed only by the Google and iCalendar endpoints and jobs
+DEFERRED_MODULES = ('google_auth_oauthlib', 'googleapiclient', 'google.oauth2', 'icalendar')
+
+
+def import_times(code, tmp_path):
+    """Run code in a fresh interpreter and map each imported module to its cumulative import time in µs"""
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'startup.db'}")
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(0, {ROOT!r}); {code}'],
+        cwd=tmp_path, env=env, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartup:
+    """Test cases for what a web worker imports before its first request."""
+
+    def test_heavy_dependencies_deferred(self, tmp_path):
+        """Test creating the app doesn't import the Google client or icalendar, and report the slowest imports."""
+        times = import_times('from __init__ import create_app; create_app()', tmp_path)
+        slowest = sorted(times.items(), key=lambda item: -item[1])[:10]
+        print('\nSlowest imports for create_app (cumulative µs):')
+        for name, cumulative in slowest:
+            print(f'{cumulative:>10}  {name}')
+
+        loaded = [name for name in times if name.split('.')[0] in DEFERRED_MODULES or name in DEFERRED_MODULES]
+        assert loaded == []
+        assert 'routes.calendar' in times
+
+    def test_loaded_when_used(self, tmp_path):
+        """Test the deferred imports still happen when an export needs them."""
+        times = import_times(
+            'from __init__ import create_app; app = create_app()\n'
+            'with app.app_context():\n'
+            '    from ics_export import ics_stream, dated_tasks_query\n'
+            '    next(ics_stream(dated_tasks_query(0, None, None)))',
+            tmp_path
+        )
+        assert 'icalendar' in times
@@ -0,0 +1,89 @@
+"""
+Tests for aggregate task statistics
+"""
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from models import db, Task
+from stats import task_stats, compute_task_stats, invalidate_task_stats
+
+
+class TestTaskStats:
+    """Test cases for the task statistics service."""
+    
+    def test_counts_by_status_priority_and_overdue(self, app, test_user, add_task):
+        """Test a single aggregate returns every count."""
+        past = datetime.now(timezone.utc) - timedelta(days=2)
+        add_task(test_user['id'], status='pending', priority='High', due_date=past)
+        add_task(test_user['id'], status='completed', priority='High', due_date=past)
+        add_task(test_user['id'], status='in_progress', priority='Low')
+        
+        stats = compute_task_stats(test_user['id'])
+        assert stats['total'] == 3
+        assert stats['overdue'] == 1
+        assert stats['by_status'] == {'pending': 1, 'in_progress': 1, 'completed': 1}
+        assert stats['by_priority'] == {'High': 2, 'Medium': 0, 'Low': 1}
+    
+    def test_empty_user(self, app, test_user):
+        """Test a user without tasks gets zeroed statistics."""
+        stats = compute_task_stats(test_user['id'])
+        assert stats['total'] == 0
+        assert stats['by_status']['pending'] == 0
+    
+    def test_cached_until_task_written(self, app, test_user, add_task):
+        """Test statistics are cached and dropped when a task is committed."""
+        app.config['STATS_CACHE_TTL'] = 60
+        invalidate_task_stats(test_user['id'])
+        with patch('stats.compute_task_stats', wraps=compute_task_stats) as compute:
+            assert task_stats(test_user['id'])['total'] == 0
+            assert task_stats(test_user['id'])['total'] == 0
+            assert compute.call_count == 1
+            
+            task = add_task(test_user['id'])
+            assert task_stats(test_user['id'])['total'] == 1
+            assert compute.call_count == 2
+            
+            task.status = 'completed'
+            db.session.commit()
+            assert task_stats(test_user['id'])['by_status']['completed'] == 1
+            assert compute.call_count == 3
+    
+    def test_cache_disabled(self, app, test_user):
+        """Test a zero TTL recomputes every time."""
+        app.config['STATS_CACHE_TTL'] = 0
+        with patch('stats.compute_task_stats', wraps=compute_task_stats) as compute:
+            task_stats(test_user['id'])
+            task_stats(test_user['id'])
+            assert compute.call_count == 2
+    
+    def test_rollback_keeps_cache(self, app, test_user):
+        """Test a rolled back write leaves the cached entry in place."""
+        app.config['STATS_CACHE_TTL'] = 60
+        invalidate_task_stats(test_user['id'])
+        task_stats(test_user['id'])
+        db.session.add(Task(title='Rolled back', user_id=test_user['id']))
+        db.session.flush()
+        db.session.rollback()
+        with patch('stats.compute_task_stats', wraps=compute_task_stats) as compute:
+            assert task_stats(test_user['id'])['total'] == 0
+            assert compute.call_count == 0
+
+
+class TestStatsRoutes:
+    """Test cases for the statistics endpoints."""
+    
+    def test_profile_shows_stats(self, client, auth, test_user, test_task):
+        """Test the profile page renders the aggregated counts."""
+        auth.login()
+        response = client.get('/profile')
+        assert response.status_code == 200
+        assert b'overdue' in response.data
+    
+    def test_stats_json(self, client, auth, test_user, test_task):
+        """Test the JSON statistics endpoint."""
+        auth.login()
+        response = client.get('/profile/stats')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['total'] == 1
+        assert data['by_status']['pending'] == 1
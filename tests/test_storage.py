@@ -0,0 +1,220 @@
+"""
+Tests for the upload storage backends
+"""
+import hashlib
+import io
+import os
+import pytest
+from urllib.parse import urlencode
+
+from models import Task, Attachment
+from storage import LocalStorage, ShardedStorage, S3Storage, create_storage
+from jobs import run_pending
+import blobstore
+
+
+class FakeClientError(Exception):
+    """Stand-in for botocore.exceptions.ClientError."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeS3Client:
+    """In-memory stand-in for an S3-compatible service such as MinIO."""
+
+    def __init__(self):
+        self.objects = {}
+        self.reads = 0
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        parts = []
+        while True:
+            chunk = fileobj.read(8 * 1024)
+            if not chunk:
+                break
+            parts.append(chunk)
+        self.objects[(bucket, key)] = b''.join(parts)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError('NoSuchKey')
+        self.reads += 1
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError('404')
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective):
+        source = (CopySource['Bucket'], CopySource['Key'])
+        if source not in self.objects:
+            raise FakeClientError('NoSuchKey')
+        self.objects[(Bucket, Key)] = self.objects[source]
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix=''):
+                keys = sorted(k for b, k in client.objects if b == Bucket and k.startswith(Prefix))
+                for start in range(0, len(keys), 2):
+                    yield {'Contents': [{'Key': k} for k in keys[start:start + 2]]}
+
+        return Paginator()
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        query = {k: v for k, v in Params.items() if k not in ('Bucket', 'Key')}
+        query['X-Amz-Expires'] = ExpiresIn
+        return f"https://minio.test/{Params['Bucket']}/{Params['Key']}?{urlencode(query)}"
+
+
+@pytest.fixture(params=['local', 'sharded', 's3'])
+def backend(request, tmp_path):
+    """Each storage backend, empty."""
+    if request.param == 'local':
+        return LocalStorage(str(tmp_path))
+    if request.param == 'sharded':
+        return ShardedStorage(str(tmp_path))
+    return S3Storage(FakeS3Client(), 'planner', 'uploads/')
+
+
+@pytest.fixture
+def s3_app(app):
+    """Configure the app to store uploads in the fake S3 service."""
+    client = FakeS3Client()
+    app.config.update({
+        'STORAGE_BACKEND': 's3',
+        'S3_BUCKET': 'planner',
+        'S3_CLIENT_FACTORY': lambda config: client,
+    })
+    app.extensions.pop('storage', None)
+    yield client
+    app.extensions.pop('storage', None)
+
+
+class TestBackends:
+    """Test cases shared by every storage backend."""
+
+    def test_put_open_delete(self, backend):
+        """Test a file can be stored, read back as a stream and removed."""
+        backend.put('abcdef', io.BytesIO(b'x' * 200000))
+        assert backend.exists('abcdef')
+        with backend.open('abcdef') as f:
+            assert f.read() == b'x' * 200000
+
+        backend.delete('abcdef')
+        assert not backend.exists('abcdef')
+        # Deleting twice is harmless
+        backend.delete('abcdef')
+
+    def test_put_file_consumes_staged_file(self, backend, tmp_path):
+        """Test storing a local file takes it out of the staging area."""
+        staged = tmp_path / 'staged'
+        staged.write_bytes(b'lecture')
+        backend.put_file('ab12cd', str(staged))
+        assert not staged.exists()
+        with backend.open('ab12cd') as f:
+            assert f.read() == b'lecture'
+
+    def test_list_by_prefix(self, backend):
+        """Test stored names are listed in order, optionally by prefix."""
+        for name in ('bbbb3', 'aaab2', 'aaaa1.80.webp', 'aaaa1', 'abcd4'):
+            backend.put(name, io.BytesIO(b'data'))
+        assert list(backend.list()) == ['aaaa1', 'aaaa1.80.webp', 'aaab2', 'abcd4', 'bbbb3']
+        assert list(backend.list('aaaa1')) == ['aaaa1', 'aaaa1.80.webp']
+
+    def test_touch(self, backend):
+        """Test touching reports whether the file exists."""
+        backend.put('abcdef', io.BytesIO(b'data'))
+        assert backend.touch('abcdef')
+        assert not backend.touch('missing')
+
+
+class TestShardedLayout:
+    """Test cases for the sharded filesystem backend."""
+
+    def test_files_are_sharded(self, tmp_path):
+        """Test files are spread over two levels of subdirectories."""
+        backend = ShardedStorage(str(tmp_path))
+        backend.put('abcdef', io.BytesIO(b'data'))
+        assert (tmp_path / 'ab' / 'cd' / 'abcdef').read_bytes() == b'data'
+
+    def test_unknown_backend(self, app):
+        """Test a misconfigured STORAGE_BACKEND fails loudly."""
+        with pytest.raises(ValueError):
+            create_storage(dict(app.config, STORAGE_BACKEND='ftp'))
+
+
+class TestS3Uploads:
+    """Test cases for attachments kept in S3-compatible storage."""
+
+    def test_upload_goes_to_bucket(self, client, auth, app, test_user, s3_app):
+        """Test uploads end up in the bucket, not on local disk."""
+        auth.login()
+        client.post('/task/create', data={
+            'title': 'Remote', 'description': '', 'due_date': '',
+            'status': 'pending', 'priority': 'Medium',
+            'file': (io.BytesIO(b'%PDF remote notes'), 'notes.pdf')
+        })
+        sha = hashlib.sha256(b'%PDF remote notes').hexdigest()
+        assert s3_app.objects[('planner', f'uploads/{sha}')] == b'%PDF remote notes'
+        with app.app_context():
+            assert blobstore.blob_path(sha) is None
+            assert not os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], 'tmp'))
+
+    def test_download_redirects_to_presigned_url(self, client, auth, app, test_user, s3_app):
+        """Test downloads are authorized here and then served by the bucket."""
+        auth.login()
+        client.post('/task/create', data={
+            'title': 'Remote', 'description': '', 'due_date': '',
+            'status': 'pending', 'priority': 'Medium',
+            'file': (io.BytesIO(b'%PDF remote notes'), 'notes.pdf')
+        })
+        with app.app_context():
+            key = Attachment.query.join(Task).filter(Task.user_id == test_user['id']).one().key
+
+        response = client.get(f'/uploads/{key}')
+        assert response.status_code == 302
+        location = response.headers['Location']
+        assert location.startswith(f'https://minio.test/planner/uploads/{blobstore.blob_sha(key)}?')
+        assert 'X-Amz-Expires=300' in location
+        assert 'application%2Fpdf' in location
+        assert 'no-store' in response.headers['Cache-Control']
+        assert s3_app.reads == 0
+
+    def test_delete_removes_object(self, client, auth, app, test_user, s3_app):
+        """Test the object is deleted with the last task using it."""
+        auth.login()
+        client.post('/task/create', data={
+            'title': 'Remote', 'description': '', 'due_date': '',
+            'status': 'pending', 'priority': 'Medium',
+            'file': (io.BytesIO(b'%PDF remote notes'), 'notes.pdf')
+        })
+        with app.app_context():
+            task_id = Task.query.filter_by(user_id=test_user['id']).one().id
+        client.post(f'/task/{task_id}/delete')
+        assert s3_app.objects == {}
+
+    def test_thumbnails_rendered_by_job(self, client, auth, app, test_user, s3_app):
+        """Test image thumbnails for remote storage are made by a background job."""
+        Image = pytest.importorskip('PIL.Image')
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (0, 128, 255)).save(buffer, 'PNG')
+        auth.login()
+        client.post('/task/create', data={
+            'title': 'Remote photo', 'description': '', 'due_date': '',
+            'status': 'pending', 'priority': 'Medium',
+            'file': (io.BytesIO(buffer.getvalue()), 'photo.png')
+        })
+        with app.app_context():
+            sha = Attachment.query.join(Task).filter(Task.user_id == test_user['id']).one().sha256
+            assert ('planner', f'uploads/{sha}.80.webp') not in s3_app.objects
+            run_pending()
+        for size in app.config['THUMBNAIL_SIZES']:
+            assert ('planner', f'uploads/{sha}.{size}.webp') in s3_app.objects
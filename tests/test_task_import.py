@@ -0,0 +1,166 @@
+"""
+Tests for importing tasks from CSV and iCalendar files
+"""
+import io
+import pytest
+from datetime import datetime
+
+from models import db, Task, Category
+from task_import import ImportRowError, TaskImporter, iter_csv_rows, iter_ics_rows
+
+
+CSV = b'''\xef\xbb\xbfTitle,Description,Due Date,Status,Priority,Category
+Essay draft,First 1000 words,2026-11-02,pending,High,Literature
+Lab report,,2026-11-05 14:30,in progress,low,Chemistry
+,No title here,2026-11-06,,,
+Reading,Chapter 4,next week,,,
+Revision,,2026-11-09,archived,,
+Poem analysis,,,,,literature
+'''
+
+ICS = b'''BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//Other planner//EN\r
+BEGIN:VEVENT\r
+UID:1@example.com\r
+SUMMARY:Midterm exam\r
+DESCRIPTION:Bring a calculator and a very long list of things that does not\r
+  fit on one line\r
+DTSTART;VALUE=DATE:20261120\r
+CATEGORIES:Maths,Exams\r
+PRIORITY:1\r
+END:VEVENT\r
+BEGIN:VTODO\r
+UID:2@example.com\r
+SUMMARY:Hand in project\r
+DUE:20261201T170000Z\r
+STATUS:COMPLETED\r
+END:VTODO\r
+BEGIN:VEVENT\r
+UID:3@example.com\r
+DTSTART;VALUE=DATE:20261121\r
+END:VEVENT\r
+END:VCALENDAR\r
+'''
+
+
+def user_tasks(app, user_id):
+    with app.app_context():
+        return {task.title: task for task in Task.query.filter_by(user_id=user_id)}
+
+
+class TestCsvImport:
+    """Test cases for CSV files."""
+
+    def test_rows_and_errors(self, app, test_user):
+        """Test valid rows are imported and bad ones are reported without stopping the import."""
+        with app.app_context():
+            report = TaskImporter(test_user['id']).run(iter_csv_rows(io.BytesIO(CSV)))
+        assert report['imported'] == 3
+        assert report['categories_created'] == 2
+        assert [error['line'] for error in report['errors']] == [4, 5, 6]
+        assert 'Missing title' in report['errors'][0]['error']
+        assert 'due date' in report['errors'][1]['error']
+        assert 'status' in report['errors'][2]['error']
+
+        tasks = user_tasks(app, test_user['id'])
+        with app.app_context():
+            essay = db.session.merge(tasks['Essay draft'])
+            lab = db.session.merge(tasks['Lab report'])
+            poem = db.session.merge(tasks['Poem analysis'])
+            assert (essay.priority, essay.status, essay.due_date) == ('High', 'pending', datetime(2026, 11, 2))
+            assert (lab.priority, lab.status, lab.due_date) == ('Low', 'in_progress', datetime(2026, 11, 5, 14, 30))
+            # Category names match case-insensitively, so the poem joins the essay's category
+            assert poem.category_id == essay.category_id
+            assert essay.category.name == 'Literature'
+            assert essay.created_at is not None
+
+    def test_existing_category_reused(self, app, test_user, test_category):
+        """Test rows naming an existing category don't create another one."""
+        data = f"title,category\nWorksheet,{test_category['name']}\n".encode()
+        with app.app_context():
+            report = TaskImporter(test_user['id']).run(iter_csv_rows(io.BytesIO(data)))
+            assert report['categories_created'] == 0
+            assert Category.query.filter_by(user_id=test_user['id']).count() == 1
+        assert user_tasks(app, test_user['id'])['Worksheet'].category_id == test_category['id']
+
+    def test_batches(self, app, test_user):
+        """Test rows are written in chunks of the batch size and the row limit is enforced."""
+        data = b'title\n' + b''.join(b'Task %d\n' % i for i in range(7))
+        with app.app_context():
+            importer = TaskImporter(test_user['id'], batch_size=2, max_rows=5)
+            inserts = []
+            original = importer._flush
+            importer._flush = lambda: (inserts.append(len(importer.pending)), original())
+            report = importer.run(iter_csv_rows(io.BytesIO(data)))
+        assert report['imported'] == 5
+        assert inserts == [2, 2, 1]
+        assert report['errors'] == [{'line': 7, 'error': 'Stopped after 5 rows'}]
+
+    def test_missing_header(self):
+        """Test a file without a title column is refused before any row is read."""
+        with pytest.raises(ImportRowError, match='title column'):
+            iter_csv_rows(io.BytesIO(b'name,when\nEssay,2026-11-02\n'))
+
+
+class TestIcsImport:
+    """Test cases for calendar files."""
+
+    def test_events_and_todos(self, app, test_user):
+        """Test VEVENTs and VTODOs become tasks, with folded lines and categories."""
+        with app.app_context():
+            report = TaskImporter(test_user['id']).run(iter_ics_rows(io.BytesIO(ICS)))
+        assert report['imported'] == 2
+        assert report['errors'] == [{'line': 19, 'error': 'Missing title'}]
+
+        tasks = user_tasks(app, test_user['id'])
+        with app.app_context():
+            exam = db.session.merge(tasks['Midterm exam'])
+            assert exam.description.endswith('does not fit on one line')
+            assert (exam.due_date, exam.priority, exam.category.name) == (datetime(2026, 11, 20), 'High', 'Maths')
+        project = tasks['Hand in project']
+        assert (project.due_date, project.status, project.category_id) == (datetime(2026, 12, 1, 17), 'completed', None)
+
+
+class TestImportRoute:
+    """Test cases for the import page and command."""
+
+    def test_upload_json(self, client, auth, app, test_user):
+        """Test the JSON report and that cached statistics see the new tasks."""
+        auth.login()
+        assert client.get('/profile/stats').get_json()['by_status']['pending'] == 0
+        response = client.post('/tasks/import?format=json', data={'file': (io.BytesIO(CSV), 'tasks.csv')})
+        assert response.status_code == 200
+        assert response.get_json()['imported'] == 3
+        assert response.get_json()['error_count'] == 3
+        assert client.get('/profile/stats').get_json()['by_status']['pending'] == 2
+
+    def test_upload_page(self, client, auth, test_user):
+        """Test the form shows the report and skipped rows."""
+        auth.login()
+        assert client.get('/tasks/import').status_code == 200
+        response = client.post('/tasks/import', data={'file': (io.BytesIO(ICS), 'calendar.ics')})
+        assert b'Imported <strong>2</strong>' in response.data
+        assert b'Missing title' in response.data
+
+    def test_wrong_extension(self, client, auth, test_user):
+        """Test files that are neither CSV nor iCalendar are refused."""
+        auth.login()
+        response = client.post('/tasks/import?format=json', data={'file': (io.BytesIO(b'x'), 'tasks.xlsx')})
+        assert response.status_code == 400
+
+    def test_missing_header(self, client, auth, app, test_user):
+        """Test a CSV file without a title column is a bad request, not an empty report."""
+        auth.login()
+        response = client.post('/tasks/import?format=json', data={'file': (io.BytesIO(b'name,when\nEssay,2026-11-02\n'), 'tasks.csv')})
+        assert response.status_code == 400
+        assert 'title column' in response.get_json()['error']
+        assert user_tasks(app, test_user['id']) == {}
+
+    def test_command(self, app, runner, test_user, tmp_path):
+        """Test the import-tasks command imports a file for the named user."""
+        path = tmp_path / 'tasks.csv'
+        path.write_bytes(CSV)
+        result = runner.invoke(args=['import-tasks', '--user', test_user['username'], str(path)])
+        assert 'Imported 3 tasks, created 2 categories' in result.output
+        assert len(user_tasks(app, test_user['id'])) == 3
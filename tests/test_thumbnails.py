@@ -0,0 +1,97 @@
+"""
+Tests for image attachment thumbnails
+"""
+import io
+import os
+import pytest
+
+from models import Task, Attachment
+import blobstore
+import thumbnails
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def png_bytes(width=1200, height=800):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def image_key(client, auth, app, test_user):
+    """Log in and attach a large PNG to a new task, returning its key."""
+    auth.login()
+    client.post('/task/create', data={
+        'title': 'Photo of the whiteboard',
+        'description': '',
+        'due_date': '',
+        'status': 'pending',
+        'priority': 'Medium',
+        'file': (io.BytesIO(png_bytes()), 'board.png')
+    })
+    with app.app_context():
+        return Attachment.query.join(Task).filter(Task.user_id == test_user['id']).one().key
+
+
+class TestThumbnails:
+    """Test cases for generating and serving thumbnails."""
+
+    def test_generated_on_upload(self, app, image_key):
+        """Test every configured size is rendered when an image is uploaded."""
+        with app.app_context():
+            for size in app.config['THUMBNAIL_SIZES']:
+                path = thumbnails.thumbnail_path(image_key, size)
+                assert path == blobstore.key_path(image_key) + f'.{size}.webp'
+                with Image.open(path) as thumb:
+                    assert thumb.format == 'WEBP'
+                    assert max(thumb.size) == size
+
+    def test_served_as_webp(self, client, app, image_key):
+        """Test the thumbnail route serves a small WebP with a strong ETag."""
+        response = client.get(f'/uploads/{image_key}/thumb/80')
+        assert response.status_code == 200
+        assert response.mimetype == 'image/webp'
+        assert response.headers['ETag'] == f'"{blobstore.blob_sha(image_key)}-80"'
+        assert len(response.data) < len(png_bytes()) / 10
+
+    def test_rendered_on_first_request(self, client, app, image_key):
+        """Test a missing thumbnail is rendered when first asked for, in the process pool."""
+        app.config['THUMBNAIL_WORKERS'] = 1
+        with app.app_context():
+            path = thumbnails.thumbnail_path(image_key, 320)
+        os.remove(path)
+
+        response = client.get(f'/uploads/{image_key}/thumb/320')
+        assert response.status_code == 200
+        assert os.path.exists(path)
+
+    def test_unknown_size_falls_back_to_original(self, client, image_key):
+        """Test sizes that aren't configured redirect to the original."""
+        response = client.get(f'/uploads/{image_key}/thumb/1000')
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith(f'/uploads/{image_key}')
+
+    def test_other_users_cannot_fetch(self, client, auth, app, image_key):
+        """Test thumbnails are only served to the owner."""
+        auth.logout()
+        client.post('/register', data={
+            'username': 'thumbthief', 'email': 'thumbthief@example.com',
+            'password': 'testpass123', 'confirm_password': 'testpass123'
+        })
+        client.post('/login', data={'username': 'thumbthief', 'password': 'testpass123'})
+        assert client.get(f'/uploads/{image_key}/thumb/80').status_code == 404
+
+    def test_removed_with_blob(self, client, app, test_user, image_key):
+        """Test thumbnails go when the last task using the image is deleted."""
+        with app.app_context():
+            task_id = Task.query.filter_by(user_id=test_user['id']).one().id
+            paths = [thumbnails.thumbnail_path(image_key, size) for size in app.config['THUMBNAIL_SIZES']]
+        client.post(f'/task/{task_id}/delete')
+        assert not any(os.path.exists(path) for path in paths)
+
+    def test_dashboard_uses_thumbnails(self, client, image_key):
+        """Test the dashboard links the small thumbnail, not the original."""
+        response = client.get('/dashboard')
+        assert f'/uploads/{image_key}/thumb/80'.encode() in response.data
+        assert f'src="/uploads/{image_key}"'.encode() not in response.data
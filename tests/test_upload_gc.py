@@ -0,0 +1,174 @@
+"""
+Tests for garbage collection of orphaned upload files
+"""
+import hashlib
+import io
+import os
+import time
+import uuid
+import pytest
+from sqlalchemy import update
+
+from models import db, Blob, Job, Attachment
+from storage import get_storage
+from upload_gc import collect_uploads, RateLimiter
+
+
+def store_orphan(content):
+    """Put a blob and a derivative in storage without any row referring to them."""
+    sha = hashlib.sha256(content).hexdigest()
+    backend = get_storage()
+    backend.put(sha, io.BytesIO(content))
+    backend.put(f'{sha}.80.webp', io.BytesIO(b'thumb'))
+    return sha
+
+
+class TestUploadCollector:
+    """Test cases for finding and removing orphaned files."""
+
+    def test_orphans_removed_referenced_kept(self, client, auth, app, test_user, create_task_with_files):
+        """Test only files nothing refers to are deleted."""
+        auth.login()
+        kept = b'%PDF kept ' + os.urandom(16)
+        create_task_with_files('Kept', [(kept, 'notes.pdf')])
+        with app.app_context():
+            kept_sha = hashlib.sha256(kept).hexdigest()
+            orphan_sha = store_orphan(b'orphan ' + os.urandom(16))
+
+            stats = collect_uploads(min_age=0, rate=0)
+
+            backend = get_storage()
+            assert backend.exists(kept_sha)
+            assert not backend.exists(orphan_sha)
+            assert not backend.exists(f'{orphan_sha}.80.webp')
+            assert stats['orphans'] == 2
+            assert stats['removed'] == 2
+
+    def test_recent_files_left_alone(self, app):
+        """Test files younger than GC_MIN_AGE may belong to an upload in progress."""
+        with app.app_context():
+            sha = store_orphan(b'in flight ' + os.urandom(16))
+            stats = collect_uploads(rate=0)
+            assert get_storage().exists(sha)
+            assert stats['orphans'] == 0
+
+    def test_dry_run(self, app):
+        """Test a dry run reports orphans without touching them."""
+        with app.app_context():
+            sha = store_orphan(b'dry ' + os.urandom(16))
+            stats = collect_uploads(dry_run=True, min_age=0, rate=0)
+            assert get_storage().exists(sha)
+            assert stats['orphans'] == 2
+            assert stats['removed'] == 0
+
+    def test_quarantine(self, app):
+        """Test orphans can be moved aside instead of deleted."""
+        content = b'quarantined ' + os.urandom(16)
+        with app.app_context():
+            sha = store_orphan(content)
+            collect_uploads(quarantine=True, min_age=0, rate=0)
+            assert not get_storage().exists(sha)
+
+            quarantine = os.path.join(app.config['UPLOAD_FOLDER'], 'quarantine')
+            [stamp] = os.listdir(quarantine)
+            with open(os.path.join(quarantine, stamp, sha), 'rb') as f:
+                assert f.read() == content
+
+    def test_stale_refcount_fixed(self, client, auth, app, test_user, create_task_with_files):
+        """Test blobs whose tasks vanished without releasing them are collected."""
+        auth.login()
+        content = b'%PDF cascaded ' + os.urandom(16)
+        create_task_with_files('Cascaded', [(content, 'notes.pdf')])
+        sha = hashlib.sha256(content).hexdigest()
+        with app.app_context():
+            # Like a user deleted through the ORM cascade: the rows go, the refcount stays
+            Attachment.query.filter(Attachment.key.startswith(sha)).delete(synchronize_session=False)
+            db.session.commit()
+            assert db.session.get(Blob, sha).refcount == 1
+
+            stats = collect_uploads(min_age=0, rate=0)
+            assert stats['refcounts_fixed'] == 1
+            assert db.session.get(Blob, sha) is None
+            assert not get_storage().exists(sha)
+
+    def test_concurrent_reference_keeps_file(self, client, auth, app, test_user, monkeypatch, create_task_with_files):
+        """Test a blob row that changes before the collector deletes it keeps its file."""
+        auth.login()
+        content = b'%PDF raced ' + os.urandom(16)
+        create_task_with_files('Raced', [(content, 'notes.pdf')])
+        sha = hashlib.sha256(content).hexdigest()
+        with app.app_context():
+            Attachment.query.filter(Attachment.key.startswith(sha)).delete(synchronize_session=False)
+            db.session.commit()
+
+            execute = db.session.execute
+
+            def upload_in_between(statement, *args, **kwargs):
+                # Another request takes a reference after the collector read the count
+                if statement.is_delete and statement.table.name == 'blob':
+                    with db.engine.begin() as conn:
+                        conn.execute(update(Blob).where(Blob.sha256 == sha).values(refcount=2))
+                return execute(statement, *args, **kwargs)
+
+            monkeypatch.setattr(db.session, 'execute', upload_in_between)
+            stats = collect_uploads(min_age=0, rate=0)
+            monkeypatch.undo()
+            assert stats['removed'] == 0
+            assert get_storage().exists(sha)
+            assert db.session.get(Blob, sha).refcount == 2
+
+    def test_legacy_uploads(self, app, test_task):
+        """Test uuid-named uploads from before the blob store are collected too."""
+        folder = app.config['UPLOAD_FOLDER']
+        referenced = f'{uuid.uuid4().hex}_kept.pdf'
+        orphan = f'{uuid.uuid4().hex}_lost.pdf'
+        for name in (referenced, orphan, f'{orphan}.80.webp', 'README'):
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(b'legacy')
+        with app.app_context():
+            db.session.add(Attachment(task_id=test_task['id'], key=referenced, size=6, mime='application/pdf'))
+            db.session.commit()
+
+            collect_uploads(min_age=0, rate=0)
+        assert sorted(n for n in os.listdir(folder) if os.path.isfile(os.path.join(folder, n))) == sorted(['README', referenced])
+
+    def test_abandoned_partial_uploads(self, app):
+        """Test partial files without a live upload session are removed."""
+        partial = os.path.join(app.config['UPLOAD_FOLDER'], 'partial')
+        os.makedirs(partial)
+        with open(os.path.join(partial, uuid.uuid4().hex), 'wb') as f:
+            f.write(b'half a recording')
+        with app.app_context():
+            collect_uploads(min_age=0, rate=0)
+        assert os.listdir(partial) == []
+
+    def test_rate_limit(self, monkeypatch):
+        """Test deletions are spaced out to the configured rate."""
+        sleeps = []
+        monkeypatch.setattr(time, 'sleep', sleeps.append)
+        limiter = RateLimiter(10)
+        for _ in range(3):
+            limiter.wait()
+        # The clock doesn't move while sleep is patched, so each wait is 0.1s longer
+        assert sleeps == pytest.approx([0.1, 0.2], abs=0.01)
+
+
+class TestGcCommand:
+    """Test cases for the gc-uploads command."""
+
+    def test_command(self, app, runner):
+        """Test the command collects orphans and reports what it did."""
+        with app.app_context():
+            app.config['GC_MIN_AGE'] = 0
+            sha = store_orphan(b'command ' + os.urandom(16))
+            result = runner.invoke(args=['gc-uploads', '--rate', '0'])
+            assert 'found 2 orphans' in result.output
+            assert not get_storage().exists(sha)
+
+    def test_background(self, app, runner):
+        """Test the collection can be queued for the job worker."""
+        result = runner.invoke(args=['gc-uploads', '--background', '--dry-run'])
+        assert 'Queued job' in result.output
+        with app.app_context():
+            job = Job.query.one()
+            assert job.kind == 'gc_uploads'
@@ -0,0 +1,203 @@
+"""
+Tests for chunked, resumable uploads
+"""
+import hashlib
+import io
+import os
+import pytest
+
+from models import db, Task, Blob, ChunkedUpload
+import blobstore
+
+
+# An MP4 'ftyp' box, then noise
+RECORDING = b'\x00\x00\x00\x18ftypmp42' + os.urandom(100 * 1024)
+
+
+@pytest.fixture
+def upload(client, auth, app, test_task):
+    """Start an upload session for the test task."""
+    app.config['UPLOAD_CHUNK_SIZE'] = 32 * 1024
+    auth.login()
+    response = client.post('/upload-sessions', json={
+        'task_id': test_task['id'],
+        'filename': 'lecture.mp4',
+        'size': len(RECORDING)
+    })
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def send_chunk(client, upload, offset, data, **headers):
+    return client.put(f"{upload['url']}?offset={offset}", data=data, headers=headers)
+
+
+class ShortReads(io.BytesIO):
+    """A request body that arrives a few bytes per read, like a slow connection."""
+
+    def read(self, size=-1):
+        return super().read(min(size, 3) if size and size > 0 else 3)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class TestChunkedUpload:
+    """Test cases for the upload session API."""
+
+    def test_upload_in_chunks(self, client, app, upload, test_task):
+        """Test a file sent in chunks is attached to the task."""
+        size = upload['chunk_size']
+        for offset in range(0, len(RECORDING), size):
+            response = send_chunk(client, upload, offset, RECORDING[offset:offset + size])
+            assert response.status_code == 200
+            assert response.get_json()['offset'] == min(offset + size, len(RECORDING))
+
+        response = client.post(f"{upload['url']}/complete")
+        assert response.status_code == 200
+        sha = hashlib.sha256(RECORDING).hexdigest()
+        assert response.get_json()['sha256'] == sha
+        assert response.get_json()['filename'] == 'lecture.mp4'
+
+        with app.app_context():
+            assert [a.key for a in db.session.get(Task, test_task['id']).attachments] == [f'{sha}_lecture.mp4']
+            assert db.session.get(Blob, sha).refcount == 1
+            assert db.session.get(ChunkedUpload, upload['id']) is None
+            with open(blobstore.blob_path(sha), 'rb') as f:
+                assert f.read() == RECORDING
+
+    def test_resume_after_wrong_offset(self, client, upload):
+        """Test the server reports where to resume from."""
+        send_chunk(client, upload, 0, RECORDING[:1000])
+
+        response = send_chunk(client, upload, 5000, RECORDING[5000:6000])
+        assert response.status_code == 409
+        assert response.get_json()['offset'] == 1000
+
+        # A lost response means the client resends a chunk that already arrived
+        response = send_chunk(client, upload, 0, RECORDING[:1000])
+        assert response.status_code == 409
+        assert client.get(upload['url']).get_json()['offset'] == 1000
+
+    def test_claimed_offset_refused(self, client, app, upload):
+        """Test a chunk for a range another request has claimed is refused without touching the file."""
+        send_chunk(client, upload, 0, RECORDING[:1000])
+        with app.app_context():
+            # As if another request had just claimed 1000-2000 and is still writing it
+            ChunkedUpload.query.filter_by(id=upload['id']).update({'received': 2000})
+            db.session.commit()
+        response = send_chunk(client, upload, 1000, RECORDING[1000:2000])
+        assert response.status_code == 409
+        assert response.get_json()['offset'] == 2000
+        path = os.path.join(app.config['UPLOAD_FOLDER'], 'partial', upload['id'])
+        assert os.path.getsize(path) == 1000
+
+    def test_unfinished_claim_resumed(self, client, app, upload):
+        """Test a chunk whose writer died is resent from what is on disk."""
+        send_chunk(client, upload, 0, RECORDING[:1000])
+        with app.app_context():
+            ChunkedUpload.query.filter_by(id=upload['id']).update({'received': 2000})
+            db.session.commit()
+        assert client.post(f"{upload['url']}/complete").status_code == 409
+
+        response = send_chunk(client, upload, 2000, RECORDING[2000:3000])
+        assert response.status_code == 409
+        assert response.get_json()['offset'] == 1000
+        assert send_chunk(client, upload, 1000, RECORDING[1000:2000]).status_code == 200
+
+    def test_partial_file_on_another_server(self, client, app, upload):
+        """Test a chunk or completion reaching a server without the partial file is a conflict, not an error."""
+        send_chunk(client, upload, 0, RECORDING[:1000])
+        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], 'partial', upload['id']))
+        response = send_chunk(client, upload, 1000, RECORDING[1000:2000])
+        assert response.status_code == 409
+        assert response.get_json()['offset'] == 1000
+        assert client.get(upload['url']).get_json()['offset'] == 1000
+        assert client.post(f"{upload['url']}/complete").status_code == 409
+
+    def test_sniff_reads_past_short_reads(self, client, upload):
+        """Test the type check sees the whole file head even if the body trickles in."""
+        data = RECORDING[:5000]
+        response = client.put(f"{upload['url']}?offset=0", input_stream=ShortReads(data),
+                              headers={'Content-Length': str(len(data))})
+        assert response.status_code == 200
+        assert response.get_json()['offset'] == 5000
+
+    def test_checksum_mismatch_rejected(self, client, upload):
+        """Test a corrupted chunk is discarded."""
+        response = send_chunk(client, upload, 0, RECORDING[:1000],
+                              **{'X-Chunk-SHA256': hashlib.sha256(b'other').hexdigest()})
+        assert response.status_code == 400
+        assert client.get(upload['url']).get_json()['offset'] == 0
+
+        response = send_chunk(client, upload, 0, RECORDING[:1000],
+                              **{'X-Chunk-SHA256': hashlib.sha256(RECORDING[:1000]).hexdigest()})
+        assert response.status_code == 200
+
+    def test_oversized_chunks_rejected(self, client, upload):
+        """Test chunks larger than allowed or past the declared size are refused."""
+        too_big = b'x' * (upload['chunk_size'] + 1)
+        assert send_chunk(client, upload, 0, too_big).status_code == 413
+
+        # One byte more than is left of the declared size
+        last = len(RECORDING) - 1000
+        for offset in range(0, last, upload['chunk_size']):
+            send_chunk(client, upload, offset, RECORDING[offset:min(offset + upload['chunk_size'], last)])
+        assert send_chunk(client, upload, last, b'x' * 1001).status_code == 413
+        assert send_chunk(client, upload, last, RECORDING[last:]).status_code == 200
+
+    def test_complete_requires_all_bytes(self, client, upload):
+        """Test an incomplete upload cannot be finalized."""
+        send_chunk(client, upload, 0, RECORDING[:1000])
+        response = client.post(f"{upload['url']}/complete")
+        assert response.status_code == 409
+        assert response.get_json()['offset'] == 1000
+
+    def test_cancel(self, client, app, upload):
+        """Test cancelling removes the session and its partial file."""
+        send_chunk(client, upload, 0, RECORDING[:1000])
+        assert client.delete(upload['url']).status_code == 204
+        assert client.get(upload['url']).status_code == 404
+        with app.app_context():
+            assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], 'partial', upload['id']))
+
+    def test_expired_session(self, client, app, upload):
+        """Test idle uploads cannot be resumed after UPLOAD_SESSION_TTL."""
+        app.config['UPLOAD_SESSION_TTL'] = 0
+        assert client.get(upload['url']).status_code == 404
+
+
+class TestChunkedUploadValidation:
+    """Test cases for starting an upload."""
+
+    def test_rejects_other_users_task(self, client, auth, app, test_task):
+        """Test uploads can only target the user's own tasks."""
+        with app.app_context():
+            other = Task(title='Other', description='', user_id=test_task['user_id'] + 1000)
+            db.session.add(other)
+            db.session.commit()
+            other_id = other.id
+        auth.login()
+
+        response = client.post('/upload-sessions', json={'task_id': other_id, 'filename': 'a.pdf', 'size': 10})
+        assert response.status_code == 404
+
+    def test_rejects_bad_type_and_size(self, client, auth, app, test_task):
+        """Test disallowed extensions and sizes are refused up front."""
+        auth.login()
+        response = client.post('/upload-sessions', json={'task_id': test_task['id'], 'filename': 'a.exe', 'size': 10})
+        assert response.status_code == 400
+        response = client.post('/upload-sessions', json={'task_id': test_task['id'], 'filename': 'a.pdf', 'size': 0})
+        assert response.status_code == 400
+        response = client.post('/upload-sessions', json={
+            'task_id': test_task['id'], 'filename': 'a.pdf', 'size': app.config['MAX_UPLOAD_SIZE'] + 1
+        })
+        assert response.status_code == 413
+
+    def test_rejects_mismatched_content(self, client, upload):
+        """Test a first chunk that isn't what the filename says is refused."""
+        response = send_chunk(client, upload, 0, b'MZ\x90\x00\x03\x00\x00\x00' + RECORDING[8:1000])
+        assert response.status_code == 415
+        assert client.get(upload['url']).get_json()['offset'] == 0
@@ -273,4 +273,24 @@ class TestErrorHandling:
                 
                 # Should handle session errors gracefully
                 result = test_function()
-                assert hasattr(result, 'status_code') 
\ No newline at end of file
+                assert hasattr(result, 'status_code') 
+
+class TestQueryCounter:
+    """Test cases for the request-scoped query counter."""
+    
+    def test_counts_statements_in_request(self, app):
+        """Test each statement inside a request is counted."""
+        from models import db, User
+        from query_counter import query_count
+        
+        with app.test_request_context():
+            app.preprocess_request()
+            assert query_count() == 0
+            db.session.execute(db.select(User).limit(1)).all()
+            db.session.execute(db.select(User).limit(1)).all()
+            assert query_count() == 2
+    
+    def test_header_reports_count(self, client):
+        """Test the X-Query-Count header is added to responses."""
+        response = client.get('/')
+        assert response.headers['X-Query-Count'] == '0'
@@ -0,0 +1,151 @@
+"""
+Thumbnails for image attachments
+
+Listings show small WebP derivatives instead of the original images. A
+derivative is stored beside the file it was made from, as
+<name>.<size>.webp in the same storage backend, and is removed together
+with it. Thumbnails are rendered in a process pool, started once an image
+upload is committed, and generated on first request if they are missing.
+With remote storage the upload-time rendering runs as a background job.
+
+Pillow is optional: without it the original image is served instead.
+"""
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+import blobstore
+from jobs import enqueue, job_handler
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_image(key):
+    """Whether a stored file can have thumbnails"""
+    return bool(key) and key.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+
+
+def thumbnail_name(name, size):
+    """Storage name of the thumbnail of a stored file"""
+    return f'{name}.{size}.webp'
+
+
+def thumbnail_path(key, size):
+    """Local path of a file's thumbnail, or None with remote storage"""
+    backend, name = blobstore.locate(key)
+    return backend.local_path(thumbnail_name(name, size))
+
+
+@blobstore.derivative
+def _thumbnail_names(name):
+    return [thumbnail_name(name, size) for size in current_app.config['THUMBNAIL_SIZES']]
+
+
+def render_thumbnail(source, dest, size, quality=80):
+    """Write a WebP thumbnail of source fitting in size x size pixels to dest"""
+    with Image.open(source) as img:
+        # Let the JPEG decoder downscale while decoding instead of loading full resolution
+        img.draft('RGB', (size * 2, size * 2))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        tmp = f'{dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+        img.save(tmp, 'WEBP', quality=quality)
+    os.replace(tmp, dest)
+    return dest
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Created on first use so forked web workers each start their own
+            _pool = ProcessPoolExecutor(max_workers=current_app.config['THUMBNAIL_WORKERS'])
+        return _pool
+
+
+def _run(source, dest, size, wait):
+    quality = current_app.config['THUMBNAIL_QUALITY']
+    if not current_app.config['THUMBNAIL_WORKERS']:
+        render_thumbnail(source, dest, size, quality)
+        return
+    future = _executor().submit(render_thumbnail, source, dest, size, quality)
+    if wait:
+        future.result(timeout=current_app.config['THUMBNAIL_TIMEOUT'])
+
+
+def _render(key, size, wait=True):
+    backend, name = blobstore.locate(key)
+    thumb = thumbnail_name(name, size)
+    source = backend.local_path(name)
+    dest = backend.local_path(thumb)
+    if source and dest:
+        # Local disk: the pool process reads the original and writes the thumbnail in place
+        _run(source, dest, size, wait)
+        return
+
+    # Remote storage: render from a local copy, then upload the result
+    staged_source = blobstore.staging_path()
+    staged_dest = blobstore.staging_path()
+    try:
+        with backend.open(name) as src, open(staged_source, 'wb') as out:
+            shutil.copyfileobj(src, out, blobstore.UPLOAD_CHUNK_SIZE)
+        _run(staged_source, staged_dest, size, wait=True)
+        backend.put_file(thumb, staged_dest)
+    finally:
+        for path in (staged_source, staged_dest):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def schedule_thumbnails(key):
+    """Start rendering every configured thumbnail size of a newly committed image"""
+    if Image is None or not is_image(key):
+        return
+    backend, name = blobstore.locate(key)
+    if backend.local_path(name) is None:
+        enqueue('thumbnails', payload={'key': key})
+        return
+    for size in current_app.config['THUMBNAIL_SIZES']:
+        try:
+            _render(key, size, wait=False)
+        except Exception:
+            # The upload itself is fine; the thumbnail is retried on first request
+            current_app.logger.exception('Thumbnail generation failed for %s', key)
+
+
+@job_handler('thumbnails')
+def thumbnails_job(job, payload):
+    """Render the thumbnails of an image kept in remote storage"""
+    for size in current_app.config['THUMBNAIL_SIZES']:
+        _render(payload['key'], size)
+    return {'sizes': list(current_app.config['THUMBNAIL_SIZES'])}
+
+
+def get_thumbnail(key, size):
+    """(backend, name) of the thumbnail, rendering it now if needed; None if one can't be made"""
+    if Image is None or not is_image(key) or size not in current_app.config['THUMBNAIL_SIZES']:
+        return None
+    backend, name = blobstore.locate(key)
+    thumb = thumbnail_name(name, size)
+    if backend.exists(thumb):
+        return backend, thumb
+    if not backend.exists(name):
+        return None
+
+    try:
+        _render(key, size)
+    except Exception:
+        current_app.logger.exception('Thumbnail generation failed for %s', key)
+        return None
+    return backend, thumb
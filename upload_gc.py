@@ -0,0 +1,210 @@
+"""
+Garbage collection of orphaned upload files
+
+Files can outlive every reference to them: a commit fails after the file
+was stored, a user is deleted through the ORM cascade (which never
+releases blobs), or a chunked upload is abandoned. The collector streams
+the stored names in batches, checks each batch against the database with
+one or two indexed queries and deletes or quarantines what nothing refers
+to. Deletions are rate limited so it can run next to a live server.
+
+Anything younger than GC_MIN_AGE is left alone, since an upload in
+progress stores its file before the row referring to it is committed.
+"""
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import update, delete
+from models import db, Attachment, Blob, ChunkedUpload
+from storage import LocalStorage, get_storage
+from jobs import job_handler
+import blobstore
+
+_BLOB_NAME = re.compile(r'^([0-9a-f]{64})(\..+)?$')
+_LEGACY_NAME = re.compile(r'^[0-9a-f]{32}_')
+_DERIVED_SUFFIX = re.compile(r'\.\d+\.webp$')
+
+
+class RateLimiter:
+    """Spaces out calls to at most rate per second (None for no limit)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self.next_at:
+            time.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+def _batches(names, size):
+    batch = []
+    for name in names:
+        batch.append(name)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class UploadCollector:
+    """One garbage collection pass over the upload storage"""
+
+    def __init__(self, dry_run=False, quarantine=False, rate=None, batch_size=None, min_age=None):
+        config = current_app.config
+        self.dry_run = dry_run
+        self.quarantine = quarantine
+        self.limiter = RateLimiter(config['GC_DELETES_PER_SECOND'] if rate is None else rate)
+        self.batch_size = batch_size or config['GC_BATCH_SIZE']
+        self.cutoff = time.time() - (config['GC_MIN_AGE'] if min_age is None else min_age)
+        self.stats = {'scanned': 0, 'orphans': 0, 'removed': 0, 'refcounts_fixed': 0}
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        self.quarantine_store = LocalStorage(os.path.join(blobstore.upload_folder(), 'quarantine', stamp))
+
+    def run(self):
+        self.collect_blobs()
+        self.collect_legacy()
+        self.collect_staging()
+        return self.stats
+
+    def collect_blobs(self):
+        """Remove blobs (and their derivatives) without a live blob row"""
+        backend = get_storage()
+        for batch in _batches(backend.list(), self.batch_size):
+            self.stats['scanned'] += len(batch)
+            by_sha = {}
+            for name in batch:
+                match = _BLOB_NAME.match(name)
+                if match:
+                    by_sha.setdefault(match.group(1), []).append(name)
+            if not by_sha:
+                continue
+
+            orphans = self._orphan_blobs(sorted(by_sha))
+            # Settle the blob rows before the slow, rate limited deletions
+            db.session.commit()
+            for sha256 in sorted(orphans):
+                for name in by_sha[sha256]:
+                    self._discard(backend, name)
+
+    def _orphan_blobs(self, shas):
+        """The shas in a sorted batch whose files can go, fixing drifted refcounts.
+
+        A file can go when nothing refers to it and its blob row is absent or
+        was deleted here; a row that changed since it was read means a
+        concurrent upload took a reference, so the file stays.
+        """
+        refcounts = dict(db.session.query(Blob.sha256, Blob.refcount).filter(Blob.sha256.in_(shas)))
+        # Keys start with the sha and storage lists names in order, so one
+        # range scan on the key index finds every attachment referring to
+        # any blob in the batch
+        references = {}
+        rows = db.session.query(Attachment.key).filter(
+            Attachment.key >= shas[0], Attachment.key < shas[-1] + '`'
+        )
+        for (key,) in rows:
+            sha256 = blobstore.blob_sha(key)
+            references[sha256] = references.get(sha256, 0) + 1
+
+        orphans = set()
+        for sha256 in shas:
+            actual = references.get(sha256, 0)
+            refcount = refcounts.get(sha256)
+            if refcount is None:
+                if not actual:
+                    orphans.add(sha256)
+                continue
+            if actual == refcount and actual:
+                continue
+            if actual != refcount:
+                self.stats['refcounts_fixed'] += 1
+            if self.dry_run:
+                if not actual:
+                    orphans.add(sha256)
+                continue
+            # Conditional on the count read above, so a concurrent upload wins
+            if actual:
+                db.session.execute(update(Blob).where(
+                    Blob.sha256 == sha256, Blob.refcount == refcount
+                ).values(refcount=actual))
+            elif db.session.execute(delete(Blob).where(
+                Blob.sha256 == sha256, Blob.refcount == refcount
+            )).rowcount:
+                orphans.add(sha256)
+        return orphans
+
+    def collect_legacy(self):
+        """Remove uuid-named uploads from before the blob store that no attachment refers to"""
+        backend = LocalStorage(blobstore.upload_folder())
+        names = (name for name in backend.list() if _LEGACY_NAME.match(name))
+        for batch in _batches(names, self.batch_size):
+            self.stats['scanned'] += len(batch)
+            keys = {_DERIVED_SUFFIX.sub('', name) for name in batch}
+            referenced = {key for (key,) in db.session.query(Attachment.key).filter(Attachment.key.in_(keys))}
+            for name in batch:
+                if _DERIVED_SUFFIX.sub('', name) not in referenced:
+                    self._discard(backend, name)
+
+    def collect_staging(self):
+        """Remove stale staging files and abandoned chunked uploads"""
+        root = blobstore.upload_folder()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        expired_before = now - timedelta(seconds=current_app.config['UPLOAD_SESSION_TTL'])
+        if not self.dry_run:
+            db.session.execute(delete(ChunkedUpload).where(ChunkedUpload.updated_at < expired_before))
+            db.session.commit()
+
+        staging = LocalStorage(os.path.join(root, 'tmp'))
+        for name in staging.list():
+            self.stats['scanned'] += 1
+            self._discard(staging, name, quarantine=False)
+
+        partial = LocalStorage(os.path.join(root, 'partial'))
+        for batch in _batches(partial.list(), self.batch_size):
+            self.stats['scanned'] += len(batch)
+            active = {upload_id for (upload_id,) in db.session.query(ChunkedUpload.id).filter(ChunkedUpload.id.in_(batch))}
+            for name in batch:
+                if name not in active:
+                    self._discard(partial, name, quarantine=False)
+
+    def _discard(self, backend, name, quarantine=None):
+        if backend.modified(name) > self.cutoff:
+            return
+        self.stats['orphans'] += 1
+        if self.dry_run:
+            return
+        self.limiter.wait()
+        if self.quarantine if quarantine is None else quarantine:
+            path = backend.local_path(name)
+            if path:
+                dest = self.quarantine_store.path(name)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(path, dest)
+            else:
+                with backend.open(name) as f:
+                    self.quarantine_store.put(name, f)
+                backend.delete(name)
+        else:
+            backend.delete(name)
+        self.stats['removed'] += 1
+
+
+def collect_uploads(**options):
+    """Run one garbage collection pass, returning counts of what was found and removed"""
+    return UploadCollector(**options).run()
+
+
+@job_handler('gc_uploads')
+def gc_uploads_job(job, payload):
+    """Background garbage collection pass"""
+    return collect_uploads(
+        dry_run=payload.get('dry_run', False),
+        quarantine=payload.get('quarantine', False)
+    )